@@ -4,122 +4,56 @@ import sqlite3
 import time
 import logging  
 
-from routes import routes
+from routes import routes, match_route, method_allowed
 from mimes import get_mime
-from views import NotFoundView, InternalServerErrorView  
-from utils.db_utils import get_db_cursor
+from views import View, NotFoundView, InternalServerErrorView  
+from utils.db_utils import get_db_connection, check_storage
+from utils.migrations import migrate
+from utils.group_commit import GROUP_COMMIT_ENABLED, start_group_commit
+from utils.bus import BUS_SOCKET_DIR, start_bus_transport
+from models.session import start_session_sweeper
+from models.blob_store import blob_store, start_blob_collector
+from utils.pswd_utils import start_hashing_pool
 
 
 # Создание таблиц в базе данных
 def initialize_database():
-    # Папка для хранения файлов
-    os.makedirs('static/uploads', exist_ok=True)
-
     """
-    Инициализирует базу данных, создавая необходимые таблицы, если они не существуют.
+    Инициализирует базу данных: применяет недостающие миграции схемы
+    и проверяет настройки хранилища.
     """
-    with get_db_cursor() as cursor:
-        # Таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL,
-                password TEXT NOT NULL, 
-                UNIQUE (username)
-            )
-        ''')
-
-        # Таблица групп
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS groups (
-                group_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                creator_id INTEGER,
-                created_at INTEGER,
-                FOREIGN KEY(creator_id) REFERENCES users(user_id)
-            )
-        ''')
-
-        # Таблица Вложений
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS attachments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                message_type TEXT NOT NULL,
-                message_id INTEGER NOT NULL,
-                file_path TEXT NOT NULL,
-                mime_type TEXT NOT NULL,
-                filename TEXT NOT NULL
-            )               
-        ''')
-
-        # Создание общего чата, если он не существует
-        cursor.execute('SELECT group_id FROM groups WHERE name = "Общий чат"')
-        group_row = cursor.fetchone()
-        if not group_row:
-            cursor.execute('''
-                INSERT INTO groups (group_id, name, creator_id, created_at)
-                VALUES (0, 'Общий чат', 0, ?)
-            ''', (int(time.time()),))
-
-        # Таблица участников групп
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS group_members (
-                group_id INTEGER,
-                user_id INTEGER,
-                role TEXT CHECK(role IN ('owner', 'admin', 'member')),
-                joined_at INTEGER,
-                UNIQUE (group_id, user_id),
-                FOREIGN KEY(group_id) REFERENCES groups(group_id),
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        ''')
-
-        # Таблица сообщений групп
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS group_messages (
-                message_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                group_id INTEGER,
-                user_id INTEGER,
-                message_text TEXT,
-                timestamp INTEGER
-            )
-        ''')
-
-        #Таблица личных сообщений
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS private_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender_id INTEGER NOT NULL,
-                receiver_id INTEGER NOT NULL,
-                message_text TEXT NOT NULL,
-                timestamp INTEGER NOT NULL,
-                FOREIGN KEY(sender_id) REFERENCES users(id),
-                FOREIGN KEY(receiver_id) REFERENCES users(id)
-            )
-        ''')
-
-        #Таблица сессий
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS session (
-                id TEXT PRIMARY KEY,
-                key TEXT NOT NULL)               
-        ''')
-        
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_private_messages_text_nocase 
-            ON private_messages(message_text COLLATE NOCASE)
-        ''')
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_group_messages_text_nocase 
-            ON group_messages(message_text COLLATE NOCASE)
-        ''')
-
-        # Фиксируем изменения в базе данных
-        cursor.connection.commit()
+    # Папка для хранения файлов
+    os.makedirs(blob_store.temp_dir, exist_ok=True)
+
+    # Проверяем режим журнала и соединения писателя/читателей
+    check_storage()
+
+    with get_db_connection() as conn:
+        migrate(conn)
+
+    # Файлы, загруженные до появления хранилища по содержимому
+    blob_store.import_legacy_uploads()
 
 # Инициализация базы данных при запуске приложения
 initialize_database()
 
+# Процессы bcrypt запускаются до фоновых потоков
+start_hashing_pool()
+
+# Групповая фиксация вставок сообщений (MESSENGER_GROUP_COMMIT=1)
+if GROUP_COMMIT_ENABLED:
+    start_group_commit()
+
+# Обмен событиями чатов с другими процессами (MESSENGER_BUS_SOCKET_DIR)
+if BUS_SOCKET_DIR:
+    start_bus_transport(BUS_SOCKET_DIR)
+
+# Фоновое удаление просроченных сессий
+start_session_sweeper()
+
+# Фоновое удаление файлов, на которые не ссылается ни одно вложение
+start_blob_collector()
+
 def load(file_name):
     """
     Загружает содержимое файла.
@@ -133,17 +67,7 @@ def load(file_name):
 
 def serve_static(environ, start_response):
     """Обработка статических файлов."""
-    file_path = environ['REQUEST_URI'][1:]
-    if not os.path.exists(file_path):
-        start_response('404 Not Found', [('Content-Type', 'text/plain')])
-        return [b'File not found']
-    
-    with open(file_path, 'rb') as f:
-        data = f.read()
-    
-    mime_type = get_mime(file_path)
-    start_response('200 OK', [('Content-Type', mime_type)])
-    return [data]
+    return View(environ['PATH_INFO']).response(environ, start_response)
 
 def app(environ, start_response):
     """
@@ -155,25 +79,30 @@ def app(environ, start_response):
     """
 
     url = environ['PATH_INFO']
-    view = None
-    matched_key = None  
+    method = environ.get('REQUEST_METHOD', 'GET')
         
     try:
-        for key in routes.keys():
-            if re.match(key, url):
-                view = routes[key](url)
-                matched_key = key 
-                break
-
-        if not view:
+        view_class, url_params = match_route(url)
+        if view_class and not method_allowed(view_class, method):
+            allowed = ', '.join(view_class.methods + (('HEAD',) if 'GET' in view_class.methods else ()))
+            start_response('405 Method Not Allowed', [
+                ('Content-Type', 'application/json'),
+                ('Allow', allowed),
+            ])
+            return [b'{"error": "Method Not Allowed"}']
+        if view_class:
+            view = view_class(url)
+            environ['url_params'] = url_params
+        else:
             view = NotFoundView(url)
 
-        if matched_key:
-            match = re.match(matched_key, url)
-            if match:
-                environ['url_params'] = match.groups()
-
-        return view.response(environ, start_response)
+        result = view.response(environ, start_response)
+        if method == 'HEAD':
+            # Заголовки те же, что у GET, тело не передаётся
+            if hasattr(result, 'close'):
+                result.close()
+            return []
+        return result
         
     except Exception as e:
         logging.error(f"Server error: {str(e)}", exc_info=True)
@@ -0,0 +1,433 @@
+import os
+import sys
+import json
+import asyncio
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode
+
+from app import app as wsgi_app
+from routes import match_route, method_allowed
+from models.session import stop_session_sweeper
+from models.blob_store import stop_blob_collector
+from utils.pswd_utils import stop_hashing_pool
+from utils import multipart
+from utils import (
+    chat_version, wait_for_chats_async, subscribe_events, stop_group_commit,
+    stop_bus_transport
+)
+from views.events import EVENTS_HEARTBEAT, EVENTS_LIFETIME, EVENTS_RETRY_MS
+from views.message import parse_wait
+
+# Режим ASGI: uvicorn asgi:application
+#
+# Обычные представления - синхронный WSGI-код с SQLite - выполняются в
+# ограниченном пуле потоков, хеширование паролей bcrypt - в отдельном
+# небольшом пуле, чтобы вход пользователей не занимал потоки базы.
+# Поток событий /events и долгий опрос (wait=N) ждут как корутины и
+# не занимают потоков, поэтому тысячи открытых соединений обходятся
+# одним процессом.
+ASGI_DB_WORKERS = int(os.environ.get('MESSENGER_ASGI_DB_WORKERS', 16))
+ASGI_CPU_WORKERS = int(os.environ.get('MESSENGER_ASGI_CPU_WORKERS', 2))
+# Сколько задач может ждать в очереди пула на один поток
+ASGI_QUEUE_FACTOR = 4
+# Тело запроса до этого размера держится в памяти, больше - во временном файле
+ASGI_SPOOL_SIZE = 1024 * 1024
+
+
+class BoundedExecutor:
+    """
+    Пул потоков с ограниченной очередью: не больше workers * queue_factor
+    задач одновременно, остальные корутины ждут своей очереди.
+    """
+
+    def __init__(self, workers, name, queue_factor=ASGI_QUEUE_FACTOR):
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        self.limit = workers * queue_factor
+        self._slots = None
+        self._loop = None
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        # Семафор привязан к циклу событий, в котором создан
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.limit)
+        async with self._slots:
+            return await loop.run_in_executor(self._pool, func, *args)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+db_executor = BoundedExecutor(ASGI_DB_WORKERS, 'asgi-db')
+cpu_executor = BoundedExecutor(ASGI_CPU_WORKERS, 'asgi-cpu')
+
+
+def build_environ(scope, body, length):
+    """
+    Строит WSGI environ из HTTP scope ASGI и тела запроса (файлового
+    объекта с length байтами).
+    """
+    query_string = scope.get('query_string', b'').decode('latin-1')
+    path = scope['path']
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'REQUEST_URI': path + ('?' + query_string if query_string else ''),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0] if client else '',
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name
+        if key in environ:
+            separator = '; ' if key == 'HTTP_COOKIE' else ','
+            value = environ[key] + separator + value
+        environ[key] = value
+    return environ
+
+
+def run_wsgi(environ):
+    """
+    Выполняет WSGI-приложение и возвращает (статус, заголовки, тело).
+    Тело собирается целиком: так читается короткий JSON долгого опроса.
+    """
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+        captured['headers'] = headers
+
+    result = wsgi_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return captured['status'], captured['headers'], body
+
+
+def response_start(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': int(status.split()[0]),
+        'headers': [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers
+        ],
+    }
+
+
+def stream_wsgi(environ, send, loop):
+    """
+    Выполняет WSGI-приложение в потоке пула и отправляет ответ по частям,
+    не собирая тело целиком: каждая часть результата уходит отдельным
+    сообщением с more_body=True. Поток ждёт отправки каждой части, поэтому
+    медленный клиент не заставляет копить ответ в памяти.
+    """
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+        captured['headers'] = headers
+
+    def emit(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    result = wsgi_app(environ, start_response)
+    try:
+        started = False
+        for chunk in result:
+            if not chunk:
+                continue
+            if not started:
+                # Заголовки уходят вместе с первой непустой частью
+                emit(response_start(captured['status'], captured['headers']))
+                started = True
+            emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not started:
+            emit(response_start(captured['status'], captured['headers']))
+        emit({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+async def send_response(send, status, headers, body):
+    await send(response_start(status, headers))
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def content_length(scope):
+    """
+    Возвращает Content-Length из заголовков запроса или None.
+    """
+    for name, value in scope.get('headers', []):
+        if name.lower() == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def read_body(receive, limit):
+    """
+    Читает тело запроса в SpooledTemporaryFile: до ASGI_SPOOL_SIZE байт
+    оно остаётся в памяти, большее уходит во временный файл.
+
+    :return: Пара (файл, размер) или None, если клиент отключился.
+    :raises UploadTooLarge: Тело больше limit байт (без Content-Length
+        или с неверным Content-Length).
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=ASGI_SPOOL_SIZE)
+    size = 0
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > limit:
+                raise multipart.UploadTooLarge()
+            body.write(chunk)
+            if not message.get('more_body', False):
+                break
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return body, size
+
+
+def has_messages(result):
+    """
+    Проверяет, вернул ли ответ долгого опроса новые сообщения.
+    Ошибки и неожиданные ответы считаются результатом и не ждут.
+    """
+    status, headers, body = result
+    if not status.startswith('200'):
+        return True
+    try:
+        return bool(json.loads(body.decode('utf-8')).get('messages'))
+    except (ValueError, AttributeError):
+        return True
+
+
+async def serve_long_poll(view, environ, wait, chats):
+    """
+    Долгий опрос без потока: чтение идёт в пуле, ожидание - в корутине.
+    """
+    query = parse_qs(environ['QUERY_STRING'], keep_blank_values=True)
+    query.pop('wait', None)
+    environ['QUERY_STRING'] = urlencode(query, doseq=True)
+
+    versions = chat_version(*chats)
+    result = await db_executor.run(run_wsgi, dict(environ))
+    if not has_messages(result) and await wait_for_chats_async(chats, versions, wait):
+        result = await db_executor.run(run_wsgi, dict(environ))
+    return result
+
+
+async def serve_events(view, environ, receive, send):
+    """
+    Поток /events как корутина: кадры берутся из подписки EventHub,
+    ожидание событий не занимает поток.
+    """
+    keys = await db_executor.run(view.event_keys, environ)
+    if keys is None:
+        await send_response(send, '403 Forbidden', [('Content-Type', 'text/plain')], b'Access denied')
+        return
+
+    subscription = subscribe_events(keys, native=True)
+    if subscription is None:
+        await send_response(
+            send, '503 Service Unavailable',
+            [('Content-Type', 'application/json'), ('Retry-After', '30')],
+            b'{"error": "Too many event streams"}'
+        )
+        return
+
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+
+    def listener():
+        try:
+            loop.call_soon_threadsafe(ready.set)
+        except RuntimeError:
+            # Цикл событий уже закрыт
+            pass
+
+    subscription.listener = listener
+
+    async def wait_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    disconnect = asyncio.ensure_future(wait_disconnect())
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': f'retry: {EVENTS_RETRY_MS}\nevent: ready\ndata: {{}}\n\n'.encode('utf-8'),
+            'more_body': True,
+        })
+
+        deadline = loop.time() + EVENTS_LIFETIME
+        while not disconnect.done():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            ready.clear()
+            frame = subscription.get(0)
+            if frame is None and subscription.ended:
+                break
+            if frame is None:
+                woken = asyncio.ensure_future(ready.wait())
+                done, _ = await asyncio.wait(
+                    {woken, disconnect},
+                    timeout=min(EVENTS_HEARTBEAT, remaining),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                woken.cancel()
+                if done:
+                    continue
+                frame = b': ping\n\n'
+            await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+
+        if not disconnect.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        subscription.listener = None
+        subscription.close()
+        disconnect.cancel()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            stop_group_commit()
+            stop_bus_transport()
+            stop_session_sweeper()
+            stop_blob_collector()
+            stop_hashing_pool()
+            db_executor.shutdown()
+            cpu_executor.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """
+    ASGI-приложение поверх тех же маршрутов и представлений, что и WSGI app.
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    started = False
+    original_send = send
+    body = None
+
+    async def send(message):
+        nonlocal started
+        if message['type'] == 'http.response.start':
+            started = True
+        await original_send(message)
+
+    try:
+        # Предел читается при каждом запросе, как и в parse_multipart
+        limit = multipart.MAX_UPLOAD_SIZE
+        length = content_length(scope)
+        try:
+            if length is not None and length > limit:
+                # Отказ до чтения тела
+                raise multipart.UploadTooLarge()
+            request = await read_body(receive, limit)
+        except multipart.UploadTooLarge:
+            await send_response(
+                send, '413 Payload Too Large',
+                [('Content-Type', 'application/json')],
+                json.dumps({'error': 'Файл слишком большой'}).encode('utf-8')
+            )
+            return
+        if request is None:
+            return
+        body, length = request
+        environ = build_environ(scope, body, length)
+        view_class, url_params = match_route(scope['path'])
+        view = view_class(scope['path']) if view_class else None
+        if view is not None and (scope['method'] == 'HEAD' or not method_allowed(view_class, scope['method'])):
+            # Ответ 405 и HEAD без тела формирует WSGI-приложение
+            view = None
+
+        if view is not None and getattr(view, 'streaming', False):
+            environ['url_params'] = url_params
+            await serve_events(view, environ, receive, send)
+            return
+
+        if view is not None and hasattr(view, 'long_poll_chats'):
+            query = parse_qs(environ['QUERY_STRING'])
+            try:
+                wait = parse_wait(query.get('wait', ['0'])[0])
+            except ValueError:
+                # Ошибку параметра вернёт само представление
+                wait = 0
+            chats = view.long_poll_chats(environ) if wait else None
+            if chats:
+                result = await serve_long_poll(view, environ, wait, chats)
+                await send_response(send, *result)
+                return
+
+        executor = cpu_executor if getattr(view, 'cpu_bound', False) else db_executor
+        await executor.run(stream_wsgi, environ, send, asyncio.get_running_loop())
+
+    except Exception as e:
+        logging.error(f"ASGI error: {str(e)}", exc_info=True)
+        if started:
+            return
+        await send_response(
+            send, '500 Internal Server Error',
+            [('Content-Type', 'application/json')],
+            b'{"error": "Internal server error"}'
+        )
+    finally:
+        if body is not None:
+            body.close()
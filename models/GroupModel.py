@@ -3,7 +3,10 @@ import logging
 from werkzeug.utils import secure_filename
 from collections import defaultdict
 from contextlib import contextmanager
-from utils import get_db_cursor
+from typing import Optional
+from utils import get_db_cursor, get_read_cursor, publish_event
+from .message_cache import recent_messages
+from .group_cache import group_access
 from datetime import datetime
 
 class GroupModel:
@@ -27,7 +30,9 @@ class GroupModel:
                 ''', (group_id, creator_id, 'owner', timestamp))
                 
                 cursor.connection.commit()
-                return {'status': 'success', 'group_id': group_id}
+            group_access.set_role(creator_id, group_id, 'owner')
+            GroupModel.publish_change('create', group_id, creator_id, name=name)
+            return {'status': 'success', 'group_id': group_id}
         except sqlite3.IntegrityError:
             return {'error': 'Группа с таким именем уже существует'}
         except Exception as e:
@@ -37,7 +42,7 @@ class GroupModel:
     @staticmethod
     def get_user_groups(user_id: int) -> list:
         """Получает группы пользователя"""
-        with get_db_cursor() as cursor:
+        with get_read_cursor() as cursor:
             cursor.execute('''
                 SELECT g.group_id, g.name, gm.role
                 FROM groups g
@@ -51,15 +56,46 @@ class GroupModel:
                 'role': row[2]
             } for row in cursor.fetchall()]
 
+    @staticmethod
+    def get_user_roles(user_id: int) -> dict:
+        """
+        Роли пользователя во всех его группах: {group_id: role}.
+        Берутся из кеша, при промахе читаются одним запросом.
+        """
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return {}
+        roles = group_access.get(user_id)
+        if roles is None:
+            version = group_access.version(user_id)
+            with get_read_cursor() as cursor:
+                cursor.execute('''
+                    SELECT group_id, role FROM group_members
+                    WHERE user_id = ?
+                ''', (user_id,))
+                roles = {row[0]: row[1] for row in cursor.fetchall()}
+            group_access.fill(user_id, version, roles)
+        return roles
+
+    @staticmethod
+    def get_user_group_ids(user_id: int) -> set:
+        """Множество id групп, в которых состоит пользователь"""
+        return set(GroupModel.get_user_roles(user_id))
+
+    @staticmethod
+    def get_role(group_id: int, user_id: int) -> Optional[str]:
+        """Роль пользователя в группе или None, если он не участник"""
+        try:
+            group_id = int(group_id)
+        except (TypeError, ValueError):
+            return None
+        return GroupModel.get_user_roles(user_id).get(group_id)
+
     @staticmethod
     def check_group_access(group_id: int, user_id: int) -> bool:
         """Проверяет доступ пользователя к группе"""
-        with get_db_cursor() as cursor:
-            cursor.execute('''
-                SELECT 1 FROM group_members 
-                WHERE group_id = ? AND user_id = ?
-            ''', (group_id, user_id))
-            return cursor.fetchone() is not None
+        return GroupModel.get_role(group_id, user_id) is not None
         
     @staticmethod
     def add_member(group_id: int, user_id: int, role: str = 'member') -> dict:
@@ -76,11 +112,7 @@ class GroupModel:
                     return {'error': 'Group not found'}
                 
                 # Проверяем, есть ли уже пользователь в группе
-                cursor.execute('''
-                    SELECT 1 FROM group_members 
-                    WHERE group_id = ? AND user_id = ?
-                    ''', (group_id, user_id))
-                if cursor.fetchone():
+                if GroupModel.get_role(group_id, user_id) is not None:
                     return {'error': 'Пользователь уже состоит в группе'}
                 
                 # Добавляем участника
@@ -91,7 +123,9 @@ class GroupModel:
                 ''', (group_id, user_id, role, timestamp))
                 
                 cursor.connection.commit()
-                return {'status': 'success'}
+            group_access.set_role(user_id, group_id, role)
+            GroupModel.publish_change('member_add', group_id, user_id, role=role)
+            return {'status': 'success'}
                 
         except sqlite3.IntegrityError:
             return {'error': 'User already in group'}
@@ -108,34 +142,19 @@ class GroupModel:
         try:
             with get_db_cursor() as cursor:
                 # Проверяем права удаляющего
-                cursor.execute('''
-                    SELECT role FROM group_members 
-                    WHERE group_id = ? AND user_id = ?
-                ''', (group_id, remover_id))
-                remover_role = cursor.fetchone()
+                remover_role = GroupModel.get_role(group_id, remover_id)
                 
-                if not remover_role or remover_role[0] not in ('owner', 'admin'):
+                if remover_role not in ('owner', 'admin'):
                     return {'error': 'Недостаточно прав'}
                 
-                # Проверяем роль удаляемого
-                cursor.execute('''
-                    SELECT role FROM group_members 
-                    WHERE group_id = ? AND user_id = ?
-                ''', (group_id, user_id))
-                target_role = cursor.fetchone()
-
-                # Проверяем, существует ли участник в группе
-                cursor.execute('''
-                    SELECT role FROM group_members 
-                    WHERE group_id = ? AND user_id = ?
-                    ''', (group_id, user_id))
-                target_role = cursor.fetchone()
+                # Проверяем, существует ли участник в группе, и его роль
+                target_role = GroupModel.get_role(group_id, user_id)
                 
                 if not target_role:
                     return {'error': 'User not in group'}
                 
                 # Владельца может удалить только другой владелец
-                if target_role and target_role[0] == 'owner':
+                if target_role == 'owner':
                     return {'error': 'Нельзя удалить владельца'}
                 
                 # Удаляем участника
@@ -145,7 +164,9 @@ class GroupModel:
                 ''', (group_id, user_id))
                 
                 cursor.connection.commit()
-                return {'status': 'success'}
+            group_access.remove(user_id, group_id)
+            GroupModel.publish_change('member_remove', group_id, user_id)
+            return {'status': 'success'}
                 
         except Exception as e:
             logging.error(f"Remove member error: {str(e)}")
@@ -160,27 +181,19 @@ class GroupModel:
         try:
             with get_db_cursor() as cursor:
                 # Проверяем права изменяющего
-                cursor.execute('''
-                    SELECT role FROM group_members 
-                    WHERE group_id = ? AND user_id = ?
-                ''', (group_id, changer_id))
-                changer_role = cursor.fetchone()
+                changer_role = GroupModel.get_role(group_id, changer_id)
                 
-                if not changer_role or changer_role[0] not in ('owner', 'admin'):
+                if changer_role not in ('owner', 'admin'):
                     return {'error': 'Недостаточно прав'}
                 
                 # Проверяем текущую роль участника
-                cursor.execute('''
-                    SELECT role FROM group_members 
-                    WHERE group_id = ? AND user_id = ?
-                ''', (group_id, user_id))
-                current_role = cursor.fetchone()
+                current_role = GroupModel.get_role(group_id, user_id)
                 
                 if not current_role:
                     return {'error': 'User not in group'}
                 
                 # Владельца может изменить только другой владелец
-                if current_role[0] == 'owner' and changer_role[0] != 'owner':
+                if current_role == 'owner' and changer_role != 'owner':
                     return {'error': 'Нельзя изменить владельца'}
                 
                 # Изменяем роль
@@ -191,7 +204,9 @@ class GroupModel:
                 ''', (new_role, group_id, user_id))
                 
                 cursor.connection.commit()
-                return {'status': 'success'}
+            group_access.set_role(user_id, group_id, new_role)
+            GroupModel.publish_change('role', group_id, user_id, role=new_role)
+            return {'status': 'success'}
                 
         except Exception as e:
             logging.error(f"Change role error: {str(e)}")
@@ -200,7 +215,7 @@ class GroupModel:
     @staticmethod
     def get_group_members(group_id: int) -> list:
         """Получает список участников группы"""
-        with get_db_cursor() as cursor:
+        with get_read_cursor() as cursor:
             cursor.execute('''
                 SELECT u.username, gm.role, gm.joined_at
                 FROM group_members gm
@@ -229,13 +244,7 @@ class GroupModel:
         try:
             with get_db_cursor() as cursor:
                 # Проверяем права пользователя
-                cursor.execute('''
-                    SELECT role FROM group_members 
-                    WHERE group_id = ? AND user_id = ?
-                ''', (group_id, user_id))
-                result = cursor.fetchone()
-                
-                if not result or result[0] not in ('owner', 'admin'):
+                if GroupModel.get_role(group_id, user_id) not in ('owner', 'admin'):
                     return {'error': 'Недостаточно прав для изменения названия'}
                 
                 # Проверяем уникальность имени
@@ -254,7 +263,8 @@ class GroupModel:
                 ''', (new_name, group_id))
                 
                 cursor.connection.commit()
-                return {'status': 'success'}
+            GroupModel.publish_change('rename', group_id, name=new_name)
+            return {'status': 'success'}
                 
         except Exception as e:
             logging.error(f"Rename group error: {str(e)}")
@@ -284,7 +294,13 @@ class GroupModel:
                 role, username = result
                 
                 if role == 'owner':
-                    # Удаляем группу полностью
+                    # Удаляем группу полностью; триггер освобождает файлы вложений
+                    cursor.execute('''
+                        DELETE FROM attachments
+                        WHERE message_type = 'group' AND message_id IN (
+                            SELECT message_id FROM group_messages WHERE group_id = ?
+                        )
+                    ''', (group_id,))
                     cursor.execute('DELETE FROM group_members WHERE group_id = ?', (group_id,))
                     cursor.execute('DELETE FROM groups WHERE group_id = ?', (group_id,))
                     is_group_deleted = True
@@ -304,11 +320,38 @@ class GroupModel:
                     (group_id, user_id, message_text, timestamp)
                     VALUES (?, 0, ?, ?)
                 ''', (group_id, action_message, int(datetime.now().timestamp())          ))
+                message_id = cursor.lastrowid
                 
                 cursor.connection.commit()
-                return {'status': 'success', 'is_group_deleted': is_group_deleted}
+            if is_group_deleted:
+                group_access.drop_group(group_id)
+            else:
+                group_access.remove(user_id, group_id)
+            # Системное сообщение записано в обход MessageModel
+            recent_messages.invalidate(f'g:{group_id}')
+            publish_event(
+                (f'g:{group_id}',), 'message',
+                {'chat': f'g:{group_id}', 'op': 'insert', 'id': message_id}
+            )
+            GroupModel.publish_change('delete' if is_group_deleted else 'leave', group_id, user_id)
+            return {'status': 'success', 'is_group_deleted': is_group_deleted}
                 
         except Exception as e:
             cursor.connection.rollback()
             logging.error(f"Leave group error: {str(e)}")
-            return {'error': 'Internal Server Error'}
\ No newline at end of file
+            return {'error': 'Internal Server Error'}
+
+    @staticmethod
+    def publish_change(op: str, group_id: int, user_id: Optional[int] = None, **fields) -> None:
+        """
+        Публикует изменение группы в шину событий после фиксации транзакции.
+        Событие получают участники группы ('g:<id>') и сам затронутый
+        пользователь ('u:<id>'), даже если он больше не в группе.
+        """
+        topics = [f'g:{group_id}']
+        payload = {'chat': f'g:{group_id}', 'op': op, 'group_id': group_id}
+        if user_id is not None:
+            topics.append(f'u:{user_id}')
+            payload['user_id'] = user_id
+        payload.update(fields)
+        publish_event(topics, 'group', payload)
@@ -1,20 +1,46 @@
 import os
+import re
+import html
+import time
 import logging
-import hashlib
+import threading
 from werkzeug.utils import secure_filename
-from typing import List, Dict, Optional
-from collections import defaultdict
+from typing import List, Dict, Optional, Tuple
+from collections import defaultdict, OrderedDict
 from contextlib import contextmanager
-from utils import get_db_cursor
+from utils import get_db_cursor, get_read_cursor, run_write, publish_event, UploadedFile
+from .message_cache import recent_messages
+from .UserModel import UserModel
+from .GroupModel import GroupModel
+from .blob_store import blob_store
 from datetime import datetime
 
+# Маркеры совпадений во фрагментах поиска: управляющие символы не встречаются
+# в тексте сообщений и заменяются на <mark> уже после HTML-экранирования
+SNIPPET_MARK_OPEN = '\x02'
+SNIPPET_MARK_CLOSE = '\x03'
+SNIPPET_TOKENS = 16
+
+# Общее число совпадений считается точно только до SEARCH_COUNT_CAP,
+# дальше отдаётся как "1000+". Подсчёт кешируется на время жизни выдачи.
+SEARCH_COUNT_CAP = 1000
+SEARCH_COUNT_TTL = 60
+SEARCH_COUNT_CACHE_SIZE = 512
+
+_search_count_cache = OrderedDict()
+_search_count_lock = threading.Lock()
+
 class MessageModel:
     @staticmethod
     def get_general_messages(timestamp: int) -> List[Dict]:
         """
         Получает общие сообщения (из общего чата) новее указанного timestamp
         """
-        with get_db_cursor() as cursor:
+        cached = MessageModel._get_recent('general', 0, timestamp)
+        if cached is not None:
+            return cached
+
+        with get_read_cursor() as cursor:
             cursor.execute('''
                 SELECT 
                     gm.message_id,
@@ -51,7 +77,11 @@ class MessageModel:
         Returns:
             Список сообщений с вложениями
         """
-        with get_db_cursor() as cursor:
+        cached = MessageModel._get_recent('group', group_id, timestamp)
+        if cached is not None:
+            return cached
+
+        with get_read_cursor() as cursor:
             cursor.execute('''
                 SELECT 
                     gm.message_id,
@@ -90,14 +120,16 @@ class MessageModel:
         Returns:
             Список сообщений с правильными полями sender и message_text
         """
-        with get_db_cursor() as cursor:
-            # Сначала получаем ID собеседника, если передан username
-            if isinstance(other_user_id, str):
-                cursor.execute("SELECT id FROM users WHERE username = ?", (other_user_id,))
-                other_user = cursor.fetchone()
-                if not other_user:
-                    return []
-                other_user_id = other_user[0]
+        # Сначала получаем ID собеседника, если передан username
+        if isinstance(other_user_id, str):
+            other_user_id = UserModel.get_user_id(other_user_id)
+            if not other_user_id:
+                return []
+
+        with get_read_cursor() as cursor:
+            conversation_id = MessageModel._conversation_id(cursor, user_id, other_user_id)
+            if conversation_id is None:
+                return []
 
             cursor.execute('''
                 SELECT 
@@ -112,11 +144,9 @@ class MessageModel:
                 FROM private_messages pm
                 JOIN users u_sender ON pm.sender_id = u_sender.id
                 LEFT JOIN attachments a ON a.message_id = pm.id AND a.message_type = 'private'
-                WHERE ((pm.sender_id = ? AND pm.receiver_id = ?)
-                OR (pm.sender_id = ? AND pm.receiver_id = ?))
-                AND pm.timestamp > ?
+                WHERE pm.conversation_id = ? AND pm.timestamp > ?
                 ORDER BY pm.timestamp ASC
-            ''', [user_id, other_user_id, other_user_id, user_id, timestamp])
+            ''', (conversation_id, timestamp))
             
             messages = defaultdict(dict)
             
@@ -140,6 +170,81 @@ class MessageModel:
                     
             return list(messages.values())
 
+    @staticmethod
+    def _conversation_id(cursor, user_id: int, other_user_id: int) -> Optional[int]:
+        """
+        Возвращает id беседы двух пользователей или None, если они не переписывались.
+        """
+        try:
+            low_id, high_id = sorted((int(user_id), int(other_user_id)))
+        except (TypeError, ValueError):
+            return None
+        cursor.execute(
+            'SELECT conversation_id FROM conversations WHERE low_id = ? AND high_id = ?',
+            (low_id, high_id)
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _get_recent(message_type: str, group_id: int, timestamp: int) -> Optional[List[Dict]]:
+        """
+        Отвечает на запрос timestamp > ? из буфера последних сообщений чата.
+        Буфер, которого ещё нет, заполняется из базы. Возвращает None,
+        если timestamp старше начала буфера и нужен обычный запрос.
+        """
+        try:
+            chat = f'g:{int(group_id)}'
+            timestamp = int(timestamp)
+        except (TypeError, ValueError):
+            return None
+        cached = recent_messages.get(chat, timestamp)
+        if cached is not None or recent_messages.has(chat):
+            return cached
+
+        version = recent_messages.version(chat)
+        with get_read_cursor() as cursor:
+            messages = MessageModel._select_group_messages(cursor, message_type, '''
+                gm.message_id IN (
+                    SELECT message_id FROM group_messages
+                    WHERE group_id = ?
+                    ORDER BY timestamp DESC, message_id DESC
+                    LIMIT ?
+                )
+            ''', (group_id, recent_messages.size))
+        recent_messages.fill(chat, version, messages)
+        return recent_messages.get(chat, timestamp)
+
+    @staticmethod
+    def _select_group_messages(cursor, message_type: str, where: str, params: tuple) -> List[Dict]:
+        """
+        Читает сообщения общего или группового чата с вложениями
+        в том же виде, что get_general_messages и get_group_messages.
+        """
+        cursor.execute(f'''
+            SELECT 
+                gm.message_id,
+                CASE 
+                    WHEN gm.user_id = 0 THEN 'System'
+                    ELSE u.username
+                END as sender,
+                gm.message_text,
+                gm.timestamp,
+                a.file_path,
+                a.mime_type,
+                a.filename,
+                ? as type,
+                gm.user_id
+            FROM group_messages gm
+            LEFT JOIN users u ON gm.user_id = u.id
+            LEFT JOIN attachments a 
+                ON a.message_id = gm.message_id 
+                AND a.message_type = 'group'
+            WHERE {where}
+            ORDER BY gm.timestamp, gm.message_id
+        ''', (message_type,) + tuple(params))
+        return MessageModel._process_messages(cursor)
+
     @staticmethod
     def _process_messages(cursor) -> List[Dict]:
         """
@@ -182,7 +287,8 @@ class MessageModel:
         user_id: int,
         message_text: str,
         group_id: Optional[int] = None,
-        receiver_id: Optional[int] = None
+        receiver_id: Optional[int] = None,
+        publish: bool = True
     ) -> Optional[int]:
         """
         Создает новое сообщение (общее, групповое или приватное)
@@ -193,51 +299,84 @@ class MessageModel:
             message_text: Текст сообщения
             group_id: ID группы (для групповых сообщений)
             receiver_id: ID получателя (для приватных сообщений)
+            publish: Публиковать событие вставки; False, если вызывающий
+                опубликует его сам после добавления вложений
             
         Returns:
             ID созданного сообщения или None в случае ошибки
         """
+        timestamp = int(datetime.now().timestamp())
+
+        def insert(cursor):
+            if message_type == 'group':
+                cursor.execute('''
+                    INSERT INTO group_messages 
+                    (group_id, user_id, message_text, timestamp)
+                    VALUES (?, ?, ?, ?)
+                ''', (group_id, user_id, message_text, timestamp))
+            elif message_type == 'private':
+                cursor.execute('''
+                    INSERT INTO private_messages 
+                    (sender_id, receiver_id, message_text, timestamp)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, receiver_id, message_text, timestamp))
+            else:  # general
+                cursor.execute('''
+                    INSERT INTO group_messages 
+                    (group_id, user_id, message_text, timestamp)
+                    VALUES (?, ?, ?, ?)
+                ''', (0, user_id, message_text, timestamp))
+            return cursor.lastrowid
+
         try:
-            with get_db_cursor() as cursor:
-                timestamp = int(datetime.now().timestamp())
-                
-                if message_type == 'group':
-                    cursor.execute('''
-                        INSERT INTO group_messages 
-                        (group_id, user_id, message_text, timestamp)
-                        VALUES (?, ?, ?, ?)
-                    ''', (group_id, user_id, message_text, timestamp))
-                elif message_type == 'private':
-                    cursor.execute('''
-                        INSERT INTO private_messages 
-                        (sender_id, receiver_id, message_text, timestamp)
-                        VALUES (?, ?, ?, ?)
-                    ''', (user_id, receiver_id, message_text, timestamp))
-                else:  # general
-                    # Получаем username отправителя
-                    cursor.execute('SELECT username FROM users WHERE id = ?', (user_id,))
-                    
-                    cursor.execute('''
-                        INSERT INTO group_messages 
-                        (group_id, user_id, message_text, timestamp)
-                        VALUES (?, ?, ?, ?)
-                    ''', (0, user_id, message_text, timestamp))
-                
-                message_id = cursor.lastrowid
-                cursor.connection.commit()
-                return message_id
-                
+            # При включённой групповой фиксации вставка попадает в общую транзакцию
+            message_id = run_write(insert)
         except Exception as e:
             logging.error(f"Error creating message: {str(e)}")
             return None
 
+        chat_id = receiver_id if message_type == 'private' else group_id
+        if message_type == 'group':
+            MessageModel._cache_new_message('group', group_id, message_id)
+        elif message_type != 'private':
+            MessageModel._cache_new_message('general', 0, message_id)
+        if publish:
+            MessageModel.publish_change('insert', message_type, user_id, chat_id, message_id)
+        return message_id
+
+    @staticmethod
+    def _cache_new_message(message_type: str, group_id: int, message_id: int) -> None:
+        """
+        Добавляет новое сообщение в буфер последних сообщений чата, если он заполнен.
+        """
+        try:
+            chat = f'g:{int(group_id)}'
+        except (TypeError, ValueError):
+            return
+        if not recent_messages.has(chat):
+            recent_messages.invalidate(chat)
+            return
+        try:
+            with get_read_cursor() as cursor:
+                messages = MessageModel._select_group_messages(
+                    cursor, message_type, 'gm.message_id = ?', (message_id,)
+                )
+        except Exception as e:
+            logging.error(f"Error caching message: {str(e)}")
+            messages = []
+        if messages:
+            recent_messages.add(chat, messages[0])
+        else:
+            recent_messages.invalidate(chat)
+
     @staticmethod
     def add_attachment(
         message_type: str,
         message_id: int,
         file_path: str,
         mime_type: str,
-        filename: str
+        filename: str,
+        blob_hash: Optional[str] = None
     ) -> bool:
         """
         Добавляет вложение к сообщению
@@ -248,58 +387,125 @@ class MessageModel:
             file_path: Путь к файлу
             mime_type: MIME-тип файла
             filename: Оригинальное имя файла
+            blob_hash: Хеш файла в хранилище (счётчик ссылок увеличит триггер)
             
         Returns:
             True если успешно, False в случае ошибки
         """
+        def insert(cursor):
+            cursor.execute('''
+                INSERT INTO attachments 
+                (message_type, message_id, file_path, mime_type, filename, blob_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (message_type, message_id, file_path, mime_type, filename, blob_hash))
+            return True
+
         try:
-            with get_db_cursor() as cursor:
-                cursor.execute('''
-                    INSERT INTO attachments 
-                    (message_type, message_id, file_path, mime_type, filename)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (message_type, message_id, file_path, mime_type, filename))
-                cursor.connection.commit()
-                return True
+            result = run_write(insert)
         except Exception as e:
             logging.error(f"Error adding attachment: {str(e)}")
             return False
 
+        if message_type == 'group':
+            recent_messages.add_attachment(message_id, {
+                'path': file_path,
+                'mime_type': mime_type,
+                'filename': filename
+            })
+        return result
+
+    @staticmethod
+    def get_attachment(file_path: str, user_id: int) -> Optional[Dict]:
+        """
+        Возвращает вложение по пути файла, если пользователь видит сообщение,
+        к которому оно приложено. Одинаковые файлы хранятся один раз, поэтому
+        файл может принадлежать нескольким сообщениям - достаточно любого.
+
+        Args:
+            file_path: Путь файла, как в сообщении (/static/uploads/...)
+            user_id: ID пользователя, запрашивающего файл
+
+        Returns:
+            Словарь с mime_type, filename и blob_hash (None у файлов,
+            не перенесённых в хранилище) или None, если доступа нет
+        """
+        with get_read_cursor() as cursor:
+            cursor.execute('''
+                SELECT
+                    a.message_type,
+                    gm.group_id,
+                    pm.sender_id,
+                    pm.receiver_id,
+                    a.mime_type,
+                    a.filename,
+                    a.blob_hash
+                FROM attachments a
+                LEFT JOIN group_messages gm
+                    ON a.message_type IN ('group', 'general') AND gm.message_id = a.message_id
+                LEFT JOIN private_messages pm
+                    ON a.message_type = 'private' AND pm.id = a.message_id
+                WHERE a.file_path = ?
+            ''', (file_path,))
+            rows = cursor.fetchall()
+
+        if not rows or UserModel.get_username(user_id) is None:
+            return None
+        user_id = int(user_id)
+        for message_type, group_id, sender_id, receiver_id, mime_type, filename, blob_hash in rows:
+            if message_type == 'private':
+                visible = user_id in (sender_id, receiver_id)
+            elif group_id is None:
+                # Сообщение удалено
+                visible = False
+            else:
+                # Общий чат (группа 0) видят все пользователи
+                visible = group_id == 0 or GroupModel.check_group_access(group_id, user_id)
+            if visible:
+                return {'mime_type': mime_type, 'filename': filename, 'blob_hash': blob_hash}
+        return None
+
     @staticmethod
-    def save_uploaded_file(file, upload_folder: str) -> Optional[dict]:
+    def save_uploaded_file(file, upload_folder: Optional[str] = None) -> Optional[dict]:
         """
-        Сохраняет загруженный файл на сервере
+        Сохраняет загруженный файл в хранилище по содержимому
         
         Args:
-            file: Файловый объект из request.FILES
-            upload_folder: Папка для загрузки
+            file: UploadedFile из parse_multipart или файловый объект
+                с атрибутами filename, file и type
+            upload_folder: Папка для временной копии файлового объекта
+                (по умолчанию - временная папка хранилища)
             
         Returns:
             Словарь с информацией о файле или None в случае ошибки
         """
+        upload = None
         try:
-            if not file.filename or not file.file:
+            if not file.filename:
+                return None
+            if isinstance(file, UploadedFile):
+                upload = file
+            elif file.file:
+                # Копируем частями во временный файл, считая хеш по ходу
+                upload_folder = upload_folder or blob_store.temp_dir
+                os.makedirs(upload_folder, exist_ok=True)
+                upload = UploadedFile.from_stream(file.file, file.filename, file.type, upload_folder)
+            else:
                 return None
-                
-            file_content = file.file.read()
-            file_hash = hashlib.md5(file_content).hexdigest()
-            file.file.seek(0)
-            
-            filename = secure_filename(file.filename)
-            unique_name = f"{file_hash}_{filename}"
-            file_path = os.path.join(upload_folder, unique_name)
             
-            if not os.path.exists(file_path):
-                with open(file_path, 'wb') as f:
-                    f.write(file_content)
+            filename = secure_filename(upload.filename)
+            blob_hash = blob_store.put(upload)
             
+            # Один файл под разными именами - разные ссылки на один blob
             return {
-                'path': f'/static/uploads/{unique_name}',
-                'mime_type': file.type,
-                'filename': filename
+                'path': f'/static/uploads/{blob_hash}/{filename}',
+                'mime_type': upload.type,
+                'filename': filename,
+                'blob_hash': blob_hash
             }
         except Exception as e:
             logging.error(f"Error saving file: {str(e)}")
+            if upload is not None:
+                upload.discard()
             return None
 
     @staticmethod
@@ -318,33 +524,34 @@ class MessageModel:
                     if not result or int(result[0]) != user_id:
                         return False
                     cursor.execute('DELETE FROM group_messages WHERE message_id = ? AND group_id = 0', (message_id,))
+                    chat_id = None
                     
                 elif message_type == 'private':
                     # Для личных - только свои сообщения
                     cursor.execute('''
-                        SELECT sender_id FROM private_messages WHERE id = ?
+                        SELECT sender_id, receiver_id FROM private_messages WHERE id = ?
                     ''', (message_id,))
                     result = cursor.fetchone()
                     if not result or int(result[0]) != user_id:
                         return False
                         
                     cursor.execute('DELETE FROM private_messages WHERE id = ?', (message_id,))
+                    chat_id = result[1]
                     
                 elif message_type == 'group':
-                    # Для групповых - сложная проверка прав
+                    # Для групповых - роль автора запроса берётся из кеша членства
                     cursor.execute('''
-                        SELECT gm.user_id, g.group_id, gm2.role 
-                        FROM group_messages gm
-                        JOIN groups g ON gm.group_id = g.group_id
-                        JOIN group_members gm2 ON g.group_id = gm2.group_id AND gm2.user_id = ?
-                        WHERE gm.message_id = ?
-                    ''', (user_id, message_id))
+                        SELECT user_id, group_id FROM group_messages WHERE message_id = ?
+                    ''', (message_id,))
                     result = cursor.fetchone()
                     
                     if not result:
-                        return False  # Пользователь не в группе или сообщение не существует
+                        return False  # Сообщение не существует
                         
-                    message_owner_id, group_id, user_role = result
+                    message_owner_id, group_id = result
+                    user_role = GroupModel.get_role(group_id, user_id)
+                    if user_role is None:
+                        return False  # Пользователь не в группе
                     
                     # Владельцы и админы могут удалять любые сообщения
                     if user_role in ('owner', 'admin'):
@@ -354,15 +561,24 @@ class MessageModel:
                         return False
                     
                     cursor.execute('DELETE FROM group_messages WHERE message_id = ?', (message_id,))
+                    chat_id = group_id
+
+                else:
+                    chat_id = None
                 
-                # Удаляем вложения в любом случае
+                # Удаляем вложения в любом случае; вложения общего чата
+                # записываются с типом 'group'. Триггер освобождает файлы
                 cursor.execute('''
                     DELETE FROM attachments 
-                    WHERE message_type = ? AND message_id = ?
-                ''', (message_type, message_id))
+                    WHERE message_type IN (?, ?) AND message_id = ?
+                ''', (message_type, 'group' if message_type == 'general' else message_type, message_id))
                 
                 cursor.connection.commit()
-                return True
+
+            if message_type in ('general', 'group'):
+                recent_messages.remove(f'g:{int(chat_id or 0)}', message_id)
+            MessageModel.publish_change('delete', message_type, user_id, chat_id, message_id)
+            return True
                 
         except Exception as e:
             logging.error(f"Error deleting message: {str(e)}")
@@ -380,8 +596,8 @@ class MessageModel:
         """
         try:
             with get_db_cursor() as cursor:
-                timestamp = int(datetime.now().timestamp())
-                
+                # Время отправки не меняется: иначе правка переносит сообщение
+                # в конец истории. Правки доставляются через журнал изменений
                 if message_type == 'general':
                     cursor.execute('''
                         SELECT user_id FROM group_messages WHERE message_id = ? AND group_id = 0
@@ -391,14 +607,15 @@ class MessageModel:
                         return False
                     cursor.execute('''
                         UPDATE group_messages 
-                        SET message_text = ?, timestamp = ?
+                        SET message_text = ?
                         WHERE message_id = ? AND group_id = 0
-                    ''', (new_text, timestamp, message_id))
+                    ''', (new_text, message_id))
+                    chat_id = None
                     
                 elif message_type == 'private':
                     # Личные сообщения - только свои
                     cursor.execute('''
-                        SELECT sender_id FROM private_messages WHERE id = ?
+                        SELECT sender_id, receiver_id FROM private_messages WHERE id = ?
                     ''', (message_id,))
                     result = cursor.fetchone()
                     if not result or int(result[0]) != user_id:
@@ -406,25 +623,25 @@ class MessageModel:
                         
                     cursor.execute('''
                         UPDATE private_messages 
-                        SET message_text = ?, timestamp = ?
+                        SET message_text = ?
                         WHERE id = ?
-                    ''', (new_text, timestamp, message_id))
+                    ''', (new_text, message_id))
+                    chat_id = result[1]
                     
                 elif message_type == 'group':
-                    # Групповые сообщения - сложная проверка прав
+                    # Групповые сообщения - роль автора запроса берётся из кеша членства
                     cursor.execute('''
-                        SELECT gm.user_id, g.group_id, gm2.role 
-                        FROM group_messages gm
-                        JOIN groups g ON gm.group_id = g.group_id
-                        JOIN group_members gm2 ON g.group_id = gm2.group_id AND gm2.user_id = ?
-                        WHERE gm.message_id = ?
-                    ''', (user_id, message_id))
+                        SELECT user_id, group_id FROM group_messages WHERE message_id = ?
+                    ''', (message_id,))
                     result = cursor.fetchone()
                     
                     if not result:
-                        return False  # Пользователь не в группе или сообщение не существует
+                        return False  # Сообщение не существует
                         
-                    message_owner_id, group_id, user_role = result
+                    message_owner_id, group_id = result
+                    user_role = GroupModel.get_role(group_id, user_id)
+                    if user_role is None:
+                        return False  # Пользователь не в группе
                     
                     # Владельцы и админы могут редактировать любые сообщения
                     if user_role in ('owner', 'admin'):
@@ -435,40 +652,223 @@ class MessageModel:
                         
                     cursor.execute('''
                         UPDATE group_messages 
-                        SET message_text = ?, timestamp = ?
+                        SET message_text = ?
                         WHERE message_id = ?
-                    ''', (new_text, timestamp, message_id))
+                    ''', (new_text, message_id))
+                    chat_id = group_id
+
+                else:
+                    chat_id = None
                 
                 cursor.connection.commit()
-                return True
+
+            if message_type in ('general', 'group'):
+                recent_messages.update_text(f'g:{int(chat_id or 0)}', message_id, new_text)
+            MessageModel.publish_change('edit', message_type, user_id, chat_id, message_id, new_text)
+            return True
                 
         except Exception as e:
             logging.error(f"Error editing message: {str(e)}")
             return False
         
+    @staticmethod
+    def chat_key(message_type: str, user_id: int, chat_id=None) -> Optional[str]:
+        """
+        Возвращает ключ чата в журнале изменений message_changes.
+
+        Для личной переписки chat_id - id собеседника; ключ не зависит
+        от того, кто из двоих отправитель.
+        """
+        if message_type == 'general':
+            return 'g:0'
+        if message_type == 'group':
+            return f'g:{int(chat_id)}'
+        if message_type == 'private':
+            first, second = sorted((int(user_id), int(chat_id)))
+            return f'p:{first}:{second}'
+        return None
+
+    @staticmethod
+    def notify_keys(message_type: str, user_id: int, chat_id=None) -> Tuple[str, ...]:
+        """
+        Возвращает ключи, по которым будятся долгие опросы после
+        изменения сообщения: ключ чата, а для личной переписки ещё
+        и ключи 'u:<id>' обоих собеседников.
+        """
+        try:
+            chat = MessageModel.chat_key(message_type, user_id, chat_id)
+            if chat is None:
+                return ()
+            if message_type == 'private':
+                return (chat, f'u:{int(user_id)}', f'u:{int(chat_id)}')
+            return (chat,)
+        except (TypeError, ValueError):
+            return ()
+
+    @staticmethod
+    def publish_change(
+        op: str,
+        message_type: str,
+        user_id: int,
+        chat_id,
+        message_id: int,
+        text: Optional[str] = None
+    ) -> None:
+        """
+        Публикует изменение сообщения в шину событий после фиксации
+        транзакции: шина будит долгие опросы и отправляет событие в поток /events.
+        """
+        keys = MessageModel.notify_keys(message_type, user_id, chat_id)
+        if not keys:
+            return
+        payload = {'chat': keys[0], 'op': op, 'id': message_id}
+        if op == 'edit':
+            payload['text'] = text
+        publish_event(keys, 'message', payload)
+
+    @staticmethod
+    def get_changes(message_type: str, chat: str, cursor_seq: Optional[int], limit: int = 500) -> Dict:
+        """
+        Возвращает изменения сообщений чата после курсора cursor_seq.
+
+        Без курсора возвращает только текущую позицию журнала, с которой
+        клиент начинает синхронизацию. Несколько событий по одному
+        сообщению сворачиваются в одно: удаление важнее правки, а правка
+        только что добавленного сообщения приходит вместе с ним.
+
+        Returns:
+            Словарь с ключами cursor, inserted, edited, deleted и more
+        """
+        result = {'cursor': cursor_seq or 0, 'inserted': [], 'edited': [], 'deleted': [], 'more': False}
+        table, id_column = (
+            ('private_messages', 'id') if message_type == 'private'
+            else ('group_messages', 'message_id')
+        )
+
+        with get_read_cursor() as cursor:
+            if cursor_seq is None:
+                cursor.execute(
+                    'SELECT MAX(seq) FROM message_changes WHERE chat = ?', (chat,)
+                )
+                result['cursor'] = cursor.fetchone()[0] or 0
+                return result
+
+            cursor.execute(f'''
+                SELECT c.seq, c.message_id, c.op, m.message_text, m.{id_column} IS NOT NULL
+                FROM message_changes c
+                LEFT JOIN {table} m ON m.{id_column} = c.message_id
+                WHERE c.chat = ? AND c.seq > ?
+                ORDER BY c.seq
+                LIMIT ?
+            ''', (chat, cursor_seq, limit + 1))
+            rows = cursor.fetchall()
+
+        if len(rows) > limit:
+            rows = rows[:limit]
+            result['more'] = True
+
+        changes = OrderedDict()
+        for seq, message_id, op, text, exists in rows:
+            result['cursor'] = seq
+            previous = changes.get(message_id)
+            if op == 'edit' and previous and previous[0] == 'insert':
+                op = 'insert'
+            changes[message_id] = (op, text, exists)
+
+        for message_id, (op, text, exists) in changes.items():
+            # Удаление могло не попасть в прочитанную часть журнала
+            if op == 'delete' or not exists:
+                result['deleted'].append(message_id)
+            elif op == 'insert':
+                result['inserted'].append(message_id)
+            else:
+                result['edited'].append({'id': message_id, 'text': text})
+        return result
+
     @staticmethod
     def get_private_chats(user_id: int) -> list:
         """Получает список приватных чатов пользователя"""
-        with get_db_cursor() as cursor:
+        with get_read_cursor() as cursor:
+            # Беседы, где пользователь - меньший и больший id пары;
+            # переписка с самим собой попадает только в первую выборку
             cursor.execute('''
-                SELECT DISTINCT 
-                    CASE 
-                        WHEN pm.sender_id = ? THEN u_receiver.username
-                        ELSE u_sender.username
-                    END as partner,
-                    MAX(pm.timestamp) as last_activity
-                FROM private_messages pm
-                JOIN users u_sender ON pm.sender_id = u_sender.id
-                JOIN users u_receiver ON pm.receiver_id = u_receiver.id
-                WHERE pm.sender_id = ? OR pm.receiver_id = ?
-                GROUP BY partner
-                ORDER BY last_activity DESC
+                SELECT u.username, c.last_activity, c.last_message_preview
+                FROM conversations c
+                JOIN users u ON u.id = c.high_id
+                WHERE c.low_id = ?
+                UNION ALL
+                SELECT u.username, c.last_activity, c.last_message_preview
+                FROM conversations c
+                JOIN users u ON u.id = c.low_id
+                WHERE c.high_id = ? AND c.low_id != ?
+                ORDER BY 2 DESC
             ''', (user_id, user_id, user_id))
             return [{
                 'username': row[0],
-                'last_activity': row[1] or 0
+                'last_activity': row[1] or 0,
+                'last_message': row[2]
             } for row in cursor.fetchall()]
         
+    @staticmethod
+    def _build_fts_query(search_query: str) -> str:
+        """
+        Преобразует пользовательский запрос в выражение FTS5 MATCH:
+        каждое слово ищется как префикс, слова объединяются через AND.
+        Спецсимволы синтаксиса FTS5 отбрасываются.
+        """
+        terms = re.findall(r'\w+', search_query)
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    @staticmethod
+    def _format_snippet(snippet: Optional[str]) -> str:
+        """
+        Экранирует HTML во фрагменте и заменяет маркеры совпадений на <mark>
+        """
+        if not snippet:
+            return ''
+        return (
+            html.escape(snippet)
+            .replace(SNIPPET_MARK_OPEN, '<mark>')
+            .replace(SNIPPET_MARK_CLOSE, '</mark>')
+        )
+
+    @staticmethod
+    def _count_matches(
+        cursor,
+        source: str,
+        params: list,
+        cache_key: tuple,
+        use_cache: bool = False
+    ) -> Tuple[int, bool]:
+        """
+        Считает совпадения не дальше SEARCH_COUNT_CAP + 1 строки.
+        Результат кешируется на SEARCH_COUNT_TTL секунд, поэтому
+        листание одной выдачи (use_cache=True) не пересчитывает его
+        на каждой странице.
+
+        Returns:
+            (total, exact) - число совпадений и признак точного подсчёта
+        """
+        now = time.monotonic()
+        with _search_count_lock:
+            cached = _search_count_cache.get(cache_key) if use_cache else None
+            if cached and now - cached[2] < SEARCH_COUNT_TTL:
+                _search_count_cache.move_to_end(cache_key)
+                return cached[0], cached[1]
+
+        cursor.execute(f"""
+            SELECT COUNT(*) FROM (SELECT 1 {source} LIMIT ?)
+        """, list(params) + [SEARCH_COUNT_CAP + 1])
+        count = cursor.fetchone()[0]
+        total, exact = min(count, SEARCH_COUNT_CAP), count <= SEARCH_COUNT_CAP
+
+        with _search_count_lock:
+            _search_count_cache[cache_key] = (total, exact, now)
+            _search_count_cache.move_to_end(cache_key)
+            while len(_search_count_cache) > SEARCH_COUNT_CACHE_SIZE:
+                _search_count_cache.popitem(last=False)
+        return total, exact
+
     @staticmethod
     def search_messages(
         search_query: str,
@@ -477,140 +877,144 @@ class MessageModel:
         user_id: Optional[int] = None,
         page: int = 1,
         per_page: int = 20,
-        sort: str = 'date'
+        sort: str = 'date',
+        before: Optional[Tuple[int, int]] = None
     ) -> dict:
         """
-        Исправленный поиск сообщений
+        Полнотекстовый поиск сообщений через индекс FTS5
+
+        Args:
+            search_query: Строка поиска (слова ищутся по префиксу)
+            message_type: Тип чата ('general', 'group' или 'private')
+            chat_id: ID группы или username собеседника
+            user_id: ID текущего пользователя
+            page: Номер страницы
+            per_page: Сообщений на странице
+            sort: 'date' - сначала новые, 'relevance' - по bm25
+            before: Курсор (timestamp, id) последнего сообщения предыдущей
+                страницы; при сортировке по дате заменяет page/OFFSET
+
+        Returns:
+            Словарь с сообщениями, общим числом совпадений и параметрами страницы.
+            Поле snippet содержит экранированный фрагмент с <mark> вокруг совпадений.
+            total точен до SEARCH_COUNT_CAP (total_exact=False, если совпадений больше),
+            next_before - курсор следующей страницы или None.
         """
+        empty_result = {
+            'messages': [],
+            'total': 0,
+            'total_exact': True,
+            'page': page,
+            'per_page': per_page,
+            'next_before': None
+        }
+
+        match = MessageModel._build_fts_query(search_query)
+        if not match:
+            return empty_result
+
         try:
-            with get_db_cursor() as cursor:
-                # Определяем параметры для разных типов сообщений
-                if message_type == 'group':
-                    query = """
-                        SELECT 
-                            gm.message_id as id,
-                            gm.message_text as text,
-                            CASE 
-                                WHEN gm.user_id = 0 THEN 'System'
-                                ELSE u.username
-                            END as sender,
-                            gm.timestamp,
-                            gm.message_text as snippet
-                        FROM group_messages gm
-                        LEFT JOIN users u ON gm.user_id = u.id
-                        WHERE gm.group_id = ? AND gm.message_text LIKE ?
-                        ORDER BY gm.timestamp DESC
-                        LIMIT ? OFFSET ?
-                    """
-                    params = [chat_id, f'%{search_query}%', per_page, (page - 1) * per_page]
-                    
-                    count_query = """
-                        SELECT COUNT(*) 
-                        FROM group_messages 
-                        WHERE group_id = ? AND message_text LIKE ?
-                    """
-                    count_params = [chat_id, f'%{search_query}%']
-                    
-                elif message_type == 'private':
+            with get_read_cursor() as cursor:
+                if message_type == 'private':
                     # Получаем ID собеседника
-                    cursor.execute("SELECT id FROM users WHERE username = ?", (chat_id,))
-                    partner = cursor.fetchone()
-                    if not partner:
-                        return {'messages': [], 'total': 0}
-                    
-                    query = """
-                        SELECT 
-                            pm.id as id,
-                            pm.message_text as text,
-                            u.username as sender,
-                            pm.timestamp,
-                            pm.message_text as snippet
-                        FROM private_messages pm
-                        JOIN users u ON pm.sender_id = u.id
-                        WHERE (
-                            (pm.sender_id = ? AND pm.receiver_id = ?) OR 
-                            (pm.sender_id = ? AND pm.receiver_id = ?)
-                        )
-                        AND pm.message_text LIKE ?
-                        ORDER BY pm.timestamp DESC
-                        LIMIT ? OFFSET ?
+                    partner_id = UserModel.get_user_id(chat_id)
+                    if not partner_id:
+                        return empty_result
+                    conversation_id = MessageModel._conversation_id(cursor, user_id, partner_id)
+                    if conversation_id is None:
+                        return empty_result
+
+                    fts_table = 'private_messages_fts'
+                    source = """
+                        FROM private_messages_fts
+                        JOIN private_messages m ON m.id = private_messages_fts.rowid
+                        JOIN users u ON m.sender_id = u.id
+                        WHERE private_messages_fts MATCH ?
+                        AND m.conversation_id = ?
                     """
-                    params = [
-                        user_id, partner[0],  # user_id -> partner
-                        partner[0], user_id,  # partner -> user_id
-                        f'%{search_query}%',
-                        per_page, (page - 1) * per_page
-                    ]
-                    
-                    count_query = """
-                        SELECT COUNT(*) 
-                        FROM private_messages 
-                        WHERE (
-                            (sender_id = ? AND receiver_id = ?) OR 
-                            (sender_id = ? AND receiver_id = ?)
-                        )
-                        AND message_text LIKE ?
+                    params = [match, conversation_id]
+                    id_column = 'm.id'
+                    columns = "m.id, m.message_text, u.username, m.timestamp"
+                    count_key = ('private', str(user_id), partner_id, match)
+                else:
+                    # general - это группа с id 0
+                    group_id = chat_id if message_type == 'group' else 0
+
+                    fts_table = 'group_messages_fts'
+                    source = """
+                        FROM group_messages_fts
+                        JOIN group_messages m ON m.message_id = group_messages_fts.rowid
+                        LEFT JOIN users u ON m.user_id = u.id
+                        WHERE group_messages_fts MATCH ? AND m.group_id = ?
                     """
-                    count_params = [
-                        user_id, partner[0],
-                        partner[0], user_id,
-                        f'%{search_query}%'
-                    ]
-                    
-                else:  # general
-                    query = """
-                        SELECT 
-                            gm.message_id as id,
-                            gm.message_text as text,
-                            CASE 
-                                WHEN gm.user_id = 0 THEN 'System'
-                                ELSE u.username
-                            END as sender,
-                            gm.timestamp,
-                            gm.message_text as snippet
-                        FROM group_messages gm
-                        LEFT JOIN users u ON gm.user_id = u.id
-                        WHERE gm.group_id = 0 AND gm.message_text LIKE ?
-                        ORDER BY gm.timestamp DESC
-                        LIMIT ? OFFSET ?
+                    params = [match, group_id]
+                    id_column = 'm.message_id'
+                    count_key = ('group', str(group_id), match)
+                    columns = """
+                        m.message_id,
+                        m.message_text,
+                        CASE 
+                            WHEN m.user_id = 0 THEN 'System'
+                            ELSE u.username
+                        END,
+                        m.timestamp
                     """
-                    params = [f'%{search_query}%', per_page, (page - 1) * per_page]
 
-                    count_query = """
-                        SELECT COUNT(*) 
-                        FROM group_messages 
-                        WHERE group_id = 0 AND message_text LIKE ?
-                    """
-                    count_params = [f'%{search_query}%']
-                
-                # Выполняем поиск
-                cursor.execute(query, params)
-                messages = []
-                for row in cursor.fetchall():
-                    messages.append({
-                        'id': row[0],
-                        'text': row[1],
-                        'sender': row[2],
-                        'timestamp': row[3],
-                        'snippet': row[4]
-                    })
-                
-                # Получаем общее количество
-                cursor.execute(count_query, count_params)
-                total = cursor.fetchone()[0]
-                
+                page_source = source
+                page_params = list(params)
+                offset = (page - 1) * per_page
+                if sort == 'relevance':
+                    order = f"bm25({fts_table}), m.timestamp DESC, {id_column} DESC"
+                else:
+                    order = f"m.timestamp DESC, {id_column} DESC"
+                    if before:
+                        # Keyset-пагинация: продолжаем после последней строки страницы
+                        page_source += f"""
+                            AND (m.timestamp < ? OR (m.timestamp = ? AND {id_column} < ?))
+                        """
+                        page_params += [before[0], before[0], before[1]]
+                        offset = 0
+
+                # Выполняем поиск (на одну строку больше, чтобы узнать, есть ли продолжение)
+                cursor.execute(f"""
+                    SELECT {columns},
+                        snippet({fts_table}, 0, ?, ?, '…', ?)
+                    {page_source}
+                    ORDER BY {order}
+                    LIMIT ? OFFSET ?
+                """, [SNIPPET_MARK_OPEN, SNIPPET_MARK_CLOSE, SNIPPET_TOKENS]
+                     + page_params + [per_page + 1, offset])
+                rows = cursor.fetchall()
+                has_more = len(rows) > per_page
+                rows = rows[:per_page]
+
+                messages = [{
+                    'id': row[0],
+                    'text': row[1],
+                    'sender': row[2],
+                    'timestamp': row[3],
+                    'snippet': MessageModel._format_snippet(row[4])
+                } for row in rows]
+
+                next_before = None
+                if has_more and sort != 'relevance':
+                    next_before = [rows[-1][3], rows[-1][0]]
+
+                # Получаем общее количество; первая страница - новая выдача, считаем заново
+                total, total_exact = MessageModel._count_matches(
+                    cursor, source, params, count_key,
+                    use_cache=bool(before) or page > 1
+                )
+
                 return {
                     'messages': messages,
                     'total': total,
+                    'total_exact': total_exact,
                     'page': page,
-                    'per_page': per_page
+                    'per_page': per_page,
+                    'next_before': next_before
                 }
-                
+
         except Exception as e:
             logging.error(f"Search error: {str(e)}")
-            return {
-                'messages': [],
-                'total': 0,
-                'page': page,
-                'per_page': per_page
-            }
\ No newline at end of file
+            return empty_result
@@ -1,22 +1,115 @@
+import os
 import sqlite3
 import logging
-import bcrypt
+import threading
 import re
 from werkzeug.utils import secure_filename
 from typing import List, Dict, Optional
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from contextlib import contextmanager
-from utils import get_db_cursor
+from utils import get_db_cursor, get_read_cursor, hash_password, check_password, PasswordHashingBusy
 from datetime import datetime
 
+# Имя пользователя не меняется после регистрации, поэтому пары имя <-> id
+# кешируются без срока жизни; давно не использованные вытесняются
+USER_CACHE_SIZE = int(os.environ.get('MESSENGER_USER_CACHE_SIZE', 10000))
+
+
+class UserCache:
+    """
+    Двусторонний LRU-кеш имя -> id и id -> имя.
+    Отсутствующие пользователи не кешируются: имя может появиться позже.
+    """
+
+    def __init__(self, size: int = USER_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._by_id = OrderedDict()
+        self._by_name = {}
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def get_id(self, username: str) -> Optional[int]:
+        with self._lock:
+            user_id = self._by_name.get(username)
+            return self._touch(user_id)
+
+    def get_name(self, user_id: int) -> Optional[str]:
+        with self._lock:
+            username = self._by_id.get(user_id)
+            self._touch(user_id if username is not None else None)
+            return username
+
+    def put(self, user_id: int, username: str) -> None:
+        with self._lock:
+            self._by_id[user_id] = username
+            self._by_id.move_to_end(user_id)
+            self._by_name[username] = user_id
+            while len(self._by_id) > self.size:
+                _, evicted = self._by_id.popitem(last=False)
+                self._by_name.pop(evicted, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_id.clear()
+            self._by_name.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._by_id)
+        return stats
+
+    def _touch(self, user_id):
+        if user_id is None:
+            self._stats['misses'] += 1
+            return None
+        self._stats['hits'] += 1
+        self._by_id.move_to_end(user_id)
+        return user_id
+
+
+_user_cache = UserCache()
+
+
 class UserModel:
     @staticmethod
     def get_user_id(username: str) -> Optional[int]:
         """Получает ID пользователя по имени"""
-        with get_db_cursor() as cursor:
+        if not isinstance(username, str):
+            return None
+        user_id = _user_cache.get_id(username)
+        if user_id is not None:
+            return user_id
+        with get_read_cursor() as cursor:
             cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
             result = cursor.fetchone()
-            return result[0] if result else None
+        if not result:
+            return None
+        _user_cache.put(result[0], username)
+        return result[0]
+
+    @staticmethod
+    def get_username(user_id: int) -> Optional[str]:
+        """Получает имя пользователя по ID"""
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        username = _user_cache.get_name(user_id)
+        if username is not None:
+            return username
+        with get_read_cursor() as cursor:
+            cursor.execute('SELECT username FROM users WHERE id = ?', (user_id,))
+            result = cursor.fetchone()
+        if not result:
+            return None
+        _user_cache.put(user_id, result[0])
+        return result[0]
+
+    @staticmethod
+    def cache_stats() -> Dict:
+        """Попадания и промахи кеша имя <-> id"""
+        return _user_cache.stats()
 
     @staticmethod
     def create_user(username: str, password: str) -> tuple:
@@ -31,16 +124,20 @@ class UserModel:
             return False, 'Пароль должен быть не менее 6 символов'
 
         try:
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+            hashed_password = hash_password(password)
             with get_db_cursor() as cursor:
                 cursor.execute(
                     'INSERT INTO users (username, password) VALUES (?, ?)',
                     (username, hashed_password)
                 )
+                user_id = cursor.lastrowid
                 cursor.connection.commit()
+            _user_cache.put(user_id, username)
             return True, None
         except sqlite3.IntegrityError:
             return False, 'Пользователь с таким именем уже существует'
+        except PasswordHashingBusy:
+            raise
         except Exception as e:
             logging.error(f"Registration error: {str(e)}")
             return False, 'Ошибка сервера при регистрации'
@@ -52,21 +149,25 @@ class UserModel:
         Возвращает (user_id, error_message)
         """
         try:
-            with get_db_cursor() as cursor:
+            with get_read_cursor() as cursor:
                 cursor.execute(
                     'SELECT id, password FROM users WHERE username=?',
                     (username,)
                 )
                 result = cursor.fetchone()
                 
-                if not result:
-                    return None, 'Пользователь не найден'
-                
-                user_id, hashed_password = result
-                if not bcrypt.checkpw(password.encode('utf-8'), hashed_password):
-                    return None, 'Неверный пароль'
-                
-                return user_id, None
+            if not result:
+                return None, 'Пользователь не найден'
+            
+            # Проверка пароля не держит соединение из пула читателей
+            user_id, hashed_password = result
+            if not check_password(hashed_password, password):
+                return None, 'Неверный пароль'
+            
+            _user_cache.put(user_id, username)
+            return user_id, None
+        except PasswordHashingBusy:
+            raise
         except Exception as e:
             logging.error(f"Auth error: {str(e)}")
             return None, 'Ошибка аутентификации'
@@ -74,18 +175,13 @@ class UserModel:
     @staticmethod
     def get_user_by_id(user_id: int) -> dict:
         """Получает данные пользователя по ID"""
-        with get_db_cursor() as cursor:
-            cursor.execute(
-                'SELECT id, username FROM users WHERE id = ?',
-                (user_id,)
-            )
-            result = cursor.fetchone()
-            return {'id': result[0], 'username': result[1]} if result else None
+        username = UserModel.get_username(user_id)
+        return {'id': int(user_id), 'username': username} if username is not None else None
 
     @staticmethod
     def search_users(query: str, exclude_user_id: int = None) -> list:
         """Поиск пользователей по имени"""
-        with get_db_cursor() as cursor:
+        with get_read_cursor() as cursor:
             params = [f'%{query}%']
             if exclude_user_id:
                 cursor.execute(
@@ -2,8 +2,11 @@ from .GroupModel import *
 from .MessageModel import *
 from .UserModel import *
 from .session import *
+from .blob_store import *
 
 __all__ = [
     'GroupModel' , 'MessageModel', 'UserModel',
-    'create_session', 'get_key', 'delete_session'
+    'create_session', 'get_key', 'delete_session',
+    'start_session_sweeper', 'stop_session_sweeper', 'get_session_stats',
+    'blob_store', 'start_blob_collector', 'stop_blob_collector', 'get_blob_stats'
 ]
\ No newline at end of file
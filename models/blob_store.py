@@ -0,0 +1,190 @@
+from utils import get_db_cursor, get_read_cursor, run_write, UploadedFile
+import os
+import time
+import logging
+import threading
+
+# Каталог хранилища: файлы в objects/<2 символа хеша>/<ещё 2>/<хеш>,
+# временные файлы загрузок в tmp
+BLOB_ROOT = os.environ.get('MESSENGER_BLOB_ROOT', os.path.join('static', 'uploads'))
+# Файл без ссылок удаляется не раньше чем через столько секунд: за это время
+# только что загруженный файл успевает попасть во вложение
+BLOB_GC_GRACE = int(os.environ.get('MESSENGER_BLOB_GC_GRACE', 3600))
+# Период сборки, размер пачки и пауза между пачками
+BLOB_GC_INTERVAL = int(os.environ.get('MESSENGER_BLOB_GC_INTERVAL', 600))
+BLOB_GC_BATCH = int(os.environ.get('MESSENGER_BLOB_GC_BATCH', 100))
+BLOB_GC_PAUSE = float(os.environ.get('MESSENGER_BLOB_GC_PAUSE', 0.5))
+
+
+class BlobStore:
+    """
+    Хранилище файлов вложений по содержимому.
+
+    Файл хранится один раз на хеш SHA-256, сколько бы вложений и под
+    какими именами на него ни ссылалось. Таблица blobs хранит размер и
+    число ссылок; счётчик меняют триггеры на attachments. Файлы без ссылок
+    удаляет collect_garbage.
+    """
+
+    def __init__(self, root=BLOB_ROOT):
+        self.root = root
+        self.temp_dir = os.path.join(root, 'tmp')
+        self._lock = threading.Lock()
+        self._stats = {'stored': 0, 'deduplicated': 0, 'collected': 0, 'collected_bytes': 0}
+
+    def path(self, blob_hash):
+        return os.path.join(self.root, 'objects', blob_hash[:2], blob_hash[2:4], blob_hash)
+
+    def put(self, upload):
+        """
+        Кладёт UploadedFile в хранилище и возвращает хеш содержимого.
+        """
+        blob_hash = upload.sha256
+        # Запись о файле фиксируется раньше, чем файл переносится на место:
+        # сборщик удаляет файлы, держа соединение-писатель, и после этой
+        # записи не тронет файл до истечения BLOB_GC_GRACE
+        def register(cursor):
+            cursor.execute('''
+                INSERT INTO blobs (hash, size, refcount, released_at)
+                VALUES (?, ?, 0, ?)
+                ON CONFLICT(hash) DO UPDATE SET released_at = CASE
+                    WHEN refcount = 0 THEN excluded.released_at ELSE released_at END
+            ''', (blob_hash, upload.size, int(time.time())))
+
+        run_write(register)
+        file_path = self.path(blob_hash)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        exists = os.path.exists(file_path)
+        upload.move_to(file_path)
+        with self._lock:
+            self._stats['deduplicated' if exists else 'stored'] += 1
+        return blob_hash
+
+    def collect_garbage(self, now=None, batch=BLOB_GC_BATCH, pause=BLOB_GC_PAUSE, grace=BLOB_GC_GRACE):
+        """
+        Удаляет файлы без ссылок пачками по batch, отпуская соединение-писатель
+        и делая паузу pause секунд между пачками. Возвращает число удалённых файлов.
+        """
+        if now is None:
+            now = int(time.time())
+        removed = 0
+        while True:
+            with get_db_cursor() as cursor:
+                cursor.execute('''
+                    SELECT hash, size FROM blobs
+                    WHERE refcount = 0 AND released_at <= ?
+                    LIMIT ?
+                ''', (now - grace, batch))
+                blobs = cursor.fetchall()
+                cursor.executemany(
+                    'DELETE FROM blobs WHERE hash = ? AND refcount = 0',
+                    [(blob_hash,) for blob_hash, _ in blobs]
+                )
+                # Файлы удаляются до фиксации: загрузка того же файла ждёт
+                # соединение-писатель и после него положит файл заново
+                for blob_hash, _ in blobs:
+                    try:
+                        os.remove(self.path(blob_hash))
+                    except FileNotFoundError:
+                        pass
+            with self._lock:
+                self._stats['collected'] += len(blobs)
+                self._stats['collected_bytes'] += sum(size for _, size in blobs)
+            removed += len(blobs)
+            if len(blobs) < batch:
+                return removed
+            time.sleep(pause)
+
+    def import_legacy_uploads(self):
+        """
+        Переносит в хранилище файлы вложений, сохранённые до его появления
+        (static/uploads/<md5>_<имя>). Ссылки на них (file_path) не меняются.
+        Возвращает число перенесённых файлов.
+        """
+        with get_read_cursor() as cursor:
+            cursor.execute('SELECT DISTINCT file_path FROM attachments WHERE blob_hash IS NULL')
+            paths = [row[0] for row in cursor.fetchall()]
+
+        imported = 0
+        for file_path in paths:
+            legacy_path = file_path.lstrip('/')
+            if '..' in legacy_path.split('/') or not os.path.isfile(legacy_path):
+                continue
+            try:
+                os.makedirs(self.temp_dir, exist_ok=True)
+                with open(legacy_path, 'rb') as f:
+                    upload = UploadedFile.from_stream(f, os.path.basename(legacy_path), None, self.temp_dir)
+                blob_hash = self.put(upload)
+                with get_db_cursor() as cursor:
+                    cursor.execute(
+                        'UPDATE attachments SET blob_hash = ? WHERE file_path = ? AND blob_hash IS NULL',
+                        (blob_hash, file_path)
+                    )
+                os.remove(legacy_path)
+                imported += 1
+            except Exception as e:
+                logging.error(f"Error importing upload {file_path}: {str(e)}")
+        return imported
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        with get_read_cursor() as cursor:
+            cursor.execute('''
+                SELECT count(*), coalesce(sum(size), 0), coalesce(sum(refcount = 0), 0)
+                FROM blobs
+            ''')
+            stats['blobs'], stats['bytes'], stats['unreferenced'] = cursor.fetchone()
+        return stats
+
+
+blob_store = BlobStore()
+
+
+class _Collector:
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, interval):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name='blob-collector', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                blob_store.collect_garbage()
+            except Exception as e:
+                logging.error(f"Blob collection error: {str(e)}")
+
+
+_collector = _Collector()
+
+
+def start_blob_collector(interval=BLOB_GC_INTERVAL):
+    """
+    Запускает фоновое удаление файлов без ссылок.
+    """
+    _collector.start(interval)
+
+
+def stop_blob_collector():
+    _collector.stop()
+
+
+def get_blob_stats():
+    """
+    Возвращает метрики хранилища файлов.
+    """
+    return blob_store.stats()
@@ -0,0 +1,165 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from utils import subscribe_remote_events
+
+# Для скольких пользователей хранятся роли в группах
+GROUP_ACCESS_CACHE_SIZE = int(os.environ.get('MESSENGER_GROUP_ACCESS_CACHE_SIZE', 10000))
+
+
+def _key(value) -> Optional[int]:
+    # id из cookies и параметров запроса приходят строками
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class GroupAccessCache:
+    """
+    Кеш членства в группах: user_id -> {group_id: role}.
+
+    Роли пользователя загружаются из group_members целиком одним запросом
+    (fill), поэтому и проверка доступа к группе, и список групп
+    пользователя - поиск в словаре. Записи GroupModel после фиксации
+    точечно обновляют кеш: set_role при вступлении и смене роли, remove при
+    выходе и исключении, drop_group при удалении группы.
+
+    Записи других процессов приходят событиями 'group' через шину
+    (MESSENGER_BUS_SOCKET_DIR) и применяются так же.
+
+    Каждая запись увеличивает версию пользователя (drop_group - общую
+    версию); fill с устаревшей версией отбрасывается, поэтому снимок,
+    прочитанный до записи, не заменяет более новое состояние.
+    """
+
+    def __init__(self, size: int = GROUP_ACCESS_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        self._versions = {}
+        self._generation = 0
+        # group_id -> пользователи в кеше, состоящие в группе
+        self._members = {}
+        self._stats = {'hits': 0, 'misses': 0, 'fills': 0, 'stale_fills': 0}
+
+    def get(self, user_id: int) -> Optional[Dict[int, str]]:
+        """
+        Возвращает копию ролей пользователя или None, если их нет в кеше.
+        """
+        with self._lock:
+            roles = self._users.get(user_id)
+            if roles is None:
+                self._stats['misses'] += 1
+                return None
+            self._users.move_to_end(user_id)
+            self._stats['hits'] += 1
+            return dict(roles)
+
+    def version(self, user_id: int) -> tuple:
+        """
+        Версия пользователя для последующего fill.
+        """
+        with self._lock:
+            return self._versions.get(user_id, 0), self._generation
+
+    def fill(self, user_id: int, version: tuple, roles: Dict[int, str]) -> None:
+        with self._lock:
+            if version != (self._versions.get(user_id, 0), self._generation):
+                self._stats['stale_fills'] += 1
+                return
+            self._drop(user_id)
+            self._users[user_id] = dict(roles)
+            for group_id in roles:
+                self._members.setdefault(group_id, set()).add(user_id)
+            self._stats['fills'] += 1
+            while len(self._users) > self.size:
+                self._drop(next(iter(self._users)))
+
+    def set_role(self, user_id: int, group_id: int, role: str) -> None:
+        user_id, group_id = _key(user_id), _key(group_id)
+        with self._lock:
+            self._bump(user_id)
+            roles = self._users.get(user_id)
+            if roles is not None:
+                roles[group_id] = role
+                self._members.setdefault(group_id, set()).add(user_id)
+
+    def remove(self, user_id: int, group_id: int) -> None:
+        user_id, group_id = _key(user_id), _key(group_id)
+        with self._lock:
+            self._bump(user_id)
+            roles = self._users.get(user_id)
+            if roles is not None:
+                roles.pop(group_id, None)
+                self._discard_member(group_id, user_id)
+
+    def drop_group(self, group_id: int) -> None:
+        """
+        Убирает удалённую группу у всех пользователей.
+        """
+        group_id = _key(group_id)
+        with self._lock:
+            self._generation += 1
+            for user_id in self._members.pop(group_id, ()):
+                self._users[user_id].pop(group_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._users.clear()
+            self._members.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['users'] = len(self._users)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _bump(self, user_id):
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def _discard_member(self, group_id, user_id):
+        members = self._members.get(group_id)
+        if members is not None:
+            members.discard(user_id)
+            if not members:
+                del self._members[group_id]
+
+    def _drop(self, user_id):
+        roles = self._users.pop(user_id, None)
+        if roles is not None:
+            for group_id in roles:
+                self._discard_member(group_id, user_id)
+
+
+group_access = GroupAccessCache()
+
+
+def get_group_access_stats() -> Dict:
+    """
+    Возвращает метрики кеша членства в группах.
+    """
+    return group_access.stats()
+
+
+def _apply_remote_change(topics, event, payload, frame):
+    # Изменение членства, записанное другим процессом
+    if event != 'group':
+        return
+    op, group_id, user_id = payload.get('op'), payload.get('group_id'), payload.get('user_id')
+    if op == 'delete':
+        group_access.drop_group(group_id)
+    elif op in ('member_remove', 'leave'):
+        group_access.remove(user_id, group_id)
+    elif op == 'create':
+        group_access.set_role(user_id, group_id, 'owner')
+    elif op in ('member_add', 'role'):
+        group_access.set_role(user_id, group_id, payload['role'])
+
+
+subscribe_remote_events(_apply_remote_change)
@@ -0,0 +1,227 @@
+import os
+import bisect
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from utils import subscribe_remote_events
+
+# Сколько последних сообщений хранится для каждого чата
+RECENT_CACHE_SIZE = int(os.environ.get('MESSENGER_RECENT_CACHE_SIZE', 200))
+# Сколько чатов держится в памяти; давно не читавшиеся вытесняются
+RECENT_CACHE_CHATS = int(os.environ.get('MESSENGER_RECENT_CACHE_CHATS', 1000))
+
+
+def _copy(message: Dict) -> Dict:
+    # Вызывающий код может дополнять сообщение, поэтому наружу отдаются копии
+    return dict(message, attachments=[dict(a) for a in message['attachments']])
+
+
+class _ChatBuffer:
+    __slots__ = ('keys', 'messages', 'complete_after')
+
+    def __init__(self, complete_after):
+        # Отсортированы по (timestamp, id)
+        self.keys = []
+        self.messages = []
+        # Буфер содержит все сообщения чата с timestamp > complete_after;
+        # None - все сообщения чата
+        self.complete_after = complete_after
+
+
+class RecentMessagesCache:
+    """
+    Кольцевой буфер последних сообщений общего и групповых чатов.
+
+    Для каждого чата ('g:<id>') хранится не больше size последних сообщений
+    вместе с вложениями - в том же виде, в каком их возвращает
+    MessageModel. Запрос timestamp > ? отвечается из памяти, если буфер
+    содержит все сообщения чата после timestamp; иначе нужен SQLite.
+
+    Буфер заполняется при первом чтении чата (fill) и дальше поддерживается
+    записями: add после вставки, update_text/remove после правки и удаления.
+    Сообщения, записанные другими процессами (шина с
+    MESSENGER_BUS_SOCKET_DIR), сбрасывают буфер чата целиком (invalidate).
+
+    Каждая запись увеличивает версию чата; fill с устаревшей версией
+    отбрасывается, поэтому снимок, прочитанный до записи, не заменяет
+    более новое состояние.
+    """
+
+    def __init__(self, size: int = RECENT_CACHE_SIZE, max_chats: int = RECENT_CACHE_CHATS):
+        self.size = size
+        self.max_chats = max_chats
+        self._lock = threading.Lock()
+        self._chats = OrderedDict()
+        self._versions = {}
+        # id сообщения -> чат; вложения добавляются по id сообщения
+        self._index = {}
+        self._attachments_version = 0
+        self._stats = {'hits': 0, 'misses': 0, 'fills': 0, 'stale_fills': 0, 'evicted_chats': 0}
+
+    def get(self, chat: str, timestamp: int) -> Optional[List[Dict]]:
+        """
+        Возвращает сообщения чата новее timestamp или None, если
+        буфера нет или timestamp старше его начала.
+        """
+        with self._lock:
+            buffer = self._chats.get(chat)
+            if buffer is None or (buffer.complete_after is not None and timestamp < buffer.complete_after):
+                self._stats['misses'] += 1
+                return None
+            self._chats.move_to_end(chat)
+            self._stats['hits'] += 1
+            start = bisect.bisect_right(buffer.keys, (timestamp, float('inf')))
+            return [_copy(m) for m in buffer.messages[start:]]
+
+    def has(self, chat: str) -> bool:
+        with self._lock:
+            return chat in self._chats
+
+    def version(self, chat: str) -> tuple:
+        """
+        Версия чата для последующего fill.
+        """
+        with self._lock:
+            return self._versions.get(chat, 0), self._attachments_version
+
+    def fill(self, chat: str, version: tuple, messages: List[Dict]) -> None:
+        """
+        Заполняет буфер чата последними сообщениями, прочитанными из базы.
+        messages - не больше size сообщений по возрастанию времени;
+        если их ровно size, более старые сообщения в буфер не попали.
+        """
+        with self._lock:
+            if version != (self._versions.get(chat, 0), self._attachments_version):
+                self._stats['stale_fills'] += 1
+                return
+            complete_after = messages[0]['timestamp'] if len(messages) >= self.size else None
+            self._drop(chat)
+            buffer = _ChatBuffer(complete_after)
+            self._chats[chat] = buffer
+            for message in messages:
+                self._insert(chat, buffer, _copy(message))
+            self._stats['fills'] += 1
+            while len(self._chats) > self.max_chats:
+                self._drop(next(iter(self._chats)))
+                self._stats['evicted_chats'] += 1
+
+    def add(self, chat: str, message: Dict) -> None:
+        """
+        Добавляет только что записанное сообщение (или заменяет его копию).
+        """
+        with self._lock:
+            self._bump(chat)
+            buffer = self._chats.get(chat)
+            if buffer is None:
+                return
+            self._remove(buffer, message['id'])
+            self._insert(chat, buffer, _copy(message))
+
+    def add_attachment(self, message_id: int, attachment: Dict) -> None:
+        with self._lock:
+            self._attachments_version += 1
+            chat = self._index.get(message_id)
+            if chat is None:
+                return
+            buffer = self._chats[chat]
+            for message in buffer.messages:
+                if message['id'] == message_id:
+                    message['attachments'].append(dict(attachment))
+                    break
+
+    def update_text(self, chat: str, message_id: int, text: str) -> None:
+        with self._lock:
+            self._bump(chat)
+            buffer = self._chats.get(chat)
+            if buffer is None:
+                return
+            for message in buffer.messages:
+                if message['id'] == message_id:
+                    message['message_text'] = text
+                    break
+
+    def remove(self, chat: str, message_id: int) -> None:
+        with self._lock:
+            self._bump(chat)
+            buffer = self._chats.get(chat)
+            if buffer is not None:
+                self._remove(buffer, message_id)
+
+    def invalidate(self, chat: str) -> None:
+        """
+        Сбрасывает буфер чата после записи в обход MessageModel.
+        """
+        with self._lock:
+            self._bump(chat)
+            self._drop(chat)
+
+    def clear(self) -> None:
+        with self._lock:
+            for chat in list(self._chats):
+                self._bump(chat)
+                self._drop(chat)
+
+    def stats(self) -> Dict:
+        """
+        Метрики кеша: попадания, промахи, доля попаданий, заполнения.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['chats'] = len(self._chats)
+            stats['messages'] = len(self._index)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _bump(self, chat):
+        self._versions[chat] = self._versions.get(chat, 0) + 1
+
+    def _insert(self, chat, buffer, message):
+        key = (message['timestamp'], message['id'])
+        position = bisect.bisect(buffer.keys, key)
+        buffer.keys.insert(position, key)
+        buffer.messages.insert(position, message)
+        self._index[message['id']] = chat
+        # Вытесняем самые старые сообщения; после этого буфер полон
+        # только для запросов не старше вытесненного сообщения
+        while len(buffer.messages) > self.size:
+            evicted_ts, evicted_id = buffer.keys.pop(0)
+            buffer.messages.pop(0)
+            self._index.pop(evicted_id, None)
+            if buffer.complete_after is None or evicted_ts > buffer.complete_after:
+                buffer.complete_after = evicted_ts
+
+    def _remove(self, buffer, message_id):
+        for position, message in enumerate(buffer.messages):
+            if message['id'] == message_id:
+                del buffer.keys[position]
+                del buffer.messages[position]
+                self._index.pop(message_id, None)
+                return
+
+    def _drop(self, chat):
+        buffer = self._chats.pop(chat, None)
+        if buffer is not None:
+            for message in buffer.messages:
+                self._index.pop(message['id'], None)
+
+
+recent_messages = RecentMessagesCache()
+
+
+def get_recent_cache_stats() -> Dict:
+    """
+    Возвращает метрики кеша последних сообщений.
+    """
+    return recent_messages.stats()
+
+
+def _drop_remote_chat(topics, event, payload, frame):
+    # Сообщение записал другой процесс: буфер чата перечитается из базы
+    chat = payload.get('chat')
+    if event == 'message' and isinstance(chat, str) and chat.startswith('g:'):
+        recent_messages.invalidate(chat)
+
+
+subscribe_remote_events(_drop_remote_chat)
@@ -1,33 +1,272 @@
-from utils import get_db_cursor
+from utils import get_db_cursor, get_read_cursor, publish_event, subscribe_remote_events
+import os
+import time
 import uuid
+import logging
+import threading
+from collections import OrderedDict
 from Crypto.Random import get_random_bytes
 
+# Время жизни сессии в секундах; каждое обращение продлевает его (скользящий срок)
+SESSION_TTL = int(os.environ.get('MESSENGER_SESSION_TTL', 7 * 24 * 3600))
+# Продление записывается в базу не чаще раза в столько секунд на сессию
+SESSION_TOUCH_INTERVAL = int(os.environ.get('MESSENGER_SESSION_TOUCH_INTERVAL', 300))
+# Сколько ключей сессий держится в памяти
+SESSION_CACHE_SIZE = int(os.environ.get('MESSENGER_SESSION_CACHE_SIZE', 10000))
+# Период и размер пачки фоновой очистки просроченных сессий
+SESSION_SWEEP_INTERVAL = int(os.environ.get('MESSENGER_SESSION_SWEEP_INTERVAL', 60))
+SESSION_SWEEP_BATCH = int(os.environ.get('MESSENGER_SESSION_SWEEP_BATCH', 500))
+
+
+class _Session:
+    __slots__ = ('key', 'expires_at', 'stored_expires_at')
+
+    def __init__(self, key, expires_at):
+        self.key = key
+        self.expires_at = expires_at
+        # Срок, записанный в базу; отстаёт от expires_at не больше
+        # чем на SESSION_TOUCH_INTERVAL
+        self.stored_expires_at = expires_at
+
+
+class SessionCache:
+    """
+    LRU-кеш ключей сессий со сроком действия.
+
+    Кроме действующих сессий помнит ограниченное число отсутствующих
+    (удалённых, просроченных, не найденных в базе), поэтому повторные
+    запросы с такими session_id отклоняются без обращения к базе.
+
+    Кеш свой у каждого процесса: удаление сессии рассылается через шину
+    событий, и другие процессы убирают её из своих кешей.
+    """
+
+    def __init__(self, size=SESSION_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._missing = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'rejected': 0, 'expired': 0}
+
+    def touch(self, session_id, now):
+        """
+        Продлевает сессию из кеша. Возвращает (ключ, срок для записи в базу
+        или None) либо None, если сессии нет в кеше.
+        Просроченная или отсутствующая сессия даёт (None, None).
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                if session_id in self._missing:
+                    self._stats['rejected'] += 1
+                    return None, None
+                self._stats['misses'] += 1
+                return None
+            if entry.expires_at <= now:
+                self._stats['expired'] += 1
+                self._forget(session_id)
+                return None, None
+            self._sessions.move_to_end(session_id)
+            self._stats['hits'] += 1
+            entry.expires_at = now + SESSION_TTL
+            if entry.expires_at - entry.stored_expires_at < SESSION_TOUCH_INTERVAL:
+                return entry.key, None
+            entry.stored_expires_at = entry.expires_at
+            return entry.key, entry.expires_at
+
+    def put(self, session_id, key, expires_at):
+        with self._lock:
+            if session_id in self._missing:
+                # Сессию удалили, пока её читали из базы
+                return
+            self._sessions[session_id] = _Session(key, expires_at)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.size:
+                self._sessions.popitem(last=False)
+
+    def forget(self, *session_ids):
+        """
+        Помечает сессии отсутствующими.
+        """
+        with self._lock:
+            for session_id in session_ids:
+                self._forget(session_id)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._missing.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['sessions'] = len(self._sessions)
+            stats['missing'] = len(self._missing)
+        return stats
+
+    def _forget(self, session_id):
+        self._sessions.pop(session_id, None)
+        self._missing[session_id] = True
+        self._missing.move_to_end(session_id)
+        while len(self._missing) > self.size:
+            self._missing.popitem(last=False)
+
+
+_sessions = SessionCache()
+
+
+def _valid_session_id(session_id):
+    # Идентификаторы выдаёт create_session: всё остальное не ищем в базе
+    try:
+        return str(uuid.UUID(session_id)) == session_id
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+
 def create_session():
     """
     Создать идентификатор сессии.
     Создать сессионный ключ.
     """
     session_id = str(uuid.uuid4())
+    expires_at = int(time.time()) + SESSION_TTL
     with get_db_cursor() as cursor:
             key = get_random_bytes(16)
-            cursor.execute(f"INSERT INTO session VALUES (?, ?)", (session_id, key))
+            cursor.execute(
+                "INSERT INTO session (id, key, expires_at) VALUES (?, ?, ?)",
+                (session_id, key, expires_at)
+            )
             cursor.connection.commit()
+    _sessions.put(session_id, key, expires_at)
     return (session_id, key)
 
 def get_key(session_id):
     """
-    Получить ключ по session_id
+    Получить ключ по session_id и продлить сессию.
+    Возвращает None, если сессия не существует или просрочена.
     """
-    with get_db_cursor() as cursor:
-        cursor.execute(f"SELECT key FROM session WHERE id = ?", (session_id, ))
-        return cursor.fetchone()[0]
+    if not _valid_session_id(session_id):
+        return None
+    now = int(time.time())
+    cached = _sessions.touch(session_id, now)
+    if cached is None:
+        with get_read_cursor() as cursor:
+            cursor.execute("SELECT key, expires_at FROM session WHERE id = ?", (session_id, ))
+            row = cursor.fetchone()
+        if row is None or row[1] <= now:
+            _sessions.forget(session_id)
+            return None
+        _sessions.put(session_id, bytes(row[0]), row[1])
+        cached = _sessions.touch(session_id, now)
+        if cached is None:
+            # Кеш переполнен другими потоками
+            return bytes(row[0])
+    key, expires_at = cached
+    if expires_at is not None:
+        try:
+            with get_db_cursor() as cursor:
+                cursor.execute("UPDATE session SET expires_at = ? WHERE id = ?", (expires_at, session_id))
+                cursor.connection.commit()
+        except Exception as e:
+            logging.error(f"Session touch error: {str(e)}")
+    return key
 
 
 def delete_session(session_id):
         """
         Удаление сессии.
         """
-        with get_db_cursor() as cursor: 
+        _sessions.forget(session_id)
+        with get_db_cursor() as cursor:
                cursor.execute(f"DELETE FROM session WHERE id = ?", (session_id,))
                cursor.connection.commit()
-        return True
\ No newline at end of file
+        _publish_forget([session_id])
+        return True
+
+
+def _publish_forget(session_ids):
+    # Событие без тем: его получают только кеши сессий других процессов.
+    # По 1000 id, чтобы событие поместилось в датаграмму шины
+    for start in range(0, len(session_ids), 1000):
+        publish_event((), 'session', {'op': 'delete', 'ids': list(session_ids[start:start + 1000])})
+
+
+def _forget_remote(topics, event, payload, frame):
+    if event == 'session' and payload.get('op') == 'delete':
+        _sessions.forget(*payload.get('ids', ()))
+
+
+subscribe_remote_events(_forget_remote)
+
+
+def sweep_expired_sessions(now=None, batch=SESSION_SWEEP_BATCH):
+    """
+    Удаляет просроченные сессии пачками по batch строк, отпуская
+    соединение-писатель между пачками. Возвращает число удалённых сессий.
+    """
+    if now is None:
+        now = int(time.time())
+    removed = 0
+    while True:
+        with get_db_cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM session WHERE expires_at <= ? LIMIT ?", (now, batch)
+            )
+            expired = [row[0] for row in cursor.fetchall()]
+            cursor.executemany("DELETE FROM session WHERE id = ?", [(i,) for i in expired])
+            cursor.connection.commit()
+        _sessions.forget(*expired)
+        if expired:
+            _publish_forget(expired)
+        removed += len(expired)
+        if len(expired) < batch:
+            return removed
+
+
+class _Sweeper:
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, interval):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name='session-sweeper', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                sweep_expired_sessions()
+            except Exception as e:
+                logging.error(f"Session sweep error: {str(e)}")
+
+
+_sweeper = _Sweeper()
+
+
+def start_session_sweeper(interval=SESSION_SWEEP_INTERVAL):
+    """
+    Запускает фоновую очистку просроченных сессий.
+    """
+    _sweeper.start(interval)
+
+
+def stop_session_sweeper():
+    _sweeper.stop()
+
+
+def get_session_stats():
+    """
+    Возвращает метрики кеша сессий.
+    """
+    return _sessions.stats()
@@ -1,8 +1,10 @@
 import unittest
+import sys
 import sqlite3
 import time
 import os
 from utils.db_utils import *
+from utils.migrations import migrate
 from contextlib import contextmanager
 from io import BytesIO
 from datetime import datetime
@@ -80,11 +82,18 @@ def init_schema(conn):
         ON group_messages(message_text COLLATE NOCASE)
     ''')
     conn.commit()
+    # Доводим схему до актуальной версии теми же миграциями, что и приложение
+    migrate(conn)
 
 # Импорт тестируемых моделей
 from models.UserModel import UserModel
 from models.GroupModel import GroupModel
 from models.MessageModel import MessageModel
+from models.message_cache import RecentMessagesCache, recent_messages
+from models.group_cache import GroupAccessCache, group_access
+# Модуль целиком: пакет models переэкспортирует одноимённый класс
+message_model = sys.modules[MessageModel.__module__]
+user_model = sys.modules[UserModel.__module__]
 
 ######################################
 #            ПОЛЬЗОВАТЕЛЬ            #
@@ -98,12 +107,18 @@ class TestUserModel(unittest.TestCase):
         init_schema(self.conn)
         from utils import db_utils
         self.original_get_db_connection = db_utils.get_db_connection
-        db_utils.get_db_connection = lambda: self.conn
+        db_utils.get_db_connection = lambda readonly=False: self.conn
+        recent_messages.clear()
+        user_model._user_cache.clear()
+        group_access.clear()
 
     def tearDown(self):
         from utils import db_utils
         self.conn.close()
         db_utils.get_db_connection = self.original_get_db_connection
+        recent_messages.clear()
+        user_model._user_cache.clear()
+        group_access.clear()
 
     def test_create_user_valid(self):
         """Проверка успешного создания пользователя с валидными данными."""
@@ -166,6 +181,37 @@ class TestUserModel(unittest.TestCase):
         self.assertIsNone(user_id)
         self.assertIn("не найден", error.lower())
 
+    def test_username_lookups_are_cached(self):
+        """Имя и id нового пользователя берутся из кеша без запросов к базе."""
+        UserModel.create_user("cached", "pass123")
+        before = UserModel.cache_stats()
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        try:
+            user_id = UserModel.get_user_id("cached")
+            self.assertEqual(UserModel.get_username(user_id), "cached")
+            self.assertEqual(UserModel.get_user_by_id(user_id), {'id': user_id, 'username': "cached"})
+            self.assertIsNone(UserModel.get_user_id("ghost_user"))
+        finally:
+            self.conn.set_trace_callback(None)
+        self.assertEqual([sql for sql in statements if 'FROM users' in sql], [
+            'SELECT id FROM users WHERE username = \'ghost_user\''
+        ])
+        stats = UserModel.cache_stats()
+        self.assertEqual(stats['hits'] - before['hits'], 3)
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+
+    def test_user_cache_evicts_both_directions(self):
+        cache = user_model.UserCache(size=2)
+        cache.put(1, "one")
+        cache.put(2, "two")
+        cache.get_id("one")
+        cache.put(3, "three")
+        self.assertEqual(cache.get_id("one"), 1)
+        self.assertIsNone(cache.get_id("two"))
+        self.assertIsNone(cache.get_name(2))
+        self.assertEqual(cache.get_name(3), "three")
+
 ######################################
 #             ГРУППЫ               #
 ######################################
@@ -178,7 +224,10 @@ class TestGroupModel(unittest.TestCase):
         init_schema(self.conn)
         from utils import db_utils
         self.original_get_db_connection = db_utils.get_db_connection
-        db_utils.get_db_connection = lambda: self.conn
+        db_utils.get_db_connection = lambda readonly=False: self.conn
+        recent_messages.clear()
+        user_model._user_cache.clear()
+        group_access.clear()
         UserModel.create_user("group_owner", "password")
         self.owner_id = UserModel.get_user_id("group_owner")
 
@@ -189,6 +238,9 @@ class TestGroupModel(unittest.TestCase):
         from utils import db_utils
         self.conn.close()
         db_utils.get_db_connection = self.original_get_db_connection
+        recent_messages.clear()
+        user_model._user_cache.clear()
+        group_access.clear()
 
     def test_create_group_valid(self):
         """Проверка успешного создания группы с уникальным именем."""
@@ -437,6 +489,40 @@ class TestGroupModel(unittest.TestCase):
         random_id = UserModel.get_user_id("random_user")
         access = GroupModel.check_group_access(group_id, random_id)
         self.assertFalse(access)
+
+    def test_group_access_is_cached(self):
+        """Повторные проверки доступа и ролей не читают group_members."""
+        group_id = GroupModel.create_group("Cached Group", self.owner_id)["group_id"]
+        GroupModel.check_group_access(group_id, self.owner_id)
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        try:
+            self.assertTrue(GroupModel.check_group_access(str(group_id), str(self.owner_id)))
+            self.assertEqual(GroupModel.get_role(group_id, self.owner_id), 'owner')
+            self.assertEqual(GroupModel.get_user_group_ids(self.owner_id), {group_id})
+            self.assertFalse(GroupModel.check_group_access(None, self.owner_id))
+        finally:
+            self.conn.set_trace_callback(None)
+        self.assertFalse([sql for sql in statements if 'group_members' in sql])
+
+    def test_group_access_cache_follows_membership_changes(self):
+        """Вступление, смена роли, исключение и удаление группы обновляют кеш."""
+        UserModel.create_user("cached_member", "password")
+        member_id = UserModel.get_user_id("cached_member")
+        group_id = GroupModel.create_group("Cached Group", self.owner_id)["group_id"]
+        self.assertFalse(GroupModel.check_group_access(group_id, member_id))
+
+        GroupModel.add_member(group_id, member_id)
+        self.assertEqual(GroupModel.get_role(group_id, member_id), 'member')
+        GroupModel.change_role(group_id, member_id, 'admin', self.owner_id)
+        self.assertEqual(GroupModel.get_role(group_id, member_id), 'admin')
+        GroupModel.remove_member(group_id, member_id, self.owner_id)
+        self.assertIsNone(GroupModel.get_role(group_id, member_id))
+
+        GroupModel.add_member(group_id, member_id)
+        GroupModel.leave_group(group_id, self.owner_id)
+        self.assertEqual(GroupModel.get_user_group_ids(member_id), set())
+        self.assertEqual(GroupModel.get_user_group_ids(self.owner_id), set())
         
     def test_add_member_nonexistent_group(self):
         """Проверка добавления участника в несуществующую группу."""
@@ -500,7 +586,11 @@ class TestMessageModel(unittest.TestCase):
         init_schema(self.conn)
         from utils import db_utils
         self.original_get_db_connection = db_utils.get_db_connection
-        db_utils.get_db_connection = lambda: self.conn
+        db_utils.get_db_connection = lambda readonly=False: self.conn
+        recent_messages.clear()
+        user_model._user_cache.clear()
+        group_access.clear()
+        message_model._search_count_cache.clear()
         UserModel.create_user("msg_sender", "pass")
         UserModel.create_user("msg_receiver", "pass")
         self.sender_id = UserModel.get_user_id("msg_sender")
@@ -510,6 +600,9 @@ class TestMessageModel(unittest.TestCase):
         from utils import db_utils
         self.conn.close()
         db_utils.get_db_connection = self.original_get_db_connection
+        recent_messages.clear()
+        user_model._user_cache.clear()
+        group_access.clear()
 
     # Вспомогательные методы
     def create_test_user(self, username):
@@ -874,6 +967,33 @@ class TestMessageModel(unittest.TestCase):
         self.assertEqual(chats[0]['last_activity'], 2000)  # Последнее сообщение от user2
         self.assertEqual(chats[1]['last_activity'], 1500)  # Последнее сообщение user1→user3
 
+    def test_conversation_follows_private_messages(self):
+        """Беседа хранит последнюю активность и превью последнего сообщения."""
+        user1_id, user2_id = self.create_two_users()
+        first = MessageModel.create_message("private", user1_id, "Hello", None, user2_id)
+        second = MessageModel.create_message("private", user2_id, "Reply", None, user1_id)
+
+        chats = MessageModel.get_private_chats(user1_id)
+        self.assertEqual([(c['username'], c['last_message']) for c in chats], [("user2", "Reply")])
+        self.assertEqual(MessageModel.get_private_chats(user2_id)[0]['username'], "user1")
+
+        MessageModel.edit_message("private", second, user2_id, "Reply edited")
+        self.assertEqual(MessageModel.get_private_chats(user1_id)[0]['last_message'], "Reply edited")
+
+        MessageModel.delete_message("private", second, user2_id)
+        self.assertEqual(MessageModel.get_private_chats(user1_id)[0]['last_message'], "Hello")
+
+        MessageModel.delete_message("private", first, user1_id)
+        self.assertEqual(MessageModel.get_private_chats(user1_id), [])
+
+    def test_private_chat_with_self_is_listed_once(self):
+        user1_id = self.create_test_user("user1")
+        MessageModel.create_message("private", user1_id, "Note", None, user1_id)
+        chats = MessageModel.get_private_chats(user1_id)
+        self.assertEqual([c['username'] for c in chats], ["user1"])
+        messages = MessageModel.get_private_messages(user1_id, user1_id, 0)
+        self.assertEqual([m['message_text'] for m in messages], ["Note"])
+
     def test_get_private_messages_by_username(self):
         """Проверка получения приватных сообщений по username собеседника."""
         # 1. Подготовка - очищаем таблицы
@@ -1456,6 +1576,88 @@ class TestMessageModel(unittest.TestCase):
         self.assertEqual(result['total'], 0)
         self.assertEqual(len(result['messages']), 0)
 
+    def test_search_messages_cyrillic(self):
+        """Поиск по кириллице не зависит от регистра и находит слова по префиксу"""
+        author_id = self.create_test_user("search_author")
+        MessageModel.create_message("general", author_id, "Привет, Мир! Как дела?")
+        MessageModel.create_message("general", author_id, "Совсем другое сообщение")
+
+        result = MessageModel.search_messages("мир", "general", None, author_id)
+        self.assertEqual(result['total'], 1)
+        self.assertEqual(result['messages'][0]['text'], "Привет, Мир! Как дела?")
+        self.assertIn("<mark>Мир</mark>", result['messages'][0]['snippet'])
+
+        result = MessageModel.search_messages("прив", "general", None, author_id)
+        self.assertEqual(result['total'], 1)
+
+    def test_search_messages_snippet_is_escaped(self):
+        """HTML в тексте сообщения экранируется во фрагменте"""
+        author_id = self.create_test_user("search_author")
+        MessageModel.create_message("general", author_id, "<b>escape</b> me")
+        result = MessageModel.search_messages("escape", "general", None, author_id)
+        snippet = result['messages'][0]['snippet']
+        self.assertNotIn("<b>", snippet)
+        self.assertIn("&lt;b&gt;<mark>escape</mark>&lt;/b&gt;", snippet)
+
+    def test_search_messages_relevance(self):
+        """Сортировка по релевантности ставит более точные совпадения выше"""
+        author_id = self.create_test_user("search_author")
+        weak = MessageModel.create_message(
+            "general", author_id,
+            "длинное сообщение про погоду, новости и между делом один раз про котлеты"
+        )
+        strong = MessageModel.create_message("general", author_id, "котлеты котлеты")
+
+        by_relevance = MessageModel.search_messages("котлеты", "general", None, author_id, sort="relevance")
+        self.assertEqual([m['id'] for m in by_relevance['messages']], [strong, weak])
+
+    def test_search_index_follows_edit_and_delete(self):
+        """Индекс поиска обновляется триггерами при редактировании и удалении"""
+        author_id = self.create_test_user("search_author")
+        message_id = MessageModel.create_message("general", author_id, "старый текст")
+        MessageModel.edit_message("general", message_id, author_id, "новый текст")
+        self.assertEqual(MessageModel.search_messages("старый", "general", None, author_id)['total'], 0)
+        self.assertEqual(MessageModel.search_messages("новый", "general", None, author_id)['total'], 1)
+
+        MessageModel.delete_message("general", message_id, author_id)
+        self.assertEqual(MessageModel.search_messages("новый", "general", None, author_id)['total'], 0)
+
+    def test_search_keyset_pagination(self):
+        """Курсор before продолжает выдачу без пропусков и повторов"""
+        author_id = self.create_test_user("search_author")
+        ids = [MessageModel.create_message("general", author_id, f"курсор {i}") for i in range(5)]
+        # Одинаковое время у всех сообщений: порядок держится на id
+        self.conn.execute("UPDATE group_messages SET timestamp = 1700000000")
+
+        seen = []
+        before = None
+        while True:
+            result = MessageModel.search_messages(
+                "курсор", "general", None, author_id, per_page=2, before=before
+            )
+            seen.extend(m['id'] for m in result['messages'])
+            self.assertEqual(result['total'], 5)
+            before = result['next_before']
+            if before is None:
+                break
+
+        self.assertEqual(seen, sorted(ids, reverse=True))
+
+    def test_search_count_is_capped(self):
+        """Подсчёт совпадений останавливается на пороге SEARCH_COUNT_CAP"""
+        author_id = self.create_test_user("search_author")
+        for i in range(5):
+            MessageModel.create_message("general", author_id, f"много {i}")
+
+        with patch.object(message_model, 'SEARCH_COUNT_CAP', 3):
+            result = MessageModel.search_messages("много", "general", None, author_id, per_page=2)
+        self.assertEqual(result['total'], 3)
+        self.assertFalse(result['total_exact'])
+
+        result = MessageModel.search_messages("много", "general", None, author_id, per_page=2)
+        self.assertEqual(result['total'], 5)
+        self.assertTrue(result['total_exact'])
+
     def test_search_error_handling(self):
         """Проверка обработки ошибок при поиске"""
         # Создаем ситуацию, которая вызовет ошибку (неправильный тип сообщения)
@@ -1471,5 +1673,282 @@ class TestMessageModel(unittest.TestCase):
         self.assertEqual(len(result['messages']), 0)
         self.assertEqual(result['page'], 1)
 
+    def test_edit_keeps_timestamp(self):
+        """Редактирование не меняет время отправки сообщения"""
+        author_id = self.create_test_user("log_author")
+        message_id = MessageModel.create_message("general", author_id, "текст")
+        self.conn.execute("UPDATE group_messages SET timestamp = 100 WHERE message_id = ?", (message_id,))
+        self.assertTrue(MessageModel.edit_message("general", message_id, author_id, "правка"))
+        row = self.conn.execute(
+            "SELECT timestamp FROM group_messages WHERE message_id = ?", (message_id,)
+        ).fetchone()
+        self.assertEqual(row[0], 100)
+
+    def test_private_changes_are_shared_by_both_sides(self):
+        """Журнал личного чата общий для обоих собеседников и сворачивает события"""
+        user1_id, user2_id = self.create_two_users()
+        chat = MessageModel.chat_key("private", user1_id, user2_id)
+        self.assertEqual(chat, MessageModel.chat_key("private", user2_id, user1_id))
+        start = MessageModel.get_changes("private", chat, None)['cursor']
+
+        edited = MessageModel.create_message("private", user1_id, "раз", receiver_id=user2_id)
+        deleted = MessageModel.create_message("private", user2_id, "два", receiver_id=user1_id)
+        changes = MessageModel.get_changes("private", chat, start)
+        self.assertEqual(changes['inserted'], [edited, deleted])
+
+        MessageModel.edit_message("private", edited, user1_id, "раз!")
+        MessageModel.delete_message("private", deleted, user2_id)
+        later = MessageModel.get_changes("private", chat, changes['cursor'])
+        self.assertEqual(later['edited'], [{'id': edited, 'text': "раз!"}])
+        self.assertEqual(later['deleted'], [deleted])
+
+        # Правка нового для клиента сообщения приходит как добавление
+        collapsed = MessageModel.get_changes("private", chat, start)
+        self.assertEqual(collapsed['inserted'], [edited])
+        self.assertEqual(collapsed['deleted'], [deleted])
+
+    def test_changes_limit_sets_more(self):
+        """Длинный журнал отдаётся частями"""
+        author_id = self.create_test_user("log_author")
+        for i in range(3):
+            MessageModel.create_message("general", author_id, f"сообщение {i}")
+        first = MessageModel.get_changes("general", "g:0", 0, limit=2)
+        self.assertTrue(first['more'])
+        self.assertEqual(len(first['inserted']), 2)
+        rest = MessageModel.get_changes("general", "g:0", first['cursor'], limit=2)
+        self.assertFalse(rest['more'])
+        self.assertEqual(len(rest['inserted']), 1)
+
+######################################
+#   БУФЕР ПОСЛЕДНИХ СООБЩЕНИЙ        #
+######################################
+class TestRecentMessagesCache(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        init_schema(self.conn)
+        from utils import db_utils
+        self.original_get_db_connection = db_utils.get_db_connection
+        db_utils.get_db_connection = lambda readonly=False: self.conn
+        recent_messages.clear()
+        user_model._user_cache.clear()
+        group_access.clear()
+        UserModel.create_user("cache_user", "password")
+        self.user_id = UserModel.get_user_id("cache_user")
+        self.statements = []
+
+    def tearDown(self):
+        from utils import db_utils
+        self.conn.set_trace_callback(None)
+        self.conn.close()
+        db_utils.get_db_connection = self.original_get_db_connection
+        recent_messages.clear()
+        user_model._user_cache.clear()
+        group_access.clear()
+
+    def message(self, message_id, timestamp):
+        return {'id': message_id, 'sender': 'u', 'message_text': str(message_id),
+                'timestamp': timestamp, 'type': 'general', 'attachments': []}
+
+    def count_reads(self, func):
+        """Выполняет func и возвращает (результат, число SELECT к сообщениям)"""
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        try:
+            result = func()
+        finally:
+            self.conn.set_trace_callback(None)
+        return result, sum(1 for sql in statements if 'FROM group_messages' in sql)
+
+    def test_ring_buffer_window(self):
+        cache = RecentMessagesCache(size=3)
+        cache.fill('g:0', cache.version('g:0'), [self.message(1, 10), self.message(2, 20), self.message(3, 30)])
+        # Сообщения старше начала буфера могли не попасть в него
+        self.assertIsNone(cache.get('g:0', 5))
+        self.assertEqual([m['id'] for m in cache.get('g:0', 10)], [2, 3])
+
+        cache.add('g:0', self.message(4, 40))
+        self.assertEqual([m['id'] for m in cache.get('g:0', 10)], [2, 3, 4])
+        self.assertIsNone(cache.get('g:0', 9))
+        self.assertEqual(cache.stats()['messages'], 3)
+
+    def test_stale_fill_is_dropped(self):
+        cache = RecentMessagesCache(size=3)
+        version = cache.version('g:0')
+        cache.add('g:0', self.message(1, 10))
+        cache.fill('g:0', version, [])
+        self.assertFalse(cache.has('g:0'))
+        self.assertEqual(cache.stats()['stale_fills'], 1)
+
+    def test_returned_messages_are_copies(self):
+        cache = RecentMessagesCache(size=3)
+        cache.fill('g:0', cache.version('g:0'), [self.message(1, 10)])
+        cache.get('g:0', 0)[0]['attachments'].append({'path': 'x'})
+        self.assertEqual(cache.get('g:0', 0)[0]['attachments'], [])
+
+    def test_polls_are_answered_from_memory(self):
+        first = MessageModel.create_message("general", self.user_id, "first")
+        messages, reads = self.count_reads(lambda: MessageModel.get_general_messages(0))
+        self.assertEqual([m['id'] for m in messages], [first])
+        self.assertEqual(reads, 1)
+
+        second = MessageModel.create_message("general", self.user_id, "second")
+        MessageModel.add_attachment("group", second, "/static/uploads/a.png", "image/png", "a.png")
+        messages, reads = self.count_reads(lambda: MessageModel.get_general_messages(0))
+        self.assertEqual(reads, 0)
+        self.assertEqual([m['id'] for m in messages], [first, second])
+        self.assertEqual(messages[1]['sender'], "cache_user")
+        self.assertEqual(messages[1]['user_id'], self.user_id)
+        self.assertEqual(messages[1]['attachments'][0]['filename'], "a.png")
+
+        MessageModel.edit_message("general", first, self.user_id, "edited")
+        MessageModel.delete_message("general", second, self.user_id)
+        messages, reads = self.count_reads(lambda: MessageModel.get_general_messages(0))
+        self.assertEqual(reads, 0)
+        self.assertEqual([(m['id'], m['message_text']) for m in messages], [(first, "edited")])
+        self.assertGreater(recent_messages.stats()['hit_rate'], 0)
+
+    def test_old_cursor_falls_back_to_database(self):
+        group_id = GroupModel.create_group("Cache Group", self.user_id)['group_id']
+        with get_db_cursor() as cursor:
+            for i in range(5):
+                cursor.execute('''
+                    INSERT INTO group_messages (group_id, user_id, message_text, timestamp)
+                    VALUES (?, ?, ?, ?)
+                ''', (group_id, self.user_id, f"m{i}", 1000 + i))
+            cursor.connection.commit()
+
+        size = recent_messages.size
+        recent_messages.size = 2
+        try:
+            recent = MessageModel.get_group_messages(group_id, 1003)
+            older, reads = self.count_reads(lambda: MessageModel.get_group_messages(group_id, 1001))
+        finally:
+            recent_messages.size = size
+
+        self.assertEqual([m['message_text'] for m in recent], ["m4"])
+        self.assertEqual(reads, 1)
+        self.assertEqual([m['message_text'] for m in older], ["m2", "m3", "m4"])
+        self.assertTrue(all(m['type'] == 'group' for m in older))
+
+######################################
+#         ПЛАНЫ ЗАПРОСОВ             #
+######################################
+class TestGroupAccessCache(unittest.TestCase):
+    def test_stale_fill_is_ignored(self):
+        cache = GroupAccessCache()
+        version = cache.version(1)
+        cache.set_role(1, 5, 'member')
+        cache.fill(1, version, {})
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()['stale_fills'], 1)
+
+    def test_drop_group_and_eviction(self):
+        cache = GroupAccessCache(size=2)
+        cache.fill(1, cache.version(1), {5: 'owner', 6: 'member'})
+        cache.fill(2, cache.version(2), {5: 'member'})
+        cache.drop_group(5)
+        self.assertEqual(cache.get(1), {6: 'member'})
+        self.assertEqual(cache.get(2), {})
+        cache.fill(3, cache.version(3), {6: 'admin'})
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(3), {6: 'admin'})
+
+
+class TestQueryPlans(unittest.TestCase):
+    """
+    Проверяет через EXPLAIN QUERY PLAN, что запросы моделей к таблицам
+    сообщений, вложений и участников используют индексы, а не полный просмотр.
+    """
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        init_schema(self.conn)
+        from utils import db_utils
+        self.original_get_db_connection = db_utils.get_db_connection
+        db_utils.get_db_connection = lambda readonly=False: self.conn
+        recent_messages.clear()
+        user_model._user_cache.clear()
+        group_access.clear()
+        UserModel.create_user("plan_owner", "password")
+        UserModel.create_user("plan_member", "password")
+        self.owner_id = UserModel.get_user_id("plan_owner")
+        self.member_id = UserModel.get_user_id("plan_member")
+        self.group_id = GroupModel.create_group("Plan Group", self.owner_id)['group_id']
+        self.statements = []
+        self.conn.set_trace_callback(self.statements.append)
+
+    def tearDown(self):
+        from utils import db_utils
+        self.conn.set_trace_callback(None)
+        self.conn.close()
+        db_utils.get_db_connection = self.original_get_db_connection
+        recent_messages.clear()
+        user_model._user_cache.clear()
+        group_access.clear()
+
+    def assert_no_full_scans(self):
+        """Каждый выполненный запрос не должен сканировать таблицу целиком"""
+        self.conn.set_trace_callback(None)
+        checked = 0
+        for sql in self.statements:
+            if sql.split()[0].upper() not in ('SELECT', 'UPDATE', 'DELETE'):
+                continue
+            # Служебное чтение настроек FTS5 после изменения схемы выполняет сам модуль FTS5
+            if sql.startswith('SELECT k, v FROM') and '_fts_config' in sql:
+                continue
+            plan = [row[3] for row in self.conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+            # Обход виртуальной таблицы FTS5 по индексу MATCH и обход
+            # результата ограниченного подзапроса полным просмотром не являются
+            scans = [
+                step for step in plan
+                if step.startswith('SCAN')
+                and 'VIRTUAL TABLE INDEX' not in step
+                and not step.startswith('SCAN (subquery')
+            ]
+            self.assertEqual(scans, [], f"Полный просмотр в запросе: {sql}")
+            checked += 1
+        self.assertGreater(checked, 0)
+
+    def test_message_reads_use_indexes(self):
+        MessageModel.get_general_messages(0)
+        MessageModel.get_group_messages(self.group_id, 0)
+        MessageModel.get_private_messages(self.owner_id, self.member_id, 0)
+        MessageModel.get_private_chats(self.owner_id)
+        self.assert_no_full_scans()
+
+    def test_search_uses_indexes(self):
+        MessageModel.search_messages("hello", "general", None, self.owner_id)
+        MessageModel.search_messages("hello", "group", self.group_id, self.owner_id)
+        MessageModel.search_messages("hello", "private", "plan_member", self.owner_id)
+        self.assert_no_full_scans()
+
+    def test_sync_uses_indexes(self):
+        chat = MessageModel.chat_key("private", self.owner_id, self.member_id)
+        MessageModel.get_changes("private", chat, None)
+        MessageModel.get_changes("private", chat, 0)
+        MessageModel.get_changes("group", f"g:{self.group_id}", 0)
+        self.assert_no_full_scans()
+
+    def test_message_writes_use_indexes(self):
+        GroupModel.add_member(self.group_id, self.member_id)
+        group_msg = MessageModel.create_message("group", self.owner_id, "hi", self.group_id)
+        private_msg = MessageModel.create_message("private", self.owner_id, "hi", None, self.member_id)
+        MessageModel.edit_message("group", group_msg, self.member_id, "edited")
+        MessageModel.delete_message("group", group_msg, self.owner_id)
+        MessageModel.edit_message("private", private_msg, self.owner_id, "edited")
+        MessageModel.delete_message("private", private_msg, self.owner_id)
+        self.assert_no_full_scans()
+
+    def test_group_queries_use_indexes(self):
+        GroupModel.add_member(self.group_id, self.member_id)
+        GroupModel.get_user_groups(self.owner_id)
+        GroupModel.check_group_access(self.group_id, self.owner_id)
+        GroupModel.get_group_members(self.group_id)
+        GroupModel.change_role(self.group_id, self.member_id, 'admin', self.owner_id)
+        GroupModel.rename_group(self.group_id, "Plan Group 2", self.owner_id)
+        GroupModel.remove_member(self.group_id, self.member_id, self.owner_id)
+        GroupModel.leave_group(self.group_id, self.owner_id)
+        self.assert_no_full_scans()
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,3 +1,5 @@
+import re
+
 from views import (
     View, IndexView, GetUserIdView, GetMessageView, SendMessageView,
     RegisterView, LoginView, GetGroupMessagesView, CheckMessagesView,
@@ -8,11 +10,14 @@ from views import (
     GetGroupMembersView, CheckGroupAccessView, SendSystemMessageView,
     ChangeMemberRoleView, RenameGroupView, RemoveFromGroupView,
     GetGeneralMembersView, NotFoundView, ForbiddenView, InternalServerErrorView,
-    LogoutView, DeleteSessionView
+    LogoutView, DeleteSessionView, SyncMessagesView, BatchView,
+    EventsView, AttachmentView
 )
 
 routes = {
     '/static/': View,
+    # Вложения: более длинный префикс выбирается раньше '/static/'
+    '/static/uploads/': AttachmentView,
     '^/favicon.ico$': View,
     '^/$': IndexView,  
     '/get_user_id': GetUserIdView,
@@ -23,6 +28,9 @@ routes = {
     '/get_group_messages': GetGroupMessagesView,
     '/check_messages': CheckMessagesView,
     '/check_edited_messages': CheckEditedMessagesView,
+    '/sync': SyncMessagesView,
+    '/batch': BatchView,
+    '/events': EventsView,
     '/check_groups_updates': CheckGroupsUpdatesView,
     '/check_private_chats_updates': CheckPrivateChatsUpdatesView,
     '/create_group': CreateGroupView,
@@ -53,6 +61,112 @@ routes = {
 }
 
 
+# Символы, при которых ключ маршрута считается регулярным выражением;
+# точка допускается в литеральных путях (favicon.ico)
+_REGEX_CHARS = set('\\[](){}*+?|')
+
+
+class Router:
+    """
+    Таблица маршрутов, скомпилированная один раз при импорте.
+
+    Ключи routes разбираются по виду:
+    - литеральный путь ('/get_messages', '^/favicon.ico$') - точное
+      совпадение через словарь;
+    - литеральный префикс, оканчивающийся на '/' ('/static/') - поиск
+      в дереве префиксов по сегментам пути;
+    - остальные - регулярные выражения, которые должны совпасть с путём
+      целиком; они сгруппированы по первому сегменту, так что на запрос
+      проверяются только выражения с подходящим началом.
+    """
+
+    def __init__(self, table):
+        self.exact = {}
+        # Узел дерева: {'children': {сегмент: узел}, 'prefix': str, 'view': класс}
+        self.prefixes = {'children': {}, 'prefix': None, 'view': None}
+        # Первый сегмент пути (None - любой) -> [(выражение, класс)]
+        self.patterns = {}
+        for key, view_class in table.items():
+            self.add(key, view_class)
+
+    def add(self, key, view_class):
+        body = key[1:] if key.startswith('^') else key
+        anchored = body.endswith('$')
+        if anchored:
+            body = body[:-1]
+        if any(c in _REGEX_CHARS for c in body):
+            regex = re.compile(body)
+            literal = re.match(r'/([\w-]+)/', body)
+            self.patterns.setdefault(literal.group(1) if literal else None, []).append((regex, view_class))
+        elif body.endswith('/') and not anchored:
+            node = self.prefixes
+            for segment in body.strip('/').split('/'):
+                node = node['children'].setdefault(segment, {'children': {}, 'prefix': None, 'view': None})
+            node['prefix'], node['view'] = body, view_class
+        else:
+            # Ключ без '$' раньше совпадал и с любым продолжением пути
+            self.exact.setdefault(body, view_class)
+
+    def match(self, path):
+        """
+        :return: Пара (класс представления, параметры из групп регулярного
+            выражения) или (None, ()), если маршрут не найден.
+        """
+        view_class = self.exact.get(path)
+        if view_class is not None:
+            return view_class, ()
+
+        segments = path.split('/')
+        node, found = self.prefixes, None
+        for segment in segments[1:]:
+            node = node['children'].get(segment)
+            if node is None:
+                break
+            if node['view'] is not None and path.startswith(node['prefix']):
+                found = node['view']
+        if found is not None:
+            return found, ()
+
+        first = segments[1] if len(segments) > 2 else None
+        for bucket in (self.patterns.get(first, ()), self.patterns.get(None, ())):
+            for regex, view_class in bucket:
+                match = regex.fullmatch(path)
+                if match:
+                    return view_class, match.groups()
+        return None, ()
+
+    @staticmethod
+    def allows(view_class, method):
+        """
+        Разрешён ли метод представлению: атрибут methods, None - любой.
+        HEAD разрешён везде, где разрешён GET.
+        """
+        methods = getattr(view_class, 'methods', None)
+        if methods is None or method in methods:
+            return True
+        return method == 'HEAD' and 'GET' in methods
+
+
+router = Router(routes)
+
+
+def match_route(url):
+    """
+    Находит представление для URL.
+
+    :return: Пара (класс представления, параметры из групп регулярного
+        выражения) или (None, ()), если маршрут не найден.
+    """
+    return router.match(url)
+
+
+def method_allowed(view_class, method):
+    """
+    Проверяет, принимает ли представление HTTP-метод.
+    """
+    return Router.allows(view_class, method)
+
+
 def route(url):
     """
     Преобразовывает URL в путь к файлу в соответствии с определенными маршрутами.
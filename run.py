@@ -1,7 +1,12 @@
+import os
+
 from app import app
 from waitress import serve
 
 if __name__ == '__main__':
    
     from waitress import serve
-    serve(app, host='0.0.0.0', port=8000)
\ No newline at end of file
+    # Потоков должно быть больше, чем MESSENGER_LONGPOLL_MAX_WAITERS
+    # и MESSENGER_SSE_MAX_STREAMS вместе, иначе долгие опросы и потоки
+    # событий займут все потоки
+    serve(app, host='0.0.0.0', port=8000, threads=int(os.environ.get('MESSENGER_THREADS', 16)))
@@ -62,7 +62,8 @@ document.addEventListener("DOMContentLoaded", function () {
         query: '',
         page: 1,
         perPage: 20,
-        sort: 'date'
+        sort: 'date',
+        cursors: {}  // номер страницы -> курсор before, полученный со страницы перед ней
     };
 
     // Элементы интерфейса
@@ -210,43 +211,173 @@ document.addEventListener("DOMContentLoaded", function () {
         isTabActive = false;
     });
 
+    // Сколько секунд сервер держит долгий опрос, если в чате ничего не происходит
+    const LONG_POLL_SECONDS = 25;
+    // Интервал проверки, пока открыт поток событий /events
+    const EVENTS_POLL_INTERVAL = 30000;
+    let pollInFlight = false;
+    let pollPending = false;
+
     async function checkForUpdates() {
         if (!isTabActive) return;
+        if (pollInFlight) {
+            // Событие пришло во время опроса - повторим сразу после него
+            pollPending = true;
+            return;
+        }
+        pollInFlight = true;
+        pollPending = false;
     
         try {
+            // 0. Без потока событий ждём изменений в общем или групповом чате долгим опросом
+            if (!eventsConnected) {
+                await waitForMessages();
+            }
+
+            // Все проверки опроса уходят на сервер одним запросом /batch
+            const lastCheck = parseInt(sessionStorage.getItem('groupsLastCheck') || '0');
+            const sync = prepareSync();
+            const results = await batchFetch([
+                { id: 'groups', path: `/check_groups_updates?last_check=${lastCheck}` },
+                { id: 'chats', path: '/get_private_chats' },
+                { id: 'sync', path: sync.path }
+            ]);
+
             // 1. Проверяем обновления интерфейса (группы, чаты)
-            await checkInterfaceUpdates();
-            
-            // 2. Проверяем новые сообщения в текущем чате
-            if (currentGroup) {
-                await loadMessages();
-            } else if (currentPrivateChat) {
-                await loadPrivateMessages();
-            } else {
-                await loadMessages(); // Общий чат
+            await applyInterfaceUpdates(results.groups);
+
+            // 2. Применяем правки и удаления из журнала изменений чата;
+            // новые сообщения загружаем, только если журнал о них сообщил
+            const hasNew = applySync(sync, results.sync);
+            if (hasNew) {
+                if (currentGroup) {
+                    await loadMessages();
+                } else if (currentPrivateChat) {
+                    await loadPrivateMessages();
+                } else {
+                    await loadMessages(); // Общий чат
+                }
             }
             
             // 3. Всегда обновляем список личных чатов при проверке обновлений
-            await loadPrivateChats();
-            
-            // 4. Проверяем измененные/удаленные сообщения
-            await checkDeletedMessages();
-            await checkEditedMessages();
+            if (results.chats.status === 200) {
+                renderPrivateChatsData(results.chats.body);
+            }
             
         } catch (e) {
             console.error('Update error:', e);
         } finally {
+            pollInFlight = false;
+            debouncedUpdate(pollPending ? 0 : undefined);
+        }
+    }
+
+    // Поток событий /events: пока он открыт, опрос идёт по событиям и раз в EVENTS_POLL_INTERVAL
+    let eventSource = null;
+    let eventsConnected = false;
+
+    function connectEvents() {
+        if (!window.EventSource || !username) return;
+        eventSource = new EventSource('/events');
+        eventSource.addEventListener('ready', () => {
+            eventsConnected = true;
+        });
+        eventSource.addEventListener('message', e => handleChatEvent(JSON.parse(e.data)));
+        eventSource.addEventListener('resync', e => handleChatEvent(JSON.parse(e.data)));
+        eventSource.addEventListener('group', e => handleGroupEvent(JSON.parse(e.data)));
+        eventSource.onerror = () => {
+            eventsConnected = false;
+            // После ответа с ошибкой (например, 503) браузер не переподключается сам
+            if (eventSource.readyState === EventSource.CLOSED) {
+                eventSource = null;
+                setTimeout(connectEvents, EVENTS_POLL_INTERVAL);
+            }
             debouncedUpdate();
+        };
+    }
+
+    function handleChatEvent(event) {
+        // Ключи чатов сервера: 'g:<id>' для общего и групповых, 'p:<id>:<id>' для личных.
+        // chat === null - общий resync всех чатов
+        const isPrivate = event.chat === null || event.chat.startsWith('p:');
+        const openChat = currentGroup ? `g:${currentGroup}` : (currentPrivateChat ? null : 'g:0');
+        // Личный чат клиент знает по имени, а не по id, поэтому любое
+        // событие личной переписки проверяется через /sync и список чатов
+        if (isPrivate || event.chat === openChat) {
+            debouncedUpdate(0);
+        }
+    }
+
+    // Изменения состава групп меняют набор чатов, на которые подписан поток,
+    // поэтому после них поток переподключается
+    const MEMBERSHIP_OPS = ['create', 'member_add', 'member_remove', 'leave', 'delete'];
+
+    function handleGroupEvent(event) {
+        if (MEMBERSHIP_OPS.includes(event.op) && eventSource) {
+            eventSource.close();
+            eventSource = null;
+            eventsConnected = false;
+            connectEvents();
+        }
+        debouncedUpdate(0);
+    }
+
+    connectEvents();
+
+    // Долгий опрос новых сообщений: сервер отвечает, как только в чате
+    // что-то изменилось, или через LONG_POLL_SECONDS секунд.
+    // Личные чаты опрашиваются как прежде
+    async function waitForMessages() {
+        if (currentPrivateChat) return;
+        const chat = currentChatKey();
+        const url = currentGroup
+            ? `/get_group_messages?group_id=${currentGroup}&timestamp=${lastTimestamp}&wait=${LONG_POLL_SECONDS}`
+            : `/get_messages?timestamp=${lastTimestamp}&wait=${LONG_POLL_SECONDS}`;
+
+        try {
+            const res = await fetch(url);
+            if (!res.ok) return;
+            const data = await res.json();
+            // Пока запрос ждал, пользователь мог переключить чат
+            if (currentChatKey() !== chat || lastTimestamp === 0) return;
+            if (data.messages?.length > 0) {
+                displayMessages(data.messages);
+                lastTimestamp = data.timestamp;
+            }
+        } catch (e) {
+            console.error('Long poll error:', e);
+        }
+    }
+
+    // Выполняет несколько GET-запросов к API за один запрос /batch.
+    // Возвращает объект {id: {status, body}}
+    async function batchFetch(requests) {
+        const res = await fetch('/batch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ requests })
+        });
+        if (!res.ok) {
+            throw new Error(`HTTP ${res.status}`);
         }
+        const data = await res.json();
+        const results = {};
+        data.responses.forEach(item => {
+            results[item.id] = item;
+        });
+        return results;
     }
     
     let updateTimeout;
     
-    function debouncedUpdate() {
+    function debouncedUpdate(delay) {
+        if (delay === undefined) {
+            delay = eventsConnected ? EVENTS_POLL_INTERVAL : 1000;
+        }
         clearTimeout(updateTimeout);
         updateTimeout = setTimeout(() => {
             checkForUpdates();
-        }, 1000);
+        }, delay);
     }
 
     let participantsUpdateTimeout;
@@ -900,27 +1031,12 @@ function viewAttachments(messageElement) {
         });
     }
 
-    async function checkInterfaceUpdates() {
+    async function applyInterfaceUpdates(groupsResult) {
         try {
-            // Проверяем обновления групп с передачей последнего времени проверки
-            const lastCheck = parseInt(sessionStorage.getItem('groupsLastCheck') || '0');
-            const groupsRes = await fetch(`/check_groups_updates?last_check=${lastCheck}`);
-            
-            if (groupsRes.ok) {
-                const data = await groupsRes.json();
-                if (data.updated) {
-                    sessionStorage.setItem('groupsLastCheck', data.new_timestamp || Date.now());
-                    await loadGroups();
-                }
-            }
-            
-            // Проверяем обновления приватных чатов
-            const chatsRes = await fetch('/check_private_chats_updates');
-            if (chatsRes.ok) {
-                const chatsData = await chatsRes.json();
-                if (chatsData.updated) {
-                    await loadPrivateChats();
-                }
+            // Обновления групп с момента последней проверки
+            if (groupsResult.status === 200 && groupsResult.body.updated) {
+                sessionStorage.setItem('groupsLastCheck', groupsResult.body.new_timestamp || Date.now());
+                await loadGroups();
             }
             
             // Если открыт сайдбар участников - обновляем его
@@ -932,79 +1048,68 @@ function viewAttachments(messageElement) {
         }
     }
 
-    async function checkDeletedMessages() {
-        // Получаем все ID сообщений, которые есть в DOM
-        const messageElements = Array.from(document.querySelectorAll('.message[data-id]'));
-        const messageIds = messageElements.map(el => el.dataset.id);
-        
-        if (messageIds.length === 0) return;
-        
-        try {
-            let url;
-            if (currentGroup) {
-                url = `/check_messages?type=group&chat_id=${currentGroup}&ids=${messageIds.join(',')}`;
-            } else if (currentPrivateChat) {
-                url = `/check_messages?type=private&chat_id=${currentPrivateChat}&ids=${messageIds.join(',')}`;
-            } else {
-                url = `/check_messages?type=general&ids=${messageIds.join(',')}`;
-            }
-            
-            const res = await fetch(url);
-            if (res.ok) {
-                const data = await res.json();
-                data.existingIds = data.existingIds || [];
-                messageElements.forEach(el => {
-                    if (!data.existingIds.includes(el.dataset.id)) {
-                        el.remove();
-                    }
-                });
-            }
-        } catch (e) {
-            console.error('Error checking deleted messages:', e);
+    // Курсор журнала изменений и чат, к которому он относится
+    let syncCursor = null;
+    let syncChat = null;
+
+    function currentChatKey() {
+        if (currentGroup) return `group:${currentGroup}`;
+        if (currentPrivateChat) return `private:${currentPrivateChat}`;
+        return 'general';
+    }
+
+    // Готовит запрос /sync для текущего чата
+    function prepareSync() {
+        const chat = currentChatKey();
+        if (chat !== syncChat) {
+            syncChat = chat;
+            syncCursor = null;
+        }
+
+        let path;
+        if (currentGroup) {
+            path = `/sync?type=group&chat_id=${currentGroup}`;
+        } else if (currentPrivateChat) {
+            path = `/sync?type=private&chat_id=${encodeURIComponent(currentPrivateChat)}`;
+        } else {
+            path = `/sync?type=general`;
+        }
+        const fresh = syncCursor === null;
+        if (!fresh) {
+            path += `&cursor=${syncCursor}`;
         }
+        return { chat, fresh, path };
     }
 
-    async function checkEditedMessages() {
-        const messageElements = Array.from(document.querySelectorAll('.message[data-id]'));
-        if (messageElements.length === 0) return;
-    
-        try {
-            let url;
-            if (currentGroup) {
-                url = `/check_edited_messages?type=group&chat_id=${currentGroup}`;
-            } else if (currentPrivateChat) {
-                url = `/check_edited_messages?type=private&chat_id=${currentPrivateChat}`;
-            } else {
-                url = `/check_edited_messages?type=general`;
-            }
-    
-            // Добавляем timestamp последнего сообщения
-            const lastMessage = messageElements[messageElements.length - 1];
-            url += `&last_timestamp=${lastMessage.dataset.timestamp}`;
-    
-            const res = await fetch(url);
-            if (res.ok) {
-                const data = await res.json();
-                data.editedMessages = data.editedMessages || [];
-                
-                // Обновляем измененные сообщения
-                data.editedMessages.forEach(msg => {
-                    const messageElement = document.querySelector(`[data-id="${msg.id}"]`);
-                    if (messageElement) {
-                        const textElement = messageElement.querySelector('.message-text');
-                        if (textElement && textElement.textContent !== msg.text) {
-                            textElement.textContent = msg.text;
-                            messageElement.classList.add('highlight');
-                            setTimeout(() => {
-                                messageElement.classList.remove('highlight');
-                            }, 2000);
-                        }
-                    }
-                });
+    // Применяет ответ /sync. Возвращает true, если в чате могли появиться новые сообщения
+    function applySync(sync, result) {
+        // Потерю доступа к группе обработает загрузчик сообщений
+        if (!result || result.status !== 200) return true;
+        // Пока шёл запрос, пользователь мог переключить чат
+        if (currentChatKey() !== sync.chat) return false;
+        const data = result.body;
+        syncCursor = data.cursor;
+
+        data.deleted.forEach(id => {
+            const messageElement = UI.chatBox.querySelector(`.message[data-id="${id}"]`);
+            if (messageElement) messageElement.remove();
+        });
+
+        data.edited.forEach(msg => {
+            const messageElement = UI.chatBox.querySelector(`.message[data-id="${msg.id}"]`);
+            if (messageElement) {
+                const textElement = messageElement.querySelector('.message-text');
+                if (textElement && textElement.textContent !== msg.text) {
+                    textElement.textContent = msg.text;
+                    messageElement.classList.add('highlight');
+                    setTimeout(() => {
+                        messageElement.classList.remove('highlight');
+                    }, 2000);
+                }
             }
-        } catch (e) {
-            console.error('Error checking edited messages:', e);
-        }
+        });
+
+        return sync.fresh || data.more || data.inserted.length > 0;
     }
 
     async function createGroup() {
@@ -1580,28 +1685,56 @@ function viewAttachments(messageElement) {
         });
     }
 
+    // WebCrypto доступен только в защищённом контексте (https или localhost);
+    // без него сервер шифрует каждое сообщение отдельно (ECB)
+    const BATCH_DECRYPT = !!(window.crypto && window.crypto.subtle);
+    let batchKey = null;
+
+    function base64ToBytes(value) {
+        return Uint8Array.from(atob(value), c => c.charCodeAt(0));
+    }
+
+    // Расшифровывает пачку сообщений, зашифрованную одной операцией AES-GCM
+    async function decryptMessageBatch(encrypted) {
+        const rawKey = sessionStorage.getItem('session_key');
+        if (!batchKey || batchKey.raw !== rawKey) {
+            batchKey = {
+                raw: rawKey,
+                key: await crypto.subtle.importKey('raw', base64ToBytes(rawKey), 'AES-GCM', false, ['decrypt'])
+            };
+        }
+        const plain = await crypto.subtle.decrypt(
+            { name: 'AES-GCM', iv: base64ToBytes(encrypted.nonce) },
+            batchKey.key,
+            base64ToBytes(encrypted.data)
+        );
+        return JSON.parse(new TextDecoder().decode(plain));
+    }
+
     async function loadPrivateMessages() {
         if (!currentPrivateChat) return;
         const session_id = sessionStorage.getItem('session_id');
         const session_key = CryptoJS.enc.Base64.parse(sessionStorage.getItem('session_key'));
         
         try {
-            const res = await fetch(`/get_private_messages?user=${currentPrivateChat}&timestamp=${lastTimestamp}&session_id=${session_id}`);
+            const enc = BATCH_DECRYPT ? '&enc=gcm' : '';
+            const res = await fetch(`/get_private_messages?user=${currentPrivateChat}&timestamp=${lastTimestamp}&session_id=${session_id}${enc}`);
             let data = await res.json();
-            sessionStorage.setItem('messages', data.messages);
-            data.messages.forEach(element => {
-                console.log(element.message_text);
-                const decrypted = CryptoJS.AES.decrypt(
-                { ciphertext: CryptoJS.enc.Base64.parse(element.message_text) },
-                    session_key,
-                    {
-                        mode: CryptoJS.mode.ECB,
-                        padding: CryptoJS.pad.Pkcs7,
-                    }
-                );
-                element.message_text = decrypted.toString(CryptoJS.enc.Utf8);
-                
-            });
+            if (data.encrypted) {
+                data.messages = await decryptMessageBatch(data.encrypted);
+            } else {
+                data.messages.forEach(element => {
+                    const decrypted = CryptoJS.AES.decrypt(
+                    { ciphertext: CryptoJS.enc.Base64.parse(element.message_text) },
+                        session_key,
+                        {
+                            mode: CryptoJS.mode.ECB,
+                            padding: CryptoJS.pad.Pkcs7,
+                        }
+                    );
+                    element.message_text = decrypted.toString(CryptoJS.enc.Utf8);
+                });
+            }
 
             if (data.messages?.length > 0) {
                 displayMessages(data.messages);
@@ -1657,21 +1790,7 @@ function viewAttachments(messageElement) {
             }
             
             const data = await res.json();
-            renderPrivateChats(data.chats || []); 
-            
-            // Если у нас есть активный приватный чат, но его нет в списке,
-            // добавляем его вручную (это может быть новый чат)
-            if (currentPrivateChat) {
-                const chatExists = data.chats.some(c => c.username === currentPrivateChat);
-                if (!chatExists) {
-                    // Добавляем текущий чат в начало списка
-                    const newChat = {
-                        username: currentPrivateChat,
-                        last_activity: Math.floor(Date.now()/1000)
-                    };
-                    renderPrivateChats([newChat, ...data.chats]);
-                }
-            }
+            renderPrivateChatsData(data);
             
         } catch (error) {
             console.error("Error loading private chats:", error);
@@ -1679,6 +1798,25 @@ function viewAttachments(messageElement) {
         }
     }
 
+    function renderPrivateChatsData(data) {
+        const chats = data.chats || [];
+        renderPrivateChats(chats);
+        
+        // Если у нас есть активный приватный чат, но его нет в списке,
+        // добавляем его вручную (это может быть новый чат)
+        if (currentPrivateChat) {
+            const chatExists = chats.some(c => c.username === currentPrivateChat);
+            if (!chatExists) {
+                // Добавляем текущий чат в начало списка
+                const newChat = {
+                    username: currentPrivateChat,
+                    last_activity: Math.floor(Date.now()/1000)
+                };
+                renderPrivateChats([newChat, ...chats]);
+            }
+        }
+    }
+
     
     function renderPrivateChats(response) {
         try {
@@ -1861,6 +1999,7 @@ function viewAttachments(messageElement) {
         currentSearch.query = searchInput.value.trim();
         currentSearch.sort = sortSelect.value;
         currentSearch.page = 1;
+        currentSearch.cursors = {};
         
         if (!currentSearch.query) {
             alert('Введите текст для поиска');
@@ -1892,6 +2031,11 @@ function viewAttachments(messageElement) {
         url.searchParams.set('page', currentSearch.page);
         url.searchParams.set('per_page', currentSearch.perPage);
         url.searchParams.set('sort', currentSearch.sort);
+        // Если курсор страницы известен, сервер продолжает выдачу без OFFSET
+        const cursor = currentSearch.cursors[currentSearch.page];
+        if (cursor) {
+            url.searchParams.set('before', cursor);
+        }
     
         fetch(url)
             .then(response => {
@@ -1914,9 +2058,13 @@ function viewAttachments(messageElement) {
                     return;
                 }
                 
+                if (data.next_before) {
+                    currentSearch.cursors[data.page + 1] = data.next_before;
+                }
+
                 resultsContainer.innerHTML = `
                     <p class="search-context">
-                        Найдено ${data.total} сообщений в ${getSearchContextString()}
+                        Найдено ${data.total_display} сообщений в ${getSearchContextString()}
                     </p>
                     ${data.messages.map(msg => `
                         <div class="search-result-item" data-id="${msg.id}">
@@ -1924,7 +2072,7 @@ function viewAttachments(messageElement) {
                                 <span class="sender">${msg.sender}</span>
                                 <span class="time">${new Date(msg.timestamp * 1000).toLocaleString()}</span>
                             </div>
-                            <div class="search-result-text">${msg.text}</div>
+                            <div class="search-result-text">${msg.snippet}</div>
                         </div>
                     `).join('')}
                 `;
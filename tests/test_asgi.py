@@ -0,0 +1,230 @@
+import json
+import time
+import asyncio
+import threading
+import pytest
+
+from asgi import application
+from utils.notify import ChatNotifier
+
+pytestmark = pytest.mark.asgi
+
+
+def make_scope(path, query='', method='GET', headers=None):
+    return {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query.encode('latin-1'),
+        'headers': [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in (headers or {}).items()
+        ],
+    }
+
+
+def login_headers(test_app, auth_headers):
+    cookie = '; '.join(f'{name}={value}' for name, value in test_app.cookies.items())
+    return dict(auth_headers, Cookie=cookie)
+
+
+async def call(scope, body=b''):
+    """
+    Выполняет обычный запрос и возвращает (статус, заголовки, тело).
+    """
+    messages = []
+    requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        if requests:
+            return requests.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    headers = {k.decode(): v.decode() for k, v in messages[0]['headers']}
+    body = b''.join(m.get('body', b'') for m in messages[1:])
+    return messages[0]['status'], headers, body
+
+
+def test_plain_request(test_app, auth_headers):
+    headers = login_headers(test_app, auth_headers)
+    status, response_headers, body = asyncio.run(call(make_scope('/get_messages', 'timestamp=0', headers=headers)))
+    assert status == 200
+    assert response_headers['content-type'].startswith('application/json')
+    assert 'messages' in json.loads(body)
+
+
+def test_unknown_route():
+    status, _, _ = asyncio.run(call(make_scope('/no_such_route')))
+    assert status == 404
+
+
+def test_lifespan_startup():
+    sent = []
+    incoming = [{'type': 'lifespan.startup'}]
+
+    async def receive():
+        if incoming:
+            return incoming.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    async def run():
+        task = asyncio.ensure_future(application({'type': 'lifespan'}, receive, send))
+        while not sent:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(run())
+    assert sent == ['lifespan.startup.complete']
+
+
+def test_async_wait_wakes_on_notify():
+    notifier = ChatNotifier(max_waiters=0, max_async_waiters=2)
+
+    async def run():
+        versions = notifier.version('g:1')
+        threading.Timer(0.05, notifier.notify, args=('g:1',)).start()
+        return await notifier.wait_async(('g:1',), versions, 5)
+
+    started = time.monotonic()
+    assert asyncio.run(run())
+    assert time.monotonic() - started < 2
+    # Корутины не занимают места ждущих потоков
+    assert notifier.stats()['rejected'] == 0
+
+
+def test_long_poll_wakes_without_thread(test_app, auth_headers):
+    headers = login_headers(test_app, auth_headers)
+    group_id = test_app.post_json('/create_group', {'name': 'ASGI Poll Group'}, headers=auth_headers).json['group_id']
+
+    def send():
+        time.sleep(0.3)
+        test_app.post_json('/send_message', {'message': 'ASGI wakeup', 'group_id': group_id}, headers=auth_headers)
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    started = time.monotonic()
+    scope = make_scope('/get_group_messages', f'group_id={group_id}&timestamp=0&wait=10', headers=headers)
+    status, _, body = asyncio.run(call(scope))
+    thread.join()
+    assert status == 200
+    assert time.monotonic() - started < 5
+    assert [msg['message_text'] for msg in json.loads(body)['messages']] == ['ASGI wakeup']
+
+
+def test_events_stream_and_disconnect(test_app, auth_headers):
+    headers = login_headers(test_app, auth_headers)
+
+    async def run():
+        disconnected = asyncio.Event()
+        frames = asyncio.Queue()
+        started = []
+        requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if requests:
+                return requests.pop(0)
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                started.append(message['status'])
+            elif message.get('body'):
+                await frames.put(message['body'].decode('utf-8'))
+
+        task = asyncio.ensure_future(application(make_scope('/events', headers=headers), receive, send))
+        assert 'event: ready' in await asyncio.wait_for(frames.get(), 5)
+
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(
+            None,
+            lambda: test_app.post_json('/send_message', {'message': 'ASGI stream'}, headers=auth_headers)
+        )
+        frame = await asyncio.wait_for(frames.get(), 5)
+
+        disconnected.set()
+        await asyncio.wait_for(task, 5)
+        return started, frame, response.json['message_id']
+
+    started, frame, message_id = asyncio.run(run())
+    assert started == [200]
+    assert frame.startswith('event: message')
+    assert json.loads(frame.split('data: ', 1)[1]) == {'chat': 'g:0', 'op': 'insert', 'id': message_id}
+
+
+def test_oversized_body_rejected_before_reading(monkeypatch):
+    from utils import multipart
+    monkeypatch.setattr(multipart, 'MAX_UPLOAD_SIZE', 1024)
+    messages = []
+
+    async def receive():
+        raise AssertionError('body must not be read')
+
+    async def send(message):
+        messages.append(message)
+
+    scope = make_scope('/send_message', method='POST', headers={'Content-Length': '4096'})
+    asyncio.run(application(scope, receive, send))
+    assert messages[0]['status'] == 413
+
+
+def test_body_without_length_is_capped(monkeypatch):
+    from utils import multipart
+    monkeypatch.setattr(multipart, 'MAX_UPLOAD_SIZE', 1024)
+    requests = [
+        {'type': 'http.request', 'body': b'x' * 800, 'more_body': True},
+        {'type': 'http.request', 'body': b'x' * 800, 'more_body': True},
+        {'type': 'http.request', 'body': b'x' * 800, 'more_body': False},
+    ]
+    messages = []
+
+    async def receive():
+        return requests.pop(0)
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(make_scope('/send_message', method='POST'), receive, send))
+    assert messages[0]['status'] == 413
+    # Чтение остановилось на превышении предела
+    assert len(requests) == 1
+
+
+def test_response_is_streamed_in_chunks(monkeypatch):
+    import asgi
+    closed = []
+
+    class Result:
+        def __iter__(self):
+            return iter([b'one', b'', b'two'])
+
+        def close(self):
+            closed.append(True)
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return Result()
+
+    monkeypatch.setattr(asgi, 'wsgi_app', app)
+    messages = []
+    requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def receive():
+        return requests.pop(0)
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(make_scope('/no_such_route'), receive, send))
+    assert messages[0]['status'] == 200
+    assert [(m['body'], m.get('more_body', False)) for m in messages[1:]] == [
+        (b'one', True), (b'two', True), (b'', False)
+    ]
+    assert closed == [True]
@@ -1,3 +1,5 @@
+import time
+from utils import db_utils
 from webob import Request
 import pytest
 pytestmark = pytest.mark.auth
@@ -92,4 +94,105 @@ def test_login_wrong_password(test_app):
         'password': 'Wrongpass'
     }, expect_errors=True)
     assert resp.status_code == 401
-    assert 'Неверный пароль' in resp.json['error']
\ No newline at end of file
+    assert 'Неверный пароль' in resp.json['error']
+
+def test_session_key_is_cached_and_sliding(test_app):
+    from models import session
+    session_id, key = session.create_session()
+    with db_utils.get_read_cursor() as cursor:
+        cursor.execute("SELECT expires_at FROM session WHERE id = ?", (session_id,))
+        stored = cursor.fetchone()[0]
+    assert session.get_key(session_id) == key
+    # Продление меньше SESSION_TOUCH_INTERVAL не пишется в базу
+    with db_utils.get_read_cursor() as cursor:
+        cursor.execute("SELECT expires_at FROM session WHERE id = ?", (session_id,))
+        assert cursor.fetchone()[0] == stored
+
+
+def test_missing_session_fails_without_db(test_app, monkeypatch):
+    from models import session
+    session_id, _ = session.create_session()
+    session.delete_session(session_id)
+
+    def no_db(*args, **kwargs):
+        raise AssertionError('database must not be queried')
+    monkeypatch.setattr(session, 'get_read_cursor', no_db)
+    assert session.get_key(session_id) is None
+    assert session.get_key('not-a-session') is None
+    assert session.get_key(None) is None
+
+
+def test_session_deleted_by_other_process_is_evicted(test_app):
+    import json
+    from models import session
+    from utils.bus import _bus
+    session_id, key = session.create_session()
+    assert session.get_key(session_id) == key
+    # Другой процесс удалил сессию из базы и разослал событие
+    with db_utils.get_db_cursor() as cursor:
+        cursor.execute("DELETE FROM session WHERE id = ?", (session_id,))
+    _bus._receive(json.dumps({
+        'topics': [], 'event': 'session', 'payload': {'op': 'delete', 'ids': [session_id]}
+    }).encode())
+    assert session.get_key(session_id) is None
+
+def test_expired_sessions_are_swept_in_batches(test_app):
+    from models import session
+    created = [session.create_session()[0] for _ in range(5)]
+    now = int(time.time()) + session.SESSION_TTL + 1
+    assert session.sweep_expired_sessions(now=now, batch=2) >= 5
+    with db_utils.get_read_cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*) FROM session WHERE id IN ({','.join('?' * len(created))})", created
+        )
+        assert cursor.fetchone()[0] == 0
+    assert all(session.get_key(session_id) is None for session_id in created)
+
+
+def test_failed_logins_are_throttled_before_bcrypt(test_app, monkeypatch):
+    from utils import pswd_utils
+    test_app.post('/register', {'username': 'user_throttled', 'password': 'Testpass123!'})
+    environ = {'REMOTE_ADDR': '203.0.113.7'}
+    for _ in range(pswd_utils.LOGIN_MAX_FAILURES_PER_USER):
+        resp = test_app.post('/login', {'username': 'user_throttled', 'password': 'Wrongpass'},
+                             extra_environ=environ, expect_errors=True)
+        assert resp.status_code == 401
+
+    calls = []
+    monkeypatch.setattr(pswd_utils._hashing_pool, 'run', lambda *args: calls.append(args))
+    resp = test_app.post('/login', {'username': 'user_throttled', 'password': 'Testpass123!'},
+                         extra_environ=environ, expect_errors=True)
+    assert resp.status_code == 429
+    assert int(resp.headers['Retry-After']) > 0
+    assert calls == []
+
+
+def test_login_throttle_per_ip_and_reset():
+    from utils.pswd_utils import LoginThrottle
+    throttle = LoginThrottle(window=60, max_per_user=2, max_per_ip=3)
+    throttle.failure('alice', '10.0.0.1', now=0)
+    throttle.failure('alice', '10.0.0.1', now=1)
+    assert throttle.retry_after('alice', '10.0.0.2', now=2) == 59
+    throttle.success('alice')
+    assert throttle.retry_after('alice', '10.0.0.1', now=2) == 0
+    throttle.failure('bob', '10.0.0.1', now=3)
+    # Третья неудача с адреса блокирует любые имена с него
+    assert throttle.retry_after('carol', '10.0.0.1', now=4) == 57
+    assert throttle.retry_after('carol', '10.0.0.1', now=60) == 0
+
+
+def test_hashing_pool_runs_in_process_and_rejects_when_full():
+    import bcrypt
+    from utils.pswd_utils import HashingPool, PasswordHashingBusy
+    pool = HashingPool(workers=1, timeout=0.1, queue_factor=1)
+    try:
+        hashed = pool.run(bcrypt.hashpw, b'Testpass123!', bcrypt.gensalt(4))
+        assert pool.run(bcrypt.checkpw, b'Testpass123!', hashed)
+
+        pool._slots.acquire()
+        with pytest.raises(PasswordHashingBusy):
+            pool.run(bcrypt.gensalt)
+        pool._slots.release()
+        assert pool.stats()['rejected'] == 1
+    finally:
+        pool.stop()
@@ -0,0 +1,38 @@
+import pytest
+
+pytestmark = pytest.mark.batch
+
+
+def test_batch_runs_sub_requests_in_order(test_app, auth_headers):
+    response = test_app.post_json('/batch', {'requests': [
+        {'id': 'send', 'method': 'POST', 'path': '/send_message', 'body': {'message': 'Batched hello'}},
+        {'id': 'messages', 'path': '/get_messages?timestamp=0'},
+        {'id': 'sync', 'path': '/sync?type=general'},
+        {'id': 'missing', 'path': '/no_such_endpoint'},
+    ]}, headers=auth_headers)
+    assert response.status_code == 200
+
+    results = {item['id']: item for item in response.json['responses']}
+    assert [item['id'] for item in response.json['responses']] == ['send', 'messages', 'sync', 'missing']
+    assert results['send']['status'] == 200
+    message_id = results['send']['body']['message_id']
+    assert any(msg['id'] == message_id for msg in results['messages']['body']['messages'])
+    assert results['sync']['body']['cursor'] > 0
+    assert results['missing']['status'] == 404
+
+
+def test_batch_keeps_sub_request_errors(test_app, auth_headers):
+    response = test_app.post_json('/batch', {'requests': [
+        {'id': 'bad', 'path': '/sync?type=general&cursor=abc'},
+        {'id': 'nested', 'method': 'POST', 'path': '/batch', 'body': {'requests': []}},
+        {'id': 'invalid', 'method': 'PATCH', 'path': '/get_messages'},
+    ]}, headers=auth_headers)
+    statuses = [item['status'] for item in response.json['responses']]
+    assert statuses == [400, 404, 400]
+
+
+def test_batch_rejects_invalid_envelope(test_app, auth_headers):
+    assert test_app.get('/batch', headers=auth_headers, expect_errors=True).status_code == 405
+    response = test_app.post_json('/batch', {'requests': [{'path': '/get_messages'}] * 21},
+                                  headers=auth_headers, expect_errors=True)
+    assert response.status_code == 400
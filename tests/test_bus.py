@@ -0,0 +1,144 @@
+import json
+import time
+import random
+import socket
+import string
+import pytest
+
+from models.UserModel import UserModel
+from utils import subscribe_events
+from utils.bus import EventBus, UnixSocketTransport
+
+pytestmark = pytest.mark.bus
+
+
+def collect(bus):
+    received = []
+    bus.add_handler(lambda topics, event, payload, frame: received.append((topics, event, payload, frame)))
+    return received
+
+
+def test_frame_is_encoded_once_for_all_handlers():
+    bus = EventBus()
+    first, second = collect(bus), collect(bus)
+    bus.publish(['g:1', 'u:2'], 'group', {'chat': 'g:1', 'op': 'rename', 'name': 'New'})
+
+    assert first[0][:3] == (('g:1', 'u:2'), 'group', {'chat': 'g:1', 'op': 'rename', 'name': 'New'})
+    assert first[0][3] is second[0][3]
+    assert first[0][3].startswith(b'event: group\ndata: ')
+
+
+def test_failing_handler_does_not_stop_delivery():
+    bus = EventBus()
+    bus.add_handler(lambda *args: 1 / 0)
+    received = collect(bus)
+    bus.publish(['g:0'], 'message', {'chat': 'g:0', 'op': 'insert', 'id': 1})
+    assert len(received) == 1
+    assert bus.stats()['handler_errors'] == 1
+
+
+def test_unix_socket_transport_between_buses(tmp_path):
+    directory = str(tmp_path)
+    sender, receiver = EventBus(), EventBus()
+    local = collect(sender)
+    remote = collect(receiver)
+    sender.start_transport(UnixSocketTransport(directory, 'sender'))
+    receiver.start_transport(UnixSocketTransport(directory, 'receiver'))
+    try:
+        sender.publish(['g:3'], 'message', {'chat': 'g:3', 'op': 'edit', 'id': 9, 'text': 'Привет'})
+        deadline = time.monotonic() + 5
+        while not remote and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert len(local) == 1
+        assert remote[0][:3] == (('g:3',), 'message', {'chat': 'g:3', 'op': 'edit', 'id': 9, 'text': 'Привет'})
+        assert receiver.stats()['remote'] == 1
+    finally:
+        sender.stop_transport()
+        receiver.stop_transport()
+    assert not list(tmp_path.iterdir())
+
+
+def test_stale_peer_socket_is_removed(tmp_path):
+    bus = EventBus()
+    bus.start_transport(UnixSocketTransport(str(tmp_path), 'live'))
+    # Процесс упал и не удалил свой сокет
+    dead = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    dead.bind(str(tmp_path / 'dead.sock'))
+    dead.close()
+    try:
+        bus.publish(['g:0'], 'message', {'chat': 'g:0', 'op': 'insert', 'id': 1})
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['live.sock']
+    finally:
+        bus.stop_transport()
+
+
+def test_member_add_reaches_added_user(test_app, auth_headers):
+    username = 'busmember' + ''.join(random.choices(string.ascii_lowercase, k=6))
+    test_app.post('/register', {'username': username, 'password': 'Testpass123!'})
+    user_id = UserModel.get_user_id(username)
+    group_id = test_app.post_json('/create_group', {'name': f'Bus {username}'}, headers=auth_headers).json['group_id']
+
+    subscription = subscribe_events([f'u:{user_id}'])
+    try:
+        test_app.post_json('/add_to_group', {'group_id': group_id, 'username': username}, headers=auth_headers)
+        frame = subscription.get(1).decode('utf-8')
+    finally:
+        subscription.close()
+
+    assert frame.startswith('event: group')
+    payload = json.loads(frame.split('data: ', 1)[1])
+    assert payload == {
+        'chat': f'g:{group_id}', 'op': 'member_add', 'group_id': group_id,
+        'user_id': user_id, 'role': 'member'
+    }
+
+
+def remote_event(topics, event, payload):
+    # Событие, пришедшее через транспорт от другого процесса
+    from utils.bus import _bus
+    _bus._receive(json.dumps({'topics': topics, 'event': event, 'payload': payload}).encode('utf-8'))
+
+
+def test_remote_group_changes_update_access_cache(test_app, auth_headers):
+    from models.GroupModel import GroupModel
+    from utils import get_db_cursor
+    username = 'busremote' + ''.join(random.choices(string.ascii_lowercase, k=6))
+    test_app.post('/register', {'username': username, 'password': 'Testpass123!'})
+    user_id = UserModel.get_user_id(username)
+    group_id = test_app.post_json('/create_group', {'name': f'Bus {username}'}, headers=auth_headers).json['group_id']
+    test_app.post_json('/add_to_group', {'group_id': group_id, 'username': username}, headers=auth_headers)
+    assert GroupModel.get_role(group_id, user_id) == 'member'
+
+    # Другой процесс повышает участника, затем исключает его из группы
+    with get_db_cursor() as cursor:
+        cursor.execute("UPDATE group_members SET role = 'admin' WHERE group_id = ? AND user_id = ?", (group_id, user_id))
+    remote_event([f'g:{group_id}', f'u:{user_id}'], 'group',
+                 {'chat': f'g:{group_id}', 'op': 'role', 'group_id': group_id, 'user_id': user_id, 'role': 'admin'})
+    assert GroupModel.get_role(group_id, user_id) == 'admin'
+
+    with get_db_cursor() as cursor:
+        cursor.execute('DELETE FROM group_members WHERE group_id = ? AND user_id = ?', (group_id, user_id))
+    remote_event([f'g:{group_id}', f'u:{user_id}'], 'group',
+                 {'chat': f'g:{group_id}', 'op': 'member_remove', 'group_id': group_id, 'user_id': user_id})
+    assert not GroupModel.check_group_access(group_id, user_id)
+
+
+def test_remote_message_drops_recent_buffer(test_app, auth_headers):
+    from models.MessageModel import MessageModel
+    from models.message_cache import recent_messages
+    from utils import get_db_cursor
+    MessageModel.get_general_messages(0)
+    assert recent_messages.has('g:0')
+
+    # Другой процесс вставляет сообщение в общий чат
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO group_messages (group_id, user_id, message_text, timestamp) VALUES (0, 0, 'remote', ?)",
+            (int(time.time()),)
+        )
+        message_id = cursor.lastrowid
+    remote_event(['g:0'], 'message', {'chat': 'g:0', 'op': 'insert', 'id': message_id})
+
+    assert not recent_messages.has('g:0')
+    assert message_id in [m['id'] for m in MessageModel.get_general_messages(0)]
@@ -18,4 +18,34 @@ def test_500_internal_server_error(test_app, monkeypatch):
     from views import error as error_view
     monkeypatch.setattr(error_view, "NotFoundView", lambda *a, **kw: 1/0)
     resp = test_app.get('/not_existing_url', expect_errors=True)
-    assert resp.status_code == 500 or resp.status_code == 404
\ No newline at end of file
+    assert resp.status_code == 500 or resp.status_code == 404
+
+def test_error_pages_served_from_template_cache(test_app):
+    import gzip
+    from app import app
+    from views.template_cache import template_cache
+    page = open('templates/404.html', 'rb').read()
+    test_app.get('/not_existing_url', status=404)
+    loads = template_cache.stats()['loads']
+    for _ in range(5):
+        resp = test_app.get('/not_existing_url', status=404)
+        assert resp.body == page
+        assert resp.headers['Content-Length'] == str(len(page))
+    assert template_cache.stats()['loads'] == loads
+
+    headers = {}
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/not_existing_url', 'HTTP_ACCEPT_ENCODING': 'gzip'}
+    body = b''.join(app(environ, lambda status, h, exc_info=None: headers.update(h)))
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == page
+
+def test_template_cache_reload(tmp_path):
+    from views.template_cache import TemplateCache
+    path = tmp_path / 'page.html'
+    path.write_text('<p>первая</p>', encoding='utf-8')
+    fixed, reloading = TemplateCache(reload=False), TemplateCache(reload=True)
+    assert fixed.get(str(path)).body == reloading.get(str(path)).body == '<p>первая</p>'.encode('utf-8')
+    path.write_text('<p>вторая версия</p>', encoding='utf-8')
+    assert fixed.get(str(path)).body == '<p>первая</p>'.encode('utf-8')
+    assert reloading.get(str(path)).body == '<p>вторая версия</p>'.encode('utf-8')
+    assert fixed.get(str(tmp_path / 'missing.html')) is None
@@ -0,0 +1,117 @@
+import json
+import pytest
+from webob import Request
+
+from app import app
+from utils.events import EventHub
+
+pytestmark = pytest.mark.events
+
+
+def test_event_is_serialized_once_for_all_subscribers():
+    hub = EventHub(max_streams=4, queue_size=8)
+    first = hub.subscribe(['g:0'])
+    second = hub.subscribe(['g:0', 'u:1'])
+    other = hub.subscribe(['g:5'])
+
+    hub.publish(['g:0'], 'message', {'chat': 'g:0', 'op': 'insert', 'id': 1})
+    frame = first.get(0)
+    assert frame is second.get(0)
+    assert other.get(0) is None
+    assert frame.startswith(b'event: message\ndata: ')
+
+
+def test_slow_subscriber_is_coalesced():
+    hub = EventHub(max_streams=1, queue_size=3)
+    slow = hub.subscribe(['g:0', 'g:1'])
+    hub.publish(['g:1'], 'message', {'chat': 'g:1', 'op': 'insert', 'id': 1})
+    for i in range(5):
+        hub.publish(['g:0'], 'message', {'chat': 'g:0', 'op': 'insert', 'id': i})
+
+    frames = []
+    while True:
+        frame = slow.get(0)
+        if frame is None:
+            break
+        frames.append(frame.decode('utf-8'))
+    assert len(frames) <= 3
+    assert frames[0].startswith('event: message') and '"chat": "g:1"' in frames[0]
+    assert any(f.startswith('event: resync') and '"chat": "g:0"' in f for f in frames)
+    assert hub.stats()['dropped'] > 0
+
+
+def test_stream_limit():
+    hub = EventHub(max_streams=1)
+    subscription = hub.subscribe(['g:0'])
+    assert hub.subscribe(['g:0']) is None
+    subscription.close()
+    assert hub.subscribe(['g:0']) is not None
+
+
+def test_events_stream_delivers_new_message(test_app, auth_headers):
+    user_id = test_app.cookies['user_id']
+    status = []
+    stream = app(
+        Request.blank('/events', headers={'Cookie': f'user_id={user_id}'}).environ,
+        lambda s, headers, exc_info=None: status.append((s, dict(headers)))
+    )
+    try:
+        assert status[0][0] == '200 OK'
+        assert status[0][1]['Content-Type'].startswith('text/event-stream')
+        assert b'event: ready' in next(stream)
+
+        message_id = test_app.post_json('/send_message', {'message': 'Streamed'}, headers=auth_headers).json['message_id']
+        frame = next(stream).decode('utf-8')
+        assert frame.startswith('event: message')
+        payload = json.loads(frame.split('data: ', 1)[1])
+        assert payload == {'chat': 'g:0', 'op': 'insert', 'id': message_id}
+    finally:
+        stream.close()
+
+
+def test_events_requires_login(test_app):
+    assert test_app.get('/events', expect_errors=True).status_code == 403
+
+
+def test_membership_change_ends_affected_subscriptions():
+    hub = EventHub(max_streams=4, queue_size=8)
+    removed = hub.subscribe(['g:0', 'u:2', 'g:7'])
+    member = hub.subscribe(['g:0', 'u:3', 'g:7'])
+
+    hub.publish(['g:7', 'u:2'], 'group', {'chat': 'g:7', 'op': 'member_remove', 'group_id': 7, 'user_id': 2})
+    hub.publish(['g:7'], 'message', {'chat': 'g:7', 'op': 'insert', 'id': 1})
+    # Исключённый получает событие о себе и больше ничего
+    assert removed.get(0).startswith(b'event: group')
+    assert removed.get(0) is None and removed.ended
+    assert member.get(0).startswith(b'event: group')
+    assert member.get(0).startswith(b'event: message')
+    assert not member.ended
+
+    hub.publish(['g:7', 'u:1'], 'group', {'chat': 'g:7', 'op': 'delete', 'group_id': 7, 'user_id': 1})
+    assert member.get(0).startswith(b'event: group')
+    assert member.ended
+    assert hub.stats()['streams'] == 0
+
+
+def test_removed_member_stream_closes(test_app, auth_headers):
+    from models.UserModel import UserModel
+    test_app.post('/register', {'username': 'streamleaver', 'password': 'Testpass123!'})
+    user_id = UserModel.get_user_id('streamleaver')
+    group_id = test_app.post_json('/create_group', {'name': 'Stream Leave Group'}, headers=auth_headers).json['group_id']
+    test_app.post_json('/add_to_group', {'group_id': group_id, 'username': 'streamleaver'}, headers=auth_headers)
+
+    stream = app(
+        Request.blank('/events', headers={'Cookie': f'user_id={user_id}'}).environ,
+        lambda s, headers, exc_info=None: None
+    )
+    try:
+        assert b'event: ready' in next(stream)
+        test_app.post_json('/remove_from_group', {'group_id': group_id, 'username': 'streamleaver'},
+                           headers=auth_headers)
+        frame = next(stream).decode('utf-8')
+        assert frame.startswith('event: group') and '"member_remove"' in frame
+        test_app.post_json('/send_message', {'message': 'After removal', 'group_id': group_id}, headers=auth_headers)
+        with pytest.raises(StopIteration):
+            next(stream)
+    finally:
+        stream.close()
@@ -0,0 +1,87 @@
+import threading
+import time
+import pytest
+from webtest import TestApp
+
+from app import app
+from utils.notify import ChatNotifier
+
+pytestmark = pytest.mark.longpoll
+
+
+def test_notifier_wakes_waiter():
+    notifier = ChatNotifier(max_waiters=2)
+    versions = notifier.version('g:1')
+    timer = threading.Timer(0.05, notifier.notify, args=('g:1',))
+    timer.start()
+    started = time.monotonic()
+    assert notifier.wait(('g:1',), versions, 5)
+    assert time.monotonic() - started < 2
+    assert notifier.stats()['wakeups'] == 1
+
+
+def test_notifier_ignores_other_chats():
+    notifier = ChatNotifier(max_waiters=2)
+    versions = notifier.version('g:1', 'u:7')
+    notifier.notify('g:2')
+    assert not notifier.wait(('g:1', 'u:7'), versions, 0.05)
+    notifier.notify('u:7')
+    # Изменение до начала ожидания не теряется
+    assert notifier.wait(('g:1', 'u:7'), versions, 0.05)
+
+
+
+def test_notifier_keeps_bounded_versions():
+    notifier = ChatNotifier(max_waiters=1, max_chats=2)
+    versions = notifier.version('p:1:2')
+    notifier.notify('p:1:2')
+    changed = notifier.version('p:1:2')
+    for chat in ('p:3:4', 'p:5:6', 'p:7:8'):
+        notifier.notify(chat)
+    stats = notifier.stats()
+    assert stats['chats'] == 2 and stats['evicted'] == 2
+    # Вытесненный чат, изменённый снова, не совпадает ни с одним прежним счётчиком
+    notifier.notify('p:1:2')
+    assert notifier.wait(('p:1:2',), versions, 0.05)
+    assert notifier.wait(('p:1:2',), changed, 0.05)
+
+
+def test_notifier_caps_waiters():
+    notifier = ChatNotifier(max_waiters=1)
+    versions = notifier.version('g:1')
+    parked = threading.Thread(target=notifier.wait, args=(('g:1',), versions, 5))
+    parked.start()
+    while notifier.stats()['waiting'] == 0:
+        time.sleep(0.01)
+
+    started = time.monotonic()
+    assert not notifier.wait(('g:1',), versions, 5)
+    assert time.monotonic() - started < 1
+    assert notifier.stats()['rejected'] == 1
+
+    notifier.notify('g:1')
+    parked.join()
+
+
+def test_group_messages_wait_returns_new_message(test_app, auth_headers):
+    group_id = test_app.post_json('/create_group', {'name': 'Long Poll Group'}, headers=auth_headers).json['group_id']
+    sender = TestApp(app)
+    for name, value in test_app.cookies.items():
+        sender.set_cookie(name, value)
+
+    def send():
+        time.sleep(0.3)
+        sender.post_json('/send_message', {'message': 'Long poll wakeup', 'group_id': group_id}, headers=auth_headers)
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    started = time.monotonic()
+    response = test_app.get(f'/get_group_messages?group_id={group_id}&timestamp=0&wait=10', headers=auth_headers)
+    thread.join()
+    assert time.monotonic() - started < 5
+    assert [msg['message_text'] for msg in response.json['messages']] == ['Long poll wakeup']
+
+
+def test_get_messages_rejects_bad_wait(test_app, auth_headers):
+    response = test_app.get('/get_messages?wait=soon', headers=auth_headers, expect_errors=True)
+    assert response.status_code == 400
@@ -90,4 +90,292 @@ def test_get_messages_timestamp_filter(test_app, auth_headers):
 def test_send_system_message(test_app, auth_headers):
     resp = test_app.post_json('/send_system_message', {'message': 'System!'}, headers=auth_headers)
     assert resp.status_code == 200
-    assert resp.json['status'] == 'success'
\ No newline at end of file
+    assert resp.json['status'] == 'success'
+
+def test_system_message_is_published(test_app, auth_headers):
+    import json
+    from utils import subscribe_events
+    group_id = test_app.post_json('/create_group', {'name': 'System Event Group'}, headers=auth_headers).json['group_id']
+    subscription = subscribe_events([f'g:{group_id}'])
+    try:
+        test_app.post_json('/send_system_message', {
+            'type': 'group_leave', 'username': 'someone', 'group_id': group_id
+        }, headers=auth_headers)
+        frame = subscription.get(1).decode('utf-8')
+    finally:
+        subscription.close()
+    payload = json.loads(frame.split('data: ', 1)[1])
+    assert frame.startswith('event: message')
+    assert payload['chat'] == f'g:{group_id}' and payload['op'] == 'insert'
+    messages = test_app.get(f'/get_group_messages?group_id={group_id}&timestamp=0', headers=auth_headers).json['messages']
+    assert [m['id'] for m in messages if m['message_text'] == 'Пользователь someone покинул группу'] == [payload['id']]
+
+def test_sync_reports_changes_after_cursor(test_app, auth_headers):
+    # Запрос без курсора возвращает текущую позицию журнала
+    head = test_app.get('/sync?type=general', headers=auth_headers).json
+    assert head['inserted'] == [] and head['edited'] == [] and head['deleted'] == []
+
+    kept = test_app.post_json('/send_message', {'message': 'Sync kept'}, headers=auth_headers).json['message_id']
+    gone = test_app.post_json('/send_message', {'message': 'Sync gone'}, headers=auth_headers).json['message_id']
+    first = test_app.get(f"/sync?type=general&cursor={head['cursor']}", headers=auth_headers).json
+    assert first['inserted'] == [kept, gone]
+
+    test_app.put_json(f'/edit_message/{kept}?type=general', {'message': 'Sync edited'}, headers=auth_headers)
+    test_app.delete(f'/delete_message/{gone}?type=general', headers=auth_headers)
+    second = test_app.get(f"/sync?type=general&cursor={first['cursor']}", headers=auth_headers).json
+    assert second['edited'] == [{'id': kept, 'text': 'Sync edited'}]
+    assert second['deleted'] == [gone]
+    assert second['cursor'] > first['cursor']
+
+def test_sync_rejects_bad_cursor(test_app, auth_headers):
+    response = test_app.get('/sync?type=general&cursor=abc', headers=auth_headers, expect_errors=True)
+    assert response.status_code == 400
+
+def test_attachment_is_streamed_only_to_chat_members(test_app, auth_headers):
+    import os
+    import hashlib
+    test_app.post('/register', {'username': 'attachpartner', 'password': 'Testpass123!'})
+    data = os.urandom(200 * 1024)
+    test_app.post('/send_message', {'message': '', 'receiver': 'attachpartner'},
+                  upload_files=[('files', 'clip.mp3', data)], headers=auth_headers)
+    path = f'/static/uploads/{hashlib.sha256(data).hexdigest()}/clip.mp3'
+
+    full = test_app.get(path)
+    assert full.body == data
+    assert full.headers['Accept-Ranges'] == 'bytes'
+    assert full.headers['Content-Length'] == str(len(data))
+    assert full.headers['Cache-Control'] == 'private, no-cache'
+
+    # Перемотка: часть файла с середины и до конца
+    part = test_app.get(path, headers={'Range': 'bytes=1000-'}, status=206)
+    assert part.body == data[1000:]
+    assert part.headers['Content-Range'] == f'bytes 1000-{len(data) - 1}/{len(data)}'
+    tail = test_app.get(path, headers={'Range': 'bytes=-10'}, status=206)
+    assert tail.body == data[-10:]
+    stale = test_app.get(path, headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert stale.status_code == 200 and stale.body == data
+    test_app.get(path, headers={'Range': f'bytes={len(data)}-'}, status=416)
+    test_app.get(path, headers={'If-None-Match': full.headers['ETag']}, status=304)
+
+    intruder = TestApp(app)
+    intruder.post('/register', {'username': 'attachintruder', 'password': 'Testpass123!'})
+    intruder.post('/login', {'username': 'attachintruder', 'password': 'Testpass123!'})
+    intruder.get(path, status=404)
+    TestApp(app).get(path, status=401)
+
+def test_audio_attachment_seeks_with_audio_type(test_app, auth_headers):
+    import os
+    import hashlib
+    data = os.urandom(64 * 1024)
+    test_app.post('/send_message', {'message': 'voice'},
+                  upload_files=[('files', 'voice.mp3', data)], headers=auth_headers)
+    path = f'/static/uploads/{hashlib.sha256(data).hexdigest()}/voice.mp3'
+
+    part = test_app.get(path, headers={'Range': 'bytes=100-199'}, status=206)
+    assert part.headers['Content-Type'] == 'audio/mpeg'
+    assert part.headers['Content-Range'] == f'bytes 100-199/{len(data)}'
+    assert part.body == data[100:200]
+
+def test_attachment_uses_file_wrapper(test_app, auth_headers):
+    import os
+    import hashlib
+    data = os.urandom(4096)
+    test_app.post('/send_message', {'message': 'with file'},
+                  upload_files=[('files', 'note.bin', data)], headers=auth_headers)
+    path = f'/static/uploads/{hashlib.sha256(data).hexdigest()}/note.bin'
+    user_id = test_app.cookies['user_id']
+
+    wrapped = []
+    def file_wrapper(f, block_size):
+        wrapped.append(f)
+        return iter(lambda: f.read(block_size), b'')
+
+    def call(extra):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'HTTP_COOKIE': f'user_id={user_id}',
+                   'wsgi.file_wrapper': file_wrapper, **extra}
+        status = []
+        body = app(environ, lambda s, h, exc_info=None: status.append(s))
+        return status[0], b''.join(body)
+
+    # Файл до конца передаётся серверу через wsgi.file_wrapper
+    assert call({}) == ('200 OK', data)
+    assert call({'HTTP_RANGE': 'bytes=100-'}) == ('206 Partial Content', data[100:])
+    assert len(wrapped) == 2
+    # Диапазон из середины читается частями без file_wrapper
+    assert call({'HTTP_RANGE': 'bytes=10-19'}) == ('206 Partial Content', data[10:20])
+    assert len(wrapped) == 2
+
+class _LazyUpload:
+    """
+    Тело multipart-запроса с файлом size байт, создаваемое по мере чтения.
+    """
+    boundary = 'testboundary42'
+    block = bytes(range(256)) * 16
+
+    def __init__(self, size):
+        self.head = (f'--{self.boundary}\r\nContent-Disposition: form-data; name="message"\r\n\r\n'
+                     f'с файлом\r\n--{self.boundary}\r\nContent-Disposition: form-data; name="files"; '
+                     f'filename="big.bin"\r\nContent-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode()
+        self.size = size
+        self.length = len(self.head) + size + len(self.tail)
+        self.pos = 0
+
+    def read(self, n):
+        out = bytearray()
+        while n > 0 and self.pos < self.length:
+            if self.pos < len(self.head):
+                piece = self.head[self.pos:self.pos + n]
+            elif self.pos < len(self.head) + self.size:
+                offset = (self.pos - len(self.head)) % len(self.block)
+                piece = self.block[offset:offset + min(n, len(self.head) + self.size - self.pos)]
+            else:
+                start = self.pos - len(self.head) - self.size
+                piece = self.tail[start:start + n]
+            out += piece
+            self.pos += len(piece)
+            n -= len(piece)
+        return bytes(out)
+
+    def environ(self):
+        return {'CONTENT_TYPE': f'multipart/form-data; boundary={self.boundary}',
+                'CONTENT_LENGTH': str(self.length), 'wsgi.input': self}
+
+def test_multipart_upload_is_streamed_to_disk(tmp_path):
+    import hashlib
+    import tracemalloc
+    from utils.multipart import parse_multipart
+
+    peaks = {}
+    for size in (1024 * 1024, 16 * 1024 * 1024 + 123):
+        body = _LazyUpload(size)
+        tracemalloc.start()
+        fields, files = parse_multipart(body.environ(), str(tmp_path), max_size=64 * 1024 * 1024)
+        peaks[size] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        expected = hashlib.sha256()
+        for offset in range(0, size, len(body.block)):
+            expected.update(body.block[:min(len(body.block), size - offset)])
+        assert fields == {'message': 'с файлом'}
+        assert [(f.name, f.filename, f.size) for f in files] == [('files', 'big.bin', size)]
+        assert files[0].sha256 == expected.hexdigest()
+        target = tmp_path / f'{files[0].sha256}.bin'
+        files[0].move_to(str(target))
+        assert target.stat().st_size == size
+        assert [p.name for p in tmp_path.iterdir() if p.name.startswith('.upload-')] == []
+
+    # Пик памяти не зависит от размера файла: в памяти только блок чтения
+    small, large = peaks.values()
+    assert large < 1024 * 1024
+    assert large < small + 256 * 1024
+
+def test_upload_size_limit_checked_before_body(test_app, auth_headers, monkeypatch):
+    from app import app
+    import utils.multipart
+    monkeypatch.setattr(utils.multipart, 'MAX_UPLOAD_SIZE', 1024)
+
+    class Unread:
+        def read(self, n):
+            raise AssertionError('body must not be read')
+
+    status = []
+    environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/send_message',
+               'HTTP_COOKIE': f"user_id={test_app.cookies['user_id']}",
+               **_LazyUpload(4096).environ()}
+    environ['wsgi.input'] = Unread()
+    app(environ, lambda s, h, exc_info=None: status.append(s))
+    assert status == ['413 Payload Too Large']
+
+def test_attachment_blobs_are_shared_and_collected(test_app, auth_headers):
+    import os
+    import time
+    import hashlib
+    from models.blob_store import blob_store
+    from utils import get_read_cursor
+
+    def refcount(blob_hash):
+        with get_read_cursor() as cursor:
+            cursor.execute('SELECT refcount FROM blobs WHERE hash = ?', (blob_hash,))
+            row = cursor.fetchone()
+        return row and row[0]
+
+    data = os.urandom(10000)
+    blob_hash = hashlib.sha256(data).hexdigest()
+    ids = [
+        test_app.post('/send_message', {'message': f'blob {name}'},
+                      upload_files=[('files', name, data)], headers=auth_headers).json['message_id']
+        for name in ('one.bin', 'two.bin')
+    ]
+    # Одни и те же байты под двумя именами хранятся одним файлом
+    assert refcount(blob_hash) == 2
+    assert test_app.get(f'/static/uploads/{blob_hash}/two.bin').body == data
+    assert os.path.getsize(blob_store.path(blob_hash)) == len(data)
+
+    test_app.delete(f'/delete_message/{ids[0]}?type=general', headers=auth_headers)
+    assert refcount(blob_hash) == 1
+    test_app.delete(f'/delete_message/{ids[1]}?type=general', headers=auth_headers)
+    assert refcount(blob_hash) == 0
+
+    # До истечения отсрочки файл не удаляется
+    blob_store.collect_garbage(pause=0)
+    assert os.path.exists(blob_store.path(blob_hash))
+    assert blob_store.collect_garbage(now=int(time.time()) + 7200, batch=1, pause=0) >= 1
+    assert refcount(blob_hash) is None
+    assert not os.path.exists(blob_store.path(blob_hash))
+
+def test_insert_event_is_published_after_attachments(test_app, auth_headers, monkeypatch):
+    import os
+    from models.MessageModel import MessageModel
+    from utils import get_read_cursor
+    publish_change = MessageModel.publish_change
+    seen = []
+
+    def record(op, message_type, user_id, chat_id, message_id, text=None):
+        with get_read_cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM attachments WHERE message_type = 'group' AND message_id = ?", (message_id,)
+            )
+            seen.append((op, message_id, cursor.fetchone()[0]))
+        publish_change(op, message_type, user_id, chat_id, message_id, text)
+
+    monkeypatch.setattr(MessageModel, 'publish_change', staticmethod(record))
+    message_id = test_app.post('/send_message', {'message': 'with files'},
+                               upload_files=[('files', 'a.bin', os.urandom(100)), ('files', 'b.bin', os.urandom(100))],
+                               headers=auth_headers).json['message_id']
+    # Одно событие вставки, и к его публикации оба вложения уже сохранены
+    assert seen == [('insert', message_id, 2)]
+
+def test_deleted_group_releases_blobs_and_legacy_files_are_imported(test_app, auth_headers):
+    import os
+    import hashlib
+    from models import MessageModel
+    from models.blob_store import blob_store
+    from utils import get_read_cursor
+
+    def blob_row(blob_hash):
+        with get_read_cursor() as cursor:
+            cursor.execute('SELECT refcount FROM blobs WHERE hash = ?', (blob_hash,))
+            return cursor.fetchone()
+
+    group_id = test_app.post_json('/create_group', {'name': 'blob_group'}, headers=auth_headers).json['group_id']
+    data = os.urandom(5000)
+    test_app.post('/send_message', {'message': 'in group', 'group_id': str(group_id)},
+                  upload_files=[('files', 'g.bin', data)], headers=auth_headers)
+    blob_hash = hashlib.sha256(data).hexdigest()
+    assert blob_row(blob_hash) == (1,)
+    test_app.post_json('/leave_group', {'group_id': group_id}, headers=auth_headers)
+    assert blob_row(blob_hash) == (0,)
+
+    # Файл, сохранённый до хранилища, переносится в него при запуске
+    legacy = os.urandom(3000)
+    legacy_path = os.path.join('static', 'uploads', 'legacy_old.bin')
+    with open(legacy_path, 'wb') as f:
+        f.write(legacy)
+    message_id = test_app.post_json('/send_message', {'message': 'legacy'}, headers=auth_headers).json['message_id']
+    MessageModel.add_attachment('group', message_id, '/' + legacy_path, 'application/octet-stream', 'old.bin')
+    assert blob_store.import_legacy_uploads() == 1
+    legacy_hash = hashlib.sha256(legacy).hexdigest()
+    assert blob_row(legacy_hash) == (1,)
+    assert not os.path.exists(legacy_path)
+    assert test_app.get('/' + legacy_path).body == legacy
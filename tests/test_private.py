@@ -53,4 +53,28 @@ def test_private_chat_updates_after_message(test_app, auth_headers):
         'receiver': 'privpartner3'
     }, headers=auth_headers)
     resp = test_app.get('/check_private_chats_updates', headers=auth_headers)
-    assert resp.status_code == 200
\ No newline at end of file
+    assert resp.status_code == 200
+
+def test_private_messages_encrypted_as_one_batch(test_app, auth_headers):
+    import json
+    import base64
+    from Crypto.Cipher import AES
+    from models.session import create_session
+
+    test_app.post('/register', {'username': 'privpartner4', 'password': 'Testpass123!'})
+    for text in ('Первое', 'Второе'):
+        test_app.post_json('/send_message', {'message': text, 'receiver': 'privpartner4'}, headers=auth_headers)
+    session_id, key = create_session()
+
+    resp = test_app.get(
+        f'/get_private_messages?user=privpartner4&session_id={session_id}&enc=gcm',
+        headers=auth_headers
+    )
+    assert resp.status_code == 200
+    assert 'messages' not in resp.json
+    encrypted = resp.json['encrypted']
+    data = base64.b64decode(encrypted['data'])
+    cipher = AES.new(key, AES.MODE_GCM, nonce=base64.b64decode(encrypted['nonce']))
+    messages = json.loads(cipher.decrypt_and_verify(data[:-16], data[-16:]))
+    assert [msg['message_text'] for msg in messages] == ['Первое', 'Второе']
+    assert resp.json['timestamp'] == max(msg['timestamp'] for msg in messages)
@@ -1,9 +1,24 @@
+import os
+import re
+import gzip
+import timeit
 import unittest
 import routes
 import mimes
 import pytest
 pytestmark = pytest.mark.routes
 
+BENCH_URLS = ['/get_messages', '/delete_message/42', '/static/app.js', '/no_such_page']
+
+
+def legacy_match(url):
+    # Прежний выбор маршрута: перебор всех ключей как регулярных выражений
+    for key in routes.routes.keys():
+        match = re.match(key, url)
+        if match:
+            return routes.routes[key], re.match(key, url).groups()
+    return None, ()
+
 class TestRoutes(unittest.TestCase):
     def route(self, url, expected):
         self.assertEqual(routes.route(url), expected)
@@ -17,6 +32,51 @@ class TestRoutes(unittest.TestCase):
         """Тест static файлов"""
         self.route('/static/app.js', '/static/app.js')
 
+    def test_match_route(self):
+        """Поиск представления и параметров URL"""
+        view, params = routes.match_route('/edit_message/42')
+        self.assertIs(view, routes.routes[r'^/edit_message/(\d+)$'])
+        self.assertEqual(params, ('42',))
+        self.assertEqual(routes.match_route('/no_such_page'), (None, ()))
+
+    def test_exact_routes_do_not_match_longer_paths(self):
+        """Путь без '$' в ключе больше не совпадает с продолжением"""
+        self.assertIs(routes.match_route('/get_messages')[0], routes.routes['/get_messages'])
+        self.assertEqual(routes.match_route('/get_messages_old'), (None, ()))
+        self.assertEqual(routes.match_route('/edit_message/42/extra'), (None, ()))
+        self.assertIs(routes.match_route('/favicon.ico')[0], routes.routes['^/favicon.ico$'])
+
+    def test_prefix_routes(self):
+        """Префикс /static/ находится по дереву сегментов"""
+        self.assertIs(routes.match_route('/static/img/logo.png')[0], routes.routes['/static/'])
+        self.assertEqual(routes.match_route('/static'), (None, ()))
+
+    def test_method_allowed(self):
+        send = routes.routes['/send_message']
+        self.assertTrue(routes.method_allowed(send, 'POST'))
+        self.assertFalse(routes.method_allowed(send, 'GET'))
+        self.assertFalse(routes.method_allowed(routes.routes['/get_messages'], 'DELETE'))
+        self.assertTrue(routes.method_allowed(routes.routes['/get_messages'], 'HEAD'))
+        edit = routes.routes[r'^/edit_message/(\d+)$']
+        self.assertTrue(routes.method_allowed(edit, 'PATCH'))
+        self.assertFalse(routes.method_allowed(edit, 'POST'))
+        # Каждое представление объявляет свои методы
+        for key, view_class in routes.routes.items():
+            self.assertIsNotNone(view_class.methods, key)
+
+    def test_dispatch_matches_legacy(self):
+        """Скомпилированный маршрутизатор выбирает те же представления, что прежний перебор выражений"""
+        for url in BENCH_URLS:
+            self.assertEqual(routes.match_route(url), legacy_match(url))
+
+    @unittest.skipUnless(os.environ.get('MESSENGER_BENCH') == '1', 'замер включается MESSENGER_BENCH=1')
+    def test_dispatch_benchmark(self):
+        """Стоимость выбора маршрута на запрос: MESSENGER_BENCH=1 pytest -s -k dispatch_benchmark"""
+        number, repeat = 2000, 5
+        for name, match in (('legacy', legacy_match), ('compiled', routes.match_route)):
+            best = min(timeit.repeat(lambda: [match(u) for u in BENCH_URLS], number=number, repeat=repeat))
+            print(f"dispatch {name}: {best / (number * len(BENCH_URLS)) * 1e6:.2f} us/request")
+
 class TestMimes(unittest.TestCase):
     def mime(self, file, content):
         self.assertEqual(mimes.get_mime(file), content)
@@ -26,3 +86,86 @@ class TestMimes(unittest.TestCase):
 
     def test_css(self):
         self.mime('/static/style.css', 'text/css')
+
+    def test_audio_video(self):
+        self.mime('/static/uploads/abc/clip.mp3', 'audio/mpeg')
+        self.mime('voice.ogg', 'audio/ogg')
+        self.mime('movie.mp4', 'video/mp4')
+        self.mime('movie.webm', 'video/webm')
+
+
+def test_head_returns_headers_without_body(test_app):
+    response = test_app.head('/login')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/html')
+    assert response.body == b''
+
+
+def test_method_not_allowed_lists_allowed_methods(test_app):
+    response = test_app.put('/send_message', expect_errors=True)
+    assert response.status_code == 405
+    assert response.headers['Allow'] == 'POST'
+    # Чтения не принимают изменяющих методов
+    response = test_app.delete('/get_messages', expect_errors=True)
+    assert response.status_code == 405
+    assert response.headers['Allow'] == 'GET, HEAD'
+
+
+def test_static_etag_gzip_and_not_modified(test_app):
+    # TestApp сам распаковывает gzip, поэтому сжатый ответ читается напрямую
+    from app import app
+    captured = {}
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/static/app.js', 'HTTP_ACCEPT_ENCODING': 'gzip, deflate'}
+    body = b''.join(app(environ, lambda status, headers: captured.update(headers)))
+    assert captured['Content-Encoding'] == 'gzip'
+    assert captured['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(body) == open('static/app.js', 'rb').read()
+
+    plain = test_app.get('/static/app.js')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['ETag'] != captured['ETag']
+
+    cached = test_app.get('/static/app.js', headers={'If-None-Match': plain.headers['ETag']}, status=304)
+    assert cached.body == b''
+    test_app.get('/static/app.js', headers={'If-Modified-Since': plain.headers['Last-Modified']}, status=304)
+
+
+def test_static_cache_follows_file_changes(test_app):
+    path = os.path.join('static', 'cache_probe.txt')
+    try:
+        with open(path, 'w') as f:
+            f.write('first')
+        assert test_app.get('/static/cache_probe.txt').body == b'first'
+        with open(path, 'w') as f:
+            f.write('second version')
+        assert test_app.get('/static/cache_probe.txt').body == b'second version'
+    finally:
+        os.remove(path)
+    test_app.get('/static/cache_probe.txt', status=404)
+
+
+def test_static_path_traversal_is_rejected(test_app):
+    test_app.get('/static/../app.py', status=404)
+
+
+def test_static_cache_memory_cap(tmp_path):
+    from views.static_cache import StaticCache
+    cache = StaticCache(max_bytes=150, max_file=100)
+    for name in ('a', 'b', 'c'):
+        (tmp_path / name).write_bytes(os.urandom(60))
+    (tmp_path / 'big').write_bytes(os.urandom(200))
+    for name in ('a', 'b', 'c'):
+        assert cache.get(str(tmp_path / name)).body is not None
+    assert cache.get(str(tmp_path / 'big')).body is None
+    stats = cache.stats()
+    assert stats['files'] == 2 and stats['bytes'] <= 150
+    assert stats['evicted'] == 1 and stats['uncached'] == 1
+
+
+def test_static_range_for_audio(test_app):
+    data = open('static/Sound/notification.mp3', 'rb').read()
+    part = test_app.get('/static/Sound/notification.mp3', headers={'Range': 'bytes=0-99'}, status=206)
+    assert part.body == data[:100]
+    assert part.headers['Content-Range'] == f'bytes 0-99/{len(data)}'
+    assert 'Content-Encoding' not in part.headers
+    test_app.get('/static/Sound/notification.mp3', headers={'Range': f'bytes={len(data)}-'}, status=416)
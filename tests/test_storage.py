@@ -0,0 +1,323 @@
+import sqlite3
+import threading
+import pytest
+
+from utils import db_utils
+from utils.db_utils import ConnectionPool
+from utils.group_commit import GroupCommitQueue
+from utils import migrations
+
+pytestmark = pytest.mark.storage
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), size=2, timeout=0.2)
+    yield pool
+    pool.close()
+
+
+def test_pool_reuses_connection(pool):
+    conn = pool.acquire()
+    pool.release(conn)
+    conn2 = pool.acquire()
+    pool.release(conn2)
+    assert conn is conn2
+    stats = pool.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+
+
+def test_pool_nested_acquire_same_thread(pool):
+    outer = pool.acquire()
+    inner = pool.acquire()
+    assert outer is inner
+    pool.release(inner)
+    pool.release(outer)
+    assert pool.stats()['idle'] == 1
+
+
+def test_pool_wait_timeout(pool):
+    taken = []
+
+    def hold():
+        taken.append(pool.acquire())
+
+    for _ in range(2):
+        t = threading.Thread(target=hold)
+        t.start()
+        t.join()
+
+    with pytest.raises(sqlite3.OperationalError):
+        pool.acquire()
+    stats = pool.stats()
+    assert stats['waits'] == 1
+    assert stats['timeouts'] == 1
+
+
+def test_pool_rolls_back_uncommitted(pool):
+    conn = pool.acquire()
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    pool.release(conn)
+
+    conn = pool.acquire()
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    pool.release(conn)
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    path = str(tmp_path / 'storage.db')
+    writer = ConnectionPool(path, size=1, timeout=0.5)
+    readers = ConnectionPool(path, size=2, readonly=True)
+    monkeypatch.setattr(db_utils, 'DB_PATH', path)
+    monkeypatch.setattr(db_utils, '_writer', writer)
+    monkeypatch.setattr(db_utils, '_readers', readers)
+    yield path
+    writer.close()
+    readers.close()
+
+
+def test_read_cursor_is_query_only(storage):
+    with db_utils.get_db_cursor() as cursor:
+        cursor.execute('CREATE TABLE t (x INTEGER)')
+    with pytest.raises(sqlite3.OperationalError):
+        with db_utils.get_read_cursor() as cursor:
+            cursor.execute('INSERT INTO t VALUES (1)')
+
+
+def test_read_inside_write_sees_own_changes(storage):
+    with db_utils.get_db_cursor() as cursor:
+        cursor.execute('CREATE TABLE t (x INTEGER)')
+        cursor.execute('INSERT INTO t VALUES (1)')
+        with db_utils.get_read_cursor() as read_cursor:
+            read_cursor.execute('SELECT COUNT(*) FROM t')
+            assert read_cursor.fetchone()[0] == 1
+
+
+def test_check_storage_enables_wal(storage):
+    report = db_utils.check_storage()
+    assert report['journal_mode'] == 'WAL'
+    assert report['writable']
+    assert report['query_only']
+
+
+def test_reader_not_blocked_by_writer(storage):
+    db_utils.check_storage()
+    with db_utils.get_db_cursor() as cursor:
+        cursor.execute('CREATE TABLE t (x INTEGER)')
+        cursor.execute('INSERT INTO t VALUES (1)')
+
+    written = threading.Event()
+    done = threading.Event()
+
+    def write():
+        with db_utils.get_db_cursor() as cursor:
+            cursor.execute('INSERT INTO t VALUES (2)')
+            written.set()
+            done.wait(5)
+
+    t = threading.Thread(target=write)
+    t.start()
+    written.wait(5)
+    try:
+        with db_utils.get_read_cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM t')
+            assert cursor.fetchone()[0] == 1
+    finally:
+        done.set()
+        t.join()
+
+    with db_utils.get_read_cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM t')
+        assert cursor.fetchone()[0] == 2
+
+
+def test_busy_error_is_retried(monkeypatch, pool):
+    calls = []
+
+    def flaky(cursor, sql, parameters=()):
+        calls.append(sql)
+        if len(calls) < 3:
+            raise sqlite3.OperationalError('database is locked')
+        return sqlite3.Cursor.execute(cursor, sql, parameters)
+
+    monkeypatch.setattr(db_utils, 'BUSY_BACKOFF', 0)
+    conn = pool.acquire()
+    try:
+        cursor = conn.cursor()
+        assert cursor._retry(flaky, 'SELECT 1').fetchone() == (1,)
+    finally:
+        pool.release(conn)
+    assert len(calls) == 3
+
+
+def test_group_commit_returns_each_row_id(storage):
+    with db_utils.get_db_cursor() as cursor:
+        cursor.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, x INTEGER)')
+
+    queue = GroupCommitQueue(window=0.05, max_batch=100)
+    queue.start()
+    results = []
+
+    def insert(value):
+        def write(cursor):
+            cursor.execute('INSERT INTO t (x) VALUES (?)', (value,))
+            return cursor.lastrowid
+        results.append((value, queue.submit(write)))
+
+    threads = [threading.Thread(target=insert, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    queue.stop()
+
+    with db_utils.get_read_cursor() as cursor:
+        cursor.execute('SELECT id, x FROM t')
+        rows = dict(cursor.fetchall())
+    assert len(rows) == 20
+    assert all(rows[row_id] == value for value, row_id in results)
+
+    stats = queue.stats()
+    assert stats['jobs'] == 20
+    assert stats['batches'] < 20
+    assert stats['queue_depth'] == 0
+
+
+def test_group_commit_isolates_failed_job(storage):
+    with db_utils.get_db_cursor() as cursor:
+        cursor.execute('CREATE TABLE t (x INTEGER NOT NULL)')
+
+    queue = GroupCommitQueue(window=0.05)
+    queue.start()
+    errors = []
+
+    def submit(value):
+        try:
+            queue.submit(lambda cursor: cursor.execute('INSERT INTO t VALUES (?)', (value,)))
+        except sqlite3.IntegrityError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=submit, args=(v,)) for v in (1, None, 3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    queue.stop()
+
+    with db_utils.get_read_cursor() as cursor:
+        cursor.execute('SELECT x FROM t ORDER BY x')
+        assert [row[0] for row in cursor.fetchall()] == [1, 3]
+    assert len(errors) == 1
+
+
+def test_group_commit_timeout_cancels_job(storage):
+    with db_utils.get_db_cursor() as cursor:
+        cursor.execute('CREATE TABLE t (x INTEGER)')
+
+    queue = GroupCommitQueue(window=0)
+    queue.start()
+    running, release = threading.Event(), threading.Event()
+
+    def slow(cursor):
+        running.set()
+        release.wait(5)
+        cursor.execute('INSERT INTO t VALUES (1)')
+
+    writer = threading.Thread(target=queue.submit, args=(slow,))
+    writer.start()
+    assert running.wait(5)
+    # Писатель занят: второе задание не успевает начаться и отменяется
+    with pytest.raises(TimeoutError):
+        queue.submit(lambda cursor: cursor.execute('INSERT INTO t VALUES (2)'), timeout=0.1)
+    release.set()
+    writer.join()
+    queue.stop()
+
+    with db_utils.get_read_cursor() as cursor:
+        cursor.execute('SELECT x FROM t')
+        assert [row[0] for row in cursor.fetchall()] == [1]
+    stats = queue.stats()
+    assert stats['cancelled_jobs'] == 1
+    assert stats['jobs'] == 1
+
+def test_migrate_fresh_database():
+    conn = sqlite3.connect(':memory:')
+    applied = migrations.migrate(conn)
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.get_schema_version(conn) == migrations.SCHEMA_VERSION
+    assert migrations.migrate(conn) == []
+    conn.close()
+
+
+def test_migrate_existing_database_keeps_data():
+    conn = sqlite3.connect(':memory:')
+    # Схема в том виде, в каком её создавала прежняя initialize_database()
+    conn.execute('''
+        CREATE TABLE group_messages (
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER,
+            user_id INTEGER,
+            message_text TEXT,
+            timestamp INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX idx_group_messages_text_nocase
+        ON group_messages(message_text COLLATE NOCASE)
+    ''')
+    conn.execute("INSERT INTO group_messages (group_id, user_id, message_text, timestamp) VALUES (0, 1, 'old', 1)")
+    conn.commit()
+
+    migrations.migrate(conn)
+
+    assert conn.execute('SELECT message_text FROM group_messages').fetchall() == [('old',)]
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert 'idx_group_messages_group_ts' in indexes
+    assert 'idx_group_messages_text_nocase' not in indexes
+    conn.close()
+
+
+def test_conversations_are_backfilled():
+    conn = sqlite3.connect(':memory:')
+    migrations.migrate(conn, target=4)
+    conn.executemany(
+        'INSERT INTO private_messages (sender_id, receiver_id, message_text, timestamp) VALUES (?, ?, ?, ?)',
+        [(1, 2, 'first', 10), (2, 1, 'reply', 20), (3, 1, 'other', 15)]
+    )
+    conn.commit()
+
+    migrations.migrate(conn)
+
+    assert conn.execute('''
+        SELECT low_id, high_id, last_activity, last_sender_id, last_message_preview
+        FROM conversations ORDER BY low_id, high_id
+    ''').fetchall() == [(1, 2, 20, 2, 'reply'), (1, 3, 15, 3, 'other')]
+    assert conn.execute(
+        'SELECT COUNT(*) FROM private_messages WHERE conversation_id IS NULL'
+    ).fetchone()[0] == 0
+    conn.close()
+
+
+def test_failed_migration_is_rolled_back(monkeypatch):
+    conn = sqlite3.connect(':memory:')
+    migrations.migrate(conn, target=1)
+
+    def broken(cursor):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS + [
+        (migrations.SCHEMA_VERSION + 1, 'broken', ['CREATE TABLE half_done (x)', broken]),
+    ])
+    monkeypatch.setattr(migrations, 'SCHEMA_VERSION', migrations.SCHEMA_VERSION + 1)
+
+    with pytest.raises(RuntimeError):
+        migrations.migrate(conn, target=migrations.SCHEMA_VERSION)
+
+    assert migrations.get_schema_version(conn) == migrations.SCHEMA_VERSION - 1
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'half_done' not in tables
+    conn.close()
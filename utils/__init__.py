@@ -1,8 +1,20 @@
 from .db_utils import *
 from .pswd_utils import *
+from .group_commit import *
+from .notify import *
+from .events import *
+from .bus import *
+from .multipart import *
 
 __all__ = [
-    'hash_password' , 'check_password',
-    'get_db_connection', 'get_db_cursor',
-    
+    'hash_password' , 'check_password', 'PasswordHashingBusy', 'start_hashing_pool',
+    'stop_hashing_pool', 'get_hashing_stats', 'login_throttle',
+    'get_db_connection', 'get_db_cursor', 'get_read_cursor',
+    'configure_db', 'get_pool_stats', 'check_storage', 'holds_writer',
+    'run_write', 'start_group_commit', 'stop_group_commit', 'get_group_commit_stats',
+    'chat_version', 'notify_chats', 'wait_for_chats', 'wait_for_chats_async', 'get_notifier_stats',
+    'subscribe_events', 'get_event_stats',
+    'publish_event', 'subscribe_remote_events', 'start_bus_transport', 'stop_bus_transport',
+    'get_bus_stats',
+    'parse_multipart', 'UploadedFile', 'UploadTooLarge', 'MultipartError',
 ]
\ No newline at end of file
@@ -0,0 +1,229 @@
+import os
+import json
+import glob
+import socket
+import logging
+import threading
+
+from .events import format_event, deliver_event
+from .notify import notify_chats
+
+# Каталог сокетов для обмена событиями между процессами одной машины:
+# MESSENGER_BUS_SOCKET_DIR=/run/messenger. Без него шина работает
+# только внутри процесса
+BUS_SOCKET_DIR = os.environ.get('MESSENGER_BUS_SOCKET_DIR')
+# Датаграмма больше этого размера не рассылается другим процессам
+BUS_MAX_DATAGRAM = 64 * 1024
+
+
+class UnixSocketTransport:
+    """
+    Обмен событиями между процессами через датаграммные Unix-сокеты.
+
+    Каждый процесс слушает свой сокет <pid>.sock в общем каталоге и
+    отправляет событие во все остальные сокеты каталога. Отправка не
+    блокирует: если очередь процесса-получателя переполнена, событие
+    для него отбрасывается. Сокеты завершившихся процессов удаляются
+    при первой неудачной отправке.
+    """
+
+    def __init__(self, directory, name=None):
+        self.directory = directory
+        self.path = os.path.join(directory, f'{name or os.getpid()}.sock')
+        self._socket = None
+        self._thread = None
+        self._stats = {'sent': 0, 'received': 0, 'dropped': 0, 'peers': 0}
+
+    def start(self, on_message):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.path)
+        self._thread = threading.Thread(
+            target=self._receive, args=(self._socket, on_message),
+            name='event-bus', daemon=True
+        )
+        self._thread.start()
+
+    def _receive(self, sock, on_message):
+        while True:
+            try:
+                data = sock.recv(BUS_MAX_DATAGRAM)
+            except OSError:
+                return
+            if self._socket is not sock:
+                # Сокет закрыт в close()
+                return
+            self._stats['received'] += 1
+            on_message(data)
+
+    def send(self, data):
+        if self._socket is None or len(data) > BUS_MAX_DATAGRAM:
+            self._stats['dropped'] += 1
+            return
+        peers = [p for p in glob.glob(os.path.join(self.directory, '*.sock')) if p != self.path]
+        self._stats['peers'] = len(peers)
+        for peer in peers:
+            try:
+                self._socket.sendto(data, socket.MSG_DONTWAIT, peer)
+                self._stats['sent'] += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Процесс завершился, не убрав сокет
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+            except OSError:
+                self._stats['dropped'] += 1
+
+    def close(self):
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            try:
+                # Будит поток, ждущий в recv
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return dict(self._stats)
+
+
+class EventBus:
+    """
+    Шина событий чатов внутри процесса.
+
+    Событие публикуется по набору тем: 'g:<id>' - общий чат и группы,
+    'p:<id>:<id>' - личная переписка, 'u:<id>' - пользователь.
+    Кадр text/event-stream кодируется один раз и передаётся всем
+    обработчикам; обработчики по умолчанию будят долгие опросы и
+    раскладывают кадр по очередям подписчиков /events.
+    Транспорт (например, UnixSocketTransport) пересылает события в
+    другие процессы и доставляет их события сюда.
+    """
+
+    def __init__(self):
+        self._handlers = []
+        self._remote_handlers = []
+        self._transport = None
+        self._lock = threading.Lock()
+        self._stats = {'published': 0, 'remote': 0, 'handler_errors': 0}
+
+    def add_handler(self, handler):
+        """
+        Регистрирует обработчик handler(topics, event, payload, frame).
+        """
+        self._handlers.append(handler)
+
+    def add_remote_handler(self, handler):
+        """
+        Регистрирует обработчик только для событий из других процессов:
+        по ним процесс сбрасывает кеши, которые меняют записи других процессов.
+        """
+        self._remote_handlers.append(handler)
+
+    def publish(self, topics, event, payload):
+        """
+        Публикует событие в процессе и, если задан транспорт, в других процессах.
+        """
+        topics = tuple(topics)
+        with self._lock:
+            self._stats['published'] += 1
+        self._dispatch(self._handlers, topics, event, payload, format_event(event, payload))
+        transport = self._transport
+        if transport is not None:
+            transport.send(json.dumps(
+                {'topics': topics, 'event': event, 'payload': payload},
+                ensure_ascii=False
+            ).encode('utf-8'))
+
+    def _dispatch(self, handlers, topics, event, payload, frame):
+        for handler in handlers:
+            try:
+                handler(topics, event, payload, frame)
+            except Exception as e:
+                with self._lock:
+                    self._stats['handler_errors'] += 1
+                logging.error(f"Event bus handler error: {str(e)}", exc_info=True)
+
+    def _receive(self, data):
+        try:
+            message = json.loads(data.decode('utf-8'))
+            topics, event, payload = tuple(message['topics']), message['event'], message['payload']
+        except (ValueError, KeyError, TypeError):
+            logging.error("Event bus: malformed message dropped")
+            return
+        with self._lock:
+            self._stats['remote'] += 1
+        # Сначала сбрасываются кеши, затем будятся клиенты, которые их прочитают
+        frame = format_event(event, payload)
+        self._dispatch(self._remote_handlers, topics, event, payload, frame)
+        self._dispatch(self._handlers, topics, event, payload, frame)
+
+    def start_transport(self, transport):
+        self.stop_transport()
+        transport.start(self._receive)
+        self._transport = transport
+
+    def stop_transport(self):
+        transport, self._transport = self._transport, None
+        if transport is not None:
+            transport.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['handlers'] = len(self._handlers)
+        stats['remote_handlers'] = len(self._remote_handlers)
+        if self._transport is not None:
+            stats['transport'] = self._transport.stats()
+        return stats
+
+
+def _wake_long_polls(topics, event, payload, frame):
+    if event == 'message':
+        notify_chats(*topics)
+
+
+_bus = EventBus()
+_bus.add_handler(_wake_long_polls)
+_bus.add_handler(deliver_event)
+
+
+def publish_event(topics, event, payload):
+    """
+    Публикует событие чатов: будит долгие опросы и отправляет его в потоки /events.
+    """
+    _bus.publish(topics, event, payload)
+
+
+def subscribe_remote_events(handler):
+    """
+    Регистрирует handler(topics, event, payload, frame) для событий,
+    полученных от других процессов.
+    """
+    _bus.add_remote_handler(handler)
+
+
+def start_bus_transport(directory=BUS_SOCKET_DIR):
+    """
+    Подключает процесс к обмену событиями через Unix-сокеты в каталоге directory.
+    """
+    _bus.start_transport(UnixSocketTransport(directory))
+
+
+def stop_bus_transport():
+    _bus.stop_transport()
+
+
+def get_bus_stats():
+    """
+    Возвращает метрики шины событий.
+    """
+    return _bus.stats()
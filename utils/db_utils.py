@@ -1,17 +1,332 @@
+import os
+import time
 import sqlite3
+import logging
+import threading
 from contextlib import contextmanager
 
+# Путь к базе данных и параметры пула можно переопределить через окружение
+DB_PATH = os.environ.get('MESSENGER_DB_PATH', 'data.db')
+POOL_SIZE = int(os.environ.get('MESSENGER_DB_POOL_SIZE', 8))
+POOL_TIMEOUT = float(os.environ.get('MESSENGER_DB_POOL_TIMEOUT', 10))
+STATEMENT_CACHE_SIZE = int(os.environ.get('MESSENGER_DB_STATEMENT_CACHE', 256))
+
+# Режим журнала и уровень synchronous.
+#
+# WAL + synchronous=NORMAL (по умолчанию): читатели не блокируются писателем,
+# commit не делает fsync журнала. Зафиксированные транзакции переживают
+# падение процесса, но при отключении питания или падении ОС могут быть
+# потеряны последние транзакции (база при этом остаётся целостной).
+# synchronous=FULL делает fsync на каждый commit и даёт полную
+# долговечность ценой пропускной способности записи.
+JOURNAL_MODE = os.environ.get('MESSENGER_DB_JOURNAL_MODE', 'WAL').upper()
+SYNCHRONOUS = os.environ.get('MESSENGER_DB_SYNCHRONOUS', 'NORMAL').upper()
+
+_SYNCHRONOUS_LEVELS = {'OFF': 0, 'NORMAL': 1, 'FULL': 2, 'EXTRA': 3}
+
+# Повторы при SQLITE_BUSY / SQLITE_LOCKED
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.01
+BUSY_BACKOFF_MAX = 0.5
+
+_BUSY_CODES = {5, 6}  # SQLITE_BUSY, SQLITE_LOCKED
+
+
+def _is_busy_error(error):
+    """
+    Проверяет, что ошибка вызвана блокировкой базы данных.
+    """
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return (code & 0xff) in _BUSY_CODES
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class RetryingCursor(sqlite3.Cursor):
+    """
+    Курсор, повторяющий запрос с экспоненциальной задержкой,
+    если база данных занята другим соединением.
+    """
+
+    def _retry(self, method, *args):
+        delay = BUSY_BACKOFF
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                return method(self, *args)
+            except sqlite3.OperationalError as e:
+                if attempt == BUSY_RETRIES or not _is_busy_error(e):
+                    raise
+                logging.warning(f"Database is busy, retry {attempt + 1}: {str(e)}")
+                time.sleep(delay)
+                delay = min(delay * 2, BUSY_BACKOFF_MAX)
+
+    def execute(self, sql, parameters=()):
+        return self._retry(sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._retry(sqlite3.Cursor.executemany, sql, seq_of_parameters)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Соединение, курсоры которого повторяют запросы при SQLITE_BUSY.
+    """
+
+    def cursor(self, factory=RetryingCursor):
+        return super().cursor(factory)
+
+
+class ConnectionPool:
+    """
+    Пул долгоживущих соединений SQLite.
+
+    Поток, уже держащий соединение, получает его же при вложенном
+    использовании. Освобождённые соединения возвращаются в стек
+    свободных и переиспользуются другими потоками, поэтому connect,
+    разбор схемы и прогрев кеша запросов происходят один раз.
+    Соединения пула с readonly=True открываются в режиме query_only.
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 cached_statements=STATEMENT_CACHE_SIZE, readonly=False):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.readonly = readonly
+        self._idle = []
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            factory=PooledConnection,
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        conn.execute(f'PRAGMA synchronous = {SYNCHRONOUS}')
+        if self.readonly:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    def held_by_current_thread(self):
+        """
+        Проверяет, держит ли текущий поток соединение этого пула.
+        """
+        return getattr(self._local, 'conn', None) is not None
+
+    def acquire(self):
+        """
+        Выдаёт соединение текущему потоку.
+        """
+        local = self._local
+        if getattr(local, 'conn', None) is not None:
+            local.depth += 1
+            with self._cond:
+                self._stats['hits'] += 1
+            return local.conn
+
+        started = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError('Connection pool is closed')
+                if self._idle:
+                    conn = self._idle.pop()
+                    self._stats['hits'] += 1
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    self._stats['misses'] += 1
+                    conn = None
+                    break
+                if started is None:
+                    started = time.monotonic()
+                    self._stats['waits'] += 1
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    self._stats['wait_time'] += time.monotonic() - started
+                    raise sqlite3.OperationalError('Timed out waiting for a database connection')
+                self._cond.wait(remaining)
+            if started is not None:
+                self._stats['wait_time'] += time.monotonic() - started
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+
+        local.conn = conn
+        local.depth = 1
+        return conn
+
+    def release(self, conn):
+        """
+        Возвращает соединение в пул после выхода из внешнего контекста.
+        """
+        local = self._local
+        local.depth -= 1
+        if local.depth > 0:
+            return
+        local.conn = None
+
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logging.error(f"Dropping broken pooled connection: {str(e)}")
+            conn.close()
+            conn = None
+
+        with self._cond:
+            if conn is None or self._closed:
+                self._created -= 1
+                if conn is not None:
+                    conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def close(self):
+        """
+        Закрывает все свободные соединения пула.
+        """
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._idle.pop().close()
+                self._created -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Счётчики пула для подбора его размера.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._created
+            stats['idle'] = len(self._idle)
+        return stats
+
+
+# Все записи идут через единственное соединение-писатель,
+# чтения - через пул соединений-читателей.
+_writer = ConnectionPool(DB_PATH, size=1)
+_readers = ConnectionPool(DB_PATH, POOL_SIZE, readonly=True)
+
+
+def configure_db(path=None, pool_size=None):
+    """
+    Меняет путь к базе данных и/или размер пула читателей.
+    Текущие соединения закрываются, новые открываются по требованию.
+    """
+    global DB_PATH, POOL_SIZE, _writer, _readers
+    if path is not None:
+        DB_PATH = path
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    old_writer, old_readers = _writer, _readers
+    _writer = ConnectionPool(DB_PATH, size=1)
+    _readers = ConnectionPool(DB_PATH, POOL_SIZE, readonly=True)
+    old_writer.close()
+    old_readers.close()
+
+
+def get_pool_stats():
+    """
+    Возвращает статистику пула соединений (попадания, промахи, ожидание)
+    для писателя и читателей.
+    """
+    return {
+        'writer': _writer.stats(),
+        'readers': _readers.stats(),
+    }
+
+
+def holds_writer():
+    """
+    Проверяет, держит ли текущий поток соединение-писатель.
+    """
+    return _writer.held_by_current_thread()
+
+
+def check_storage():
+    """
+    Проверка хранилища при запуске.
+
+    Включает режим журнала JOURNAL_MODE, проверяет, что он действительно
+    применился, что писатель может взять блокировку на запись, а читатель
+    работает в режиме query_only с нужным уровнем synchronous.
+
+    Возвращает словарь с фактическими настройками; при невозможности
+    записать в базу выбрасывает sqlite3.OperationalError.
+    """
+    report = {'path': DB_PATH, 'sqlite_version': sqlite3.sqlite_version}
+
+    with get_db_connection() as conn:
+        mode = conn.execute(f'PRAGMA journal_mode = {JOURNAL_MODE}').fetchone()[0]
+        report['journal_mode'] = mode.upper()
+        if report['journal_mode'] != JOURNAL_MODE:
+            logging.warning(
+                f"Journal mode {JOURNAL_MODE} is not available for {DB_PATH}, "
+                f"using {report['journal_mode']}"
+            )
+        conn.execute('BEGIN IMMEDIATE')
+        conn.rollback()
+        report['writable'] = True
+
+    with get_db_connection(readonly=True) as conn:
+        conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        report['synchronous'] = conn.execute('PRAGMA synchronous').fetchone()[0]
+        report['query_only'] = bool(conn.execute('PRAGMA query_only').fetchone()[0])
+
+    if report['synchronous'] != _SYNCHRONOUS_LEVELS.get(SYNCHRONOUS):
+        logging.warning(f"Unexpected synchronous level: {report['synchronous']}")
+    if not report['query_only']:
+        logging.warning("Reader connections are not query_only")
+
+    logging.info(f"Storage self-check: {report}")
+    return report
+
+
 @contextmanager
-def get_db_connection():
+def get_db_connection(readonly=False):
     """
     Контекстный менеджер для работы с базой данных.
-    Автоматически открывает и закрывает соединение.
+    Берёт соединение из пула и возвращает его обратно.
+
+    Для записи выдаётся единственное соединение-писатель (остальные
+    пишущие потоки ждут его), для чтения - соединение из пула читателей.
+    Если поток уже держит писателя, чтение идёт через него, чтобы видеть
+    собственные незафиксированные изменения.
     """
-    conn = sqlite3.connect('data.db')
+    if readonly and not holds_writer():
+        pool = _readers
+    else:
+        pool = _writer
+    conn = pool.acquire()
     try:
         yield conn
     finally:
-        conn.close()
+        pool.release(conn)
 
 @contextmanager
 def get_db_cursor():
@@ -25,4 +340,17 @@ def get_db_cursor():
             yield cursor
             conn.commit()
         finally:
-            cursor.close()
\ No newline at end of file
+            cursor.close()
+
+@contextmanager
+def get_read_cursor():
+    """
+    Курсор только для чтения: не выполняет commit при выходе
+    и не ждёт соединение-писатель.
+    """
+    with get_db_connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
@@ -0,0 +1,211 @@
+import os
+import json
+import threading
+from collections import deque
+
+# Поток SSE занимает поток Waitress на всё время соединения,
+# поэтому число одновременных потоков событий ограничено
+EVENTS_MAX_STREAMS = int(os.environ.get('MESSENGER_SSE_MAX_STREAMS', 8))
+EVENTS_QUEUE_SIZE = int(os.environ.get('MESSENGER_SSE_QUEUE_SIZE', 64))
+# В режиме ASGI поток событий - корутина, а не поток ОС
+EVENTS_MAX_ASYNC_STREAMS = int(os.environ.get('MESSENGER_SSE_MAX_ASYNC_STREAMS', 10000))
+# Изменения состава группы, после которых ключи подписки устаревают
+MEMBERSHIP_OPS = frozenset({'create', 'member_add', 'member_remove', 'leave', 'delete'})
+
+
+def format_event(event, payload):
+    """
+    Сериализует событие в кадр text/event-stream.
+    """
+    data = json.dumps(payload, ensure_ascii=False)
+    return f'event: {event}\ndata: {data}\n\n'.encode('utf-8')
+
+
+class Subscription:
+    """
+    Подписка одного клиента на события набора чатов.
+
+    Очередь ограничена maxsize кадрами. Если клиент не успевает читать,
+    события переполненного чата заменяются одним событием resync для
+    этого чата (клиент догоняет его через /sync), а если и этого мало -
+    одним общим resync.
+
+    Подписка, завершённая end(), больше не получает событий, отдаёт уже
+    поставленные кадры, и поток закрывается.
+    """
+
+    def __init__(self, hub, keys, maxsize, native=False):
+        self.hub = hub
+        self.keys = frozenset(keys)
+        self.maxsize = maxsize
+        self.native = native
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+        self.ended = False
+        # Вызывается после каждого события; используется корутиной ASGI
+        self.listener = None
+
+    def put(self, chat, frame):
+        with self._cond:
+            if len(self._queue) >= self.maxsize:
+                self._coalesce(chat)
+            else:
+                self._queue.append((chat, frame))
+            self._cond.notify()
+        if self.listener is not None:
+            self.listener()
+
+    def _coalesce(self, chat):
+        before = len(self._queue)
+        self._queue = deque(item for item in self._queue if item[0] != chat)
+        if len(self._queue) < self.maxsize:
+            self._queue.append((chat, format_event('resync', {'chat': chat})))
+        else:
+            self._queue.clear()
+            self._queue.append((None, format_event('resync', {'chat': None})))
+        self.dropped += before + 1 - len(self._queue)
+
+    def get(self, timeout):
+        """
+        Возвращает следующий кадр или None, если за timeout событий не было.
+        """
+        with self._cond:
+            if not self._queue:
+                self._cond.wait_for(lambda: self._queue or self.closed or self.ended, timeout)
+            if self._queue:
+                return self._queue.popleft()[1]
+            return None
+
+    def end(self):
+        """
+        Отписывает от новых событий; поток закроется, когда клиент
+        прочитает уже поставленные кадры.
+        """
+        self.hub.unsubscribe(self)
+        with self._cond:
+            self.ended = True
+            self._cond.notify_all()
+        if self.listener is not None:
+            self.listener()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        if self.listener is not None:
+            self.listener()
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    """
+    Рассылка событий чатов подписчикам потока /events.
+
+    Событие сериализуется один раз при публикации, и один и тот же
+    кадр кладётся в очереди всех подписчиков, чьи ключи пересекаются
+    с ключами события.
+
+    Ключи групп вычисляются при подписке. Когда состав группы меняется
+    (MEMBERSHIP_OPS), подписки затронутого пользователя, а при удалении
+    группы - все её подписки, получают это событие последним и
+    завершаются: клиент переподключается с актуальным списком групп, и
+    исключённый участник не получает сообщений группы.
+    """
+
+    def __init__(self, max_streams=EVENTS_MAX_STREAMS, queue_size=EVENTS_QUEUE_SIZE,
+                 max_async_streams=EVENTS_MAX_ASYNC_STREAMS):
+        self.max_streams = max_streams
+        self.max_async_streams = max_async_streams
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._streams = {False: 0, True: 0}
+        self._stats = {'published': 0, 'delivered': 0, 'rejected': 0, 'ended': 0}
+
+    def subscribe(self, keys, native=False):
+        """
+        Регистрирует подписчика; возвращает None, если достигнут предел потоков.
+        native=True - поток обслуживается корутиной ASGI и считается
+        по отдельному, большему пределу.
+        """
+        limit = self.max_async_streams if native else self.max_streams
+        with self._lock:
+            if self._streams[native] >= limit:
+                self._stats['rejected'] += 1
+                return None
+            subscription = Subscription(self, keys, self.queue_size, native)
+            self._subscribers.add(subscription)
+            self._streams[native] += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.discard(subscription)
+                self._streams[subscription.native] -= 1
+
+    def publish(self, keys, event, payload, frame=None):
+        """
+        Отправляет событие подписчикам любого из ключей keys.
+        При переполнении очереди события сворачиваются по полю chat.
+        frame - уже закодированный кадр события, если он есть.
+        """
+        if frame is None:
+            frame = format_event(event, payload)
+        keys = frozenset(keys)
+        chat = payload.get('chat')
+        ending = ()
+        with self._lock:
+            targets = [s for s in self._subscribers if s.keys & keys]
+            if event == 'group' and payload.get('op') in MEMBERSHIP_OPS:
+                if payload['op'] == 'delete':
+                    ending = targets
+                else:
+                    user_key = f"u:{payload.get('user_id')}"
+                    ending = [s for s in targets if user_key in s.keys]
+            self._stats['published'] += 1
+            self._stats['delivered'] += len(targets)
+            self._stats['ended'] += len(ending)
+        for subscription in targets:
+            subscription.put(chat, frame)
+        for subscription in ending:
+            subscription.end()
+
+    def stats(self):
+        """
+        Метрики потока событий: подписчики, публикации, отброшенные события.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            subscribers = list(self._subscribers)
+        stats['streams'] = len(subscribers)
+        stats['async_streams'] = sum(1 for s in subscribers if s.native)
+        stats['max_streams'] = self.max_streams
+        stats['dropped'] = sum(s.dropped for s in subscribers)
+        return stats
+
+
+_hub = EventHub()
+
+
+def deliver_event(keys, event, payload, frame):
+    """
+    Раскладывает закодированное событие шины по очередям подписчиков /events.
+    """
+    _hub.publish(keys, event, payload, frame)
+
+
+def subscribe_events(keys, native=False):
+    """
+    Подписывает клиента на события чатов; None, если потоков слишком много.
+    """
+    return _hub.subscribe(keys, native)
+
+
+def get_event_stats():
+    """
+    Возвращает метрики потока событий.
+    """
+    return _hub.stats()
@@ -0,0 +1,237 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+from . import db_utils
+
+# Групповая фиксация включается явно: MESSENGER_GROUP_COMMIT=1
+GROUP_COMMIT_ENABLED = os.environ.get('MESSENGER_GROUP_COMMIT', '0') == '1'
+GROUP_COMMIT_WINDOW = float(os.environ.get('MESSENGER_GROUP_COMMIT_WINDOW_MS', 5)) / 1000
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('MESSENGER_GROUP_COMMIT_MAX_BATCH', 64))
+GROUP_COMMIT_TIMEOUT = 30
+
+
+class _WriteJob:
+    __slots__ = ('func', 'result', 'error', 'done', 'started', 'cancelled')
+
+    def __init__(self, func):
+        self.func = func
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        # Меняются под блокировкой очереди: задание либо отменено по
+        # таймауту до начала выполнения, либо начато и будет дождано
+        self.started = False
+        self.cancelled = False
+
+
+class GroupCommitQueue:
+    """
+    Очередь записей с групповой фиксацией.
+
+    Поток-писатель забирает задания, пришедшие в течение окна window
+    (или до max_batch штук), и выполняет их в одной транзакции на
+    соединении-писателе. Каждое задание изолировано SAVEPOINT'ом, поэтому
+    ошибка одного не откатывает остальные. Вызывающий поток блокируется
+    до фиксации и получает результат своего задания (например, id строки).
+    """
+
+    def __init__(self, window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._stats = {
+            'batches': 0,
+            'jobs': 0,
+            'failed_jobs': 0,
+            'cancelled_jobs': 0,
+            'max_queue_depth': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'commit_time': 0.0,
+            'last_commit_latency': 0.0,
+            'max_commit_latency': 0.0,
+        }
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name='group-commit-writer', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        Останавливает поток-писатель, дописав уже поставленные задания.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def submit(self, func, timeout=GROUP_COMMIT_TIMEOUT):
+        """
+        Ставит func(cursor) в очередь и ждёт фиксации транзакции.
+        Возвращает результат func или выбрасывает её исключение.
+
+        Если за timeout секунд задание не начало выполняться, оно
+        отменяется и не будет записано (TimeoutError). Начатое задание
+        дожидается фиксации, чтобы вызывающий узнал её исход.
+        """
+        job = _WriteJob(func)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError('Group commit queue is not running')
+            self._jobs.append(job)
+            depth = len(self._jobs)
+            if depth > self._stats['max_queue_depth']:
+                self._stats['max_queue_depth'] = depth
+            self._cond.notify()
+
+        if not job.done.wait(timeout):
+            with self._cond:
+                if not job.started:
+                    job.cancelled = True
+                    self._stats['cancelled_jobs'] += 1
+                    raise TimeoutError('Group commit timed out')
+            job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._jobs and self._running:
+                self._cond.wait()
+            if not self._jobs:
+                return []
+
+            deadline = time.monotonic() + self.window
+            while len(self._jobs) < self.max_batch and self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            while self._jobs and len(batch) < self.max_batch:
+                batch.append(self._jobs.popleft())
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            self._commit(batch)
+
+    def _commit(self, batch):
+        started = time.monotonic()
+        try:
+            with db_utils.get_db_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute('BEGIN IMMEDIATE')
+                    for job in batch:
+                        with self._cond:
+                            if job.cancelled:
+                                continue
+                            job.started = True
+                        cursor.execute('SAVEPOINT write_job')
+                        try:
+                            job.result = job.func(cursor)
+                            cursor.execute('RELEASE write_job')
+                        except Exception as e:
+                            cursor.execute('ROLLBACK TO write_job')
+                            cursor.execute('RELEASE write_job')
+                            job.error = e
+                    conn.commit()
+                finally:
+                    cursor.close()
+        except Exception as e:
+            logging.error(f"Group commit failed: {str(e)}", exc_info=True)
+            for job in batch:
+                if job.error is None and not job.cancelled:
+                    job.error = e
+                    job.result = None
+
+        latency = time.monotonic() - started
+        with self._cond:
+            batch = [job for job in batch if not job.cancelled]
+            failed = sum(1 for job in batch if job.error is not None)
+            stats = self._stats
+            stats['batches'] += 1
+            stats['jobs'] += len(batch)
+            stats['failed_jobs'] += failed
+            stats['last_batch_size'] = len(batch)
+            stats['max_batch_size'] = max(stats['max_batch_size'], len(batch))
+            stats['commit_time'] += latency
+            stats['last_commit_latency'] = latency
+            stats['max_commit_latency'] = max(stats['max_commit_latency'], latency)
+
+        for job in batch:
+            job.done.set()
+
+    def stats(self):
+        """
+        Метрики очереди: глубина, размер пачек, задержка фиксации.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['queue_depth'] = len(self._jobs)
+            stats['running'] = self._running
+        stats['avg_batch_size'] = stats['jobs'] / stats['batches'] if stats['batches'] else 0
+        stats['avg_commit_latency'] = stats['commit_time'] / stats['batches'] if stats['batches'] else 0
+        return stats
+
+
+_queue = GroupCommitQueue()
+
+
+def start_group_commit():
+    """
+    Запускает поток групповой фиксации.
+    """
+    _queue.start()
+
+
+def stop_group_commit():
+    """
+    Останавливает поток групповой фиксации.
+    """
+    _queue.stop()
+
+
+def get_group_commit_stats():
+    """
+    Возвращает метрики очереди групповой фиксации.
+    """
+    return _queue.stats()
+
+
+def run_write(func):
+    """
+    Выполняет func(cursor) в пишущей транзакции и возвращает её результат.
+
+    Если групповая фиксация запущена, запись уходит в очередь и
+    фиксируется вместе с соседними; иначе выполняется сразу.
+    Внутри уже открытой пишущей транзакции запись выполняется в ней же.
+    """
+    if _queue.running and not db_utils.holds_writer():
+        return _queue.submit(func)
+    with db_utils.get_db_cursor() as cursor:
+        return func(cursor)
@@ -0,0 +1,517 @@
+import time
+import logging
+
+# Миграции схемы. Номер версии хранится в PRAGMA user_version.
+# Каждая миграция - (версия, описание, шаги), где шаг - SQL-строка
+# или функция, принимающая курсор. Миграция выполняется в одной
+# транзакции вместе с записью новой версии, поэтому прерванный запуск
+# не оставляет базу в промежуточном состоянии.
+# Новые миграции только добавляются в конец списка.
+
+
+def _add_conversation_column(cursor):
+    # ALTER TABLE ADD COLUMN не поддерживает IF NOT EXISTS
+    cursor.execute('PRAGMA table_info(private_messages)')
+    if 'conversation_id' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(
+            'ALTER TABLE private_messages ADD COLUMN conversation_id INTEGER '
+            'REFERENCES conversations(conversation_id)'
+        )
+
+
+def _add_session_expiry(cursor):
+    cursor.execute('PRAGMA table_info(session)')
+    if 'expires_at' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE session ADD COLUMN expires_at INTEGER')
+    # Сессиям, созданным до появления срока действия, даём неделю
+    cursor.execute(
+        'UPDATE session SET expires_at = ? WHERE expires_at IS NULL',
+        (int(time.time()) + 7 * 24 * 3600,)
+    )
+
+
+def _add_attachment_blob(cursor):
+    cursor.execute('PRAGMA table_info(attachments)')
+    if 'blob_hash' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE attachments ADD COLUMN blob_hash TEXT REFERENCES blobs(hash)')
+
+
+def _create_general_chat(cursor):
+    # Создание общего чата, если он не существует
+    cursor.execute('SELECT group_id FROM groups WHERE name = "Общий чат"')
+    if not cursor.fetchone():
+        cursor.execute('''
+            INSERT INTO groups (group_id, name, creator_id, created_at)
+            VALUES (0, 'Общий чат', 0, ?)
+        ''', (int(time.time()),))
+
+
+MIGRATIONS = [
+    (1, 'Базовая схема', [
+        # Таблица пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            UNIQUE (username)
+        )
+        ''',
+        # Таблица групп
+        '''
+        CREATE TABLE IF NOT EXISTS groups (
+            group_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            creator_id INTEGER,
+            created_at INTEGER,
+            FOREIGN KEY(creator_id) REFERENCES users(user_id)
+        )
+        ''',
+        # Таблица Вложений
+        '''
+        CREATE TABLE IF NOT EXISTS attachments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_type TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            file_path TEXT NOT NULL,
+            mime_type TEXT NOT NULL,
+            filename TEXT NOT NULL
+        )
+        ''',
+        _create_general_chat,
+        # Таблица участников групп
+        '''
+        CREATE TABLE IF NOT EXISTS group_members (
+            group_id INTEGER,
+            user_id INTEGER,
+            role TEXT CHECK(role IN ('owner', 'admin', 'member')),
+            joined_at INTEGER,
+            UNIQUE (group_id, user_id),
+            FOREIGN KEY(group_id) REFERENCES groups(group_id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        ''',
+        # Таблица сообщений групп
+        '''
+        CREATE TABLE IF NOT EXISTS group_messages (
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER,
+            user_id INTEGER,
+            message_text TEXT,
+            timestamp INTEGER
+        )
+        ''',
+        # Таблица личных сообщений
+        '''
+        CREATE TABLE IF NOT EXISTS private_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER NOT NULL,
+            receiver_id INTEGER NOT NULL,
+            message_text TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            FOREIGN KEY(sender_id) REFERENCES users(id),
+            FOREIGN KEY(receiver_id) REFERENCES users(id)
+        )
+        ''',
+        # Таблица сессий
+        '''
+        CREATE TABLE IF NOT EXISTS session (
+            id TEXT PRIMARY KEY,
+            key TEXT NOT NULL)
+        ''',
+    ]),
+    (2, 'Индексы для горячих запросов', [
+        # Индексы NOCASE не используются поиском LIKE '%q%', но замедляют вставку
+        'DROP INDEX IF EXISTS idx_private_messages_text_nocase',
+        'DROP INDEX IF EXISTS idx_group_messages_text_nocase',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_group_messages_group_ts
+        ON group_messages(group_id, timestamp)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_private_messages_pair_ts
+        ON private_messages(sender_id, receiver_id, timestamp)
+        ''',
+        # Для выборок "все чаты пользователя" (sender_id = ? OR receiver_id = ?)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_private_messages_receiver_ts
+        ON private_messages(receiver_id, sender_id, timestamp)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_attachments_message
+        ON attachments(message_type, message_id)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_group_members_user
+        ON group_members(user_id)
+        ''',
+    ]),
+    (3, 'Полнотекстовый поиск FTS5 по сообщениям', [
+        # unicode61 приводит к нижнему регистру и кириллицу,
+        # remove_diacritics 2 дополнительно убирает диакритику (ё -> е)
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS group_messages_fts USING fts5(
+            message_text,
+            content='group_messages',
+            content_rowid='message_id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS group_messages_fts_insert
+        AFTER INSERT ON group_messages BEGIN
+            INSERT INTO group_messages_fts (rowid, message_text)
+            VALUES (new.message_id, new.message_text);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS group_messages_fts_delete
+        AFTER DELETE ON group_messages BEGIN
+            INSERT INTO group_messages_fts (group_messages_fts, rowid, message_text)
+            VALUES ('delete', old.message_id, old.message_text);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS group_messages_fts_update
+        AFTER UPDATE OF message_text ON group_messages BEGIN
+            INSERT INTO group_messages_fts (group_messages_fts, rowid, message_text)
+            VALUES ('delete', old.message_id, old.message_text);
+            INSERT INTO group_messages_fts (rowid, message_text)
+            VALUES (new.message_id, new.message_text);
+        END
+        ''',
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS private_messages_fts USING fts5(
+            message_text,
+            content='private_messages',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS private_messages_fts_insert
+        AFTER INSERT ON private_messages BEGIN
+            INSERT INTO private_messages_fts (rowid, message_text)
+            VALUES (new.id, new.message_text);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS private_messages_fts_delete
+        AFTER DELETE ON private_messages BEGIN
+            INSERT INTO private_messages_fts (private_messages_fts, rowid, message_text)
+            VALUES ('delete', old.id, old.message_text);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS private_messages_fts_update
+        AFTER UPDATE OF message_text ON private_messages BEGIN
+            INSERT INTO private_messages_fts (private_messages_fts, rowid, message_text)
+            VALUES ('delete', old.id, old.message_text);
+            INSERT INTO private_messages_fts (rowid, message_text)
+            VALUES (new.id, new.message_text);
+        END
+        ''',
+        # Индексируем уже существующие сообщения
+        "INSERT INTO group_messages_fts (group_messages_fts) VALUES ('rebuild')",
+        "INSERT INTO private_messages_fts (private_messages_fts) VALUES ('rebuild')",
+    ]),
+    (4, 'Журнал изменений сообщений для инкрементальной синхронизации', [
+        # seq растёт монотонно, поэтому внутри каждого чата он тоже
+        # монотонен и служит курсором синхронизации клиента.
+        # chat: 'g:<group_id>' для общего и групповых чатов,
+        # 'p:<меньший id>:<больший id>' для личной переписки
+        '''
+        CREATE TABLE IF NOT EXISTS message_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            op TEXT NOT NULL CHECK(op IN ('insert', 'edit', 'delete')),
+            created_at INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_message_changes_chat_seq
+        ON message_changes(chat, seq)
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS group_messages_log_insert
+        AFTER INSERT ON group_messages BEGIN
+            INSERT INTO message_changes (chat, message_id, op, created_at)
+            VALUES ('g:' || new.group_id, new.message_id, 'insert', CAST(strftime('%s', 'now') AS INTEGER));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS group_messages_log_edit
+        AFTER UPDATE OF message_text ON group_messages BEGIN
+            INSERT INTO message_changes (chat, message_id, op, created_at)
+            VALUES ('g:' || new.group_id, new.message_id, 'edit', CAST(strftime('%s', 'now') AS INTEGER));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS group_messages_log_delete
+        AFTER DELETE ON group_messages BEGIN
+            INSERT INTO message_changes (chat, message_id, op, created_at)
+            VALUES ('g:' || old.group_id, old.message_id, 'delete', CAST(strftime('%s', 'now') AS INTEGER));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS private_messages_log_insert
+        AFTER INSERT ON private_messages BEGIN
+            INSERT INTO message_changes (chat, message_id, op, created_at)
+            VALUES (
+                'p:' || min(new.sender_id, new.receiver_id) || ':' || max(new.sender_id, new.receiver_id),
+                new.id, 'insert', CAST(strftime('%s', 'now') AS INTEGER)
+            );
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS private_messages_log_edit
+        AFTER UPDATE OF message_text ON private_messages BEGIN
+            INSERT INTO message_changes (chat, message_id, op, created_at)
+            VALUES (
+                'p:' || min(new.sender_id, new.receiver_id) || ':' || max(new.sender_id, new.receiver_id),
+                new.id, 'edit', CAST(strftime('%s', 'now') AS INTEGER)
+            );
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS private_messages_log_delete
+        AFTER DELETE ON private_messages BEGIN
+            INSERT INTO message_changes (chat, message_id, op, created_at)
+            VALUES (
+                'p:' || min(old.sender_id, old.receiver_id) || ':' || max(old.sender_id, old.receiver_id),
+                old.id, 'delete', CAST(strftime('%s', 'now') AS INTEGER)
+            );
+        END
+        ''',
+    ]),
+    (5, 'Таблица личных бесед', [
+        # Беседа двух пользователей с упорядоченной парой (low_id <= high_id).
+        # Список чатов пользователя читается по индексам low/high,
+        # история беседы - по индексу (conversation_id, timestamp)
+        '''
+        CREATE TABLE IF NOT EXISTS conversations (
+            conversation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            low_id INTEGER NOT NULL,
+            high_id INTEGER NOT NULL,
+            last_activity INTEGER NOT NULL DEFAULT 0,
+            last_message_id INTEGER,
+            last_sender_id INTEGER,
+            last_message_preview TEXT,
+            UNIQUE (low_id, high_id),
+            CHECK (low_id <= high_id)
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_conversations_low_activity
+        ON conversations(low_id, last_activity)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_conversations_high_activity
+        ON conversations(high_id, last_activity)
+        ''',
+        _add_conversation_column,
+        '''
+        CREATE INDEX IF NOT EXISTS idx_private_messages_conversation_ts
+        ON private_messages(conversation_id, timestamp)
+        ''',
+        # Беседа создаётся или обновляется при каждой вставке сообщения,
+        # в том числе записанного в обход MessageModel
+        '''
+        CREATE TRIGGER IF NOT EXISTS private_messages_conversation_insert
+        AFTER INSERT ON private_messages BEGIN
+            INSERT INTO conversations (
+                low_id, high_id, last_activity, last_message_id, last_sender_id, last_message_preview
+            )
+            VALUES (
+                min(new.sender_id, new.receiver_id), max(new.sender_id, new.receiver_id),
+                new.timestamp, new.id, new.sender_id, substr(new.message_text, 1, 100)
+            )
+            ON CONFLICT (low_id, high_id) DO UPDATE SET
+                last_activity = excluded.last_activity,
+                last_message_id = excluded.last_message_id,
+                last_sender_id = excluded.last_sender_id,
+                last_message_preview = excluded.last_message_preview
+            WHERE excluded.last_activity >= conversations.last_activity;
+            UPDATE private_messages
+            SET conversation_id = (
+                SELECT conversation_id FROM conversations
+                WHERE low_id = min(new.sender_id, new.receiver_id)
+                AND high_id = max(new.sender_id, new.receiver_id)
+            )
+            WHERE id = new.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS private_messages_conversation_edit
+        AFTER UPDATE OF message_text ON private_messages BEGIN
+            UPDATE conversations
+            SET last_message_preview = substr(new.message_text, 1, 100)
+            WHERE conversation_id = new.conversation_id AND last_message_id = new.id;
+        END
+        ''',
+        # После удаления последнего сообщения превью берётся из предыдущего;
+        # беседа без сообщений исчезает из списка чатов
+        '''
+        CREATE TRIGGER IF NOT EXISTS private_messages_conversation_delete
+        AFTER DELETE ON private_messages BEGIN
+            UPDATE conversations
+            SET (last_activity, last_message_id, last_sender_id, last_message_preview) = (
+                SELECT timestamp, id, sender_id, substr(message_text, 1, 100)
+                FROM private_messages
+                WHERE conversation_id = old.conversation_id
+                ORDER BY timestamp DESC, id DESC
+                LIMIT 1
+            )
+            WHERE conversation_id = old.conversation_id AND last_message_id = old.id
+            AND EXISTS (SELECT 1 FROM private_messages WHERE conversation_id = old.conversation_id);
+            DELETE FROM conversations
+            WHERE conversation_id = old.conversation_id
+            AND NOT EXISTS (SELECT 1 FROM private_messages WHERE conversation_id = old.conversation_id);
+        END
+        ''',
+        # Заполняем беседы по уже существующим сообщениям
+        '''
+        INSERT OR IGNORE INTO conversations (low_id, high_id)
+        SELECT DISTINCT min(sender_id, receiver_id), max(sender_id, receiver_id)
+        FROM private_messages
+        ''',
+        '''
+        UPDATE private_messages
+        SET conversation_id = (
+            SELECT conversation_id FROM conversations
+            WHERE low_id = min(private_messages.sender_id, private_messages.receiver_id)
+            AND high_id = max(private_messages.sender_id, private_messages.receiver_id)
+        )
+        WHERE conversation_id IS NULL
+        ''',
+        '''
+        UPDATE conversations
+        SET (last_activity, last_message_id, last_sender_id, last_message_preview) = (
+            SELECT timestamp, id, sender_id, substr(message_text, 1, 100)
+            FROM private_messages
+            WHERE conversation_id = conversations.conversation_id
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+        )
+        WHERE last_message_id IS NULL
+        ''',
+    ]),
+    (6, 'Срок действия сессий', [
+        _add_session_expiry,
+        '''
+        CREATE INDEX IF NOT EXISTS idx_session_expires
+        ON session(expires_at)
+        ''',
+    ]),
+    (7, 'Поиск вложений по пути файла', [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_attachments_file_path
+        ON attachments(file_path)
+        ''',
+    ]),
+    (8, 'Хранилище файлов по содержимому', [
+        # Файл хранится один раз на хеш SHA-256; refcount - число вложений
+        # с этим файлом, released_at - когда оно стало нулём
+        '''
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            released_at INTEGER
+        )
+        ''',
+        _add_attachment_blob,
+        '''
+        CREATE INDEX IF NOT EXISTS idx_blobs_released
+        ON blobs(released_at) WHERE refcount = 0
+        ''',
+        # Счётчики ссылок ведут триггеры: вложения добавляются и удаляются
+        # в той же транзакции, что и сообщения, из разных мест кода
+        '''
+        CREATE TRIGGER IF NOT EXISTS attachments_blob_insert
+        AFTER INSERT ON attachments WHEN new.blob_hash IS NOT NULL BEGIN
+            UPDATE blobs SET refcount = refcount + 1, released_at = NULL
+            WHERE hash = new.blob_hash;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS attachments_blob_delete
+        AFTER DELETE ON attachments WHEN old.blob_hash IS NOT NULL BEGIN
+            UPDATE blobs SET
+                refcount = refcount - 1,
+                released_at = CASE WHEN refcount = 1 THEN CAST(strftime('%s', 'now') AS INTEGER)
+                              ELSE released_at END
+            WHERE hash = old.blob_hash;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS attachments_blob_update
+        AFTER UPDATE OF blob_hash ON attachments
+        WHEN old.blob_hash IS NOT new.blob_hash BEGIN
+            UPDATE blobs SET
+                refcount = refcount - 1,
+                released_at = CASE WHEN refcount = 1 THEN CAST(strftime('%s', 'now') AS INTEGER)
+                              ELSE released_at END
+            WHERE hash = old.blob_hash;
+            UPDATE blobs SET refcount = refcount + 1, released_at = NULL
+            WHERE hash = new.blob_hash;
+        END
+        ''',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """
+    Возвращает текущую версию схемы базы данных.
+    """
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """
+    Применяет к базе все миграции новее текущей версии схемы.
+
+    Каждая миграция выполняется в отдельной транзакции; при ошибке
+    транзакция откатывается и версия схемы не меняется.
+    Возвращает список применённых версий.
+    """
+    if target is None:
+        target = SCHEMA_VERSION
+    current = get_schema_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {current} is newer than supported {SCHEMA_VERSION}"
+        )
+
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+
+        cursor = conn.cursor()
+        try:
+            if conn.in_transaction:
+                conn.commit()
+            cursor.execute('BEGIN IMMEDIATE')
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logging.error(f"Migration {version} ({description}) failed", exc_info=True)
+            raise
+        finally:
+            cursor.close()
+
+        logging.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+
+    return applied
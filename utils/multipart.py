@@ -0,0 +1,218 @@
+import os
+import hashlib
+import tempfile
+from email.parser import HeaderParser
+
+# Наибольший размер тела multipart-запроса в байтах
+MAX_UPLOAD_SIZE = int(os.environ.get('MESSENGER_MAX_UPLOAD_SIZE', 50 * 1024 * 1024))
+# Наибольший размер текстового поля и заголовков одной части
+MAX_FIELD_SIZE = 1024 * 1024
+MAX_PART_HEADERS = 16 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """
+    Тело запроса больше MAX_UPLOAD_SIZE.
+    """
+
+
+class MultipartError(ValueError):
+    """
+    Тело запроса не является корректным multipart/form-data.
+    """
+
+
+class UploadedFile:
+    """
+    Загруженный файл во временном файле рядом с местом назначения.
+
+    Содержимое записывается частями, SHA-256 считается по ходу записи,
+    поэтому файл не держится в памяти целиком. move_to атомарно
+    переименовывает временный файл; незабранный файл удаляет discard.
+    """
+
+    def __init__(self, name, filename, content_type, folder):
+        self.name = name
+        self.filename = filename
+        self.type = content_type
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self.temp_path = tempfile.mkstemp(prefix='.upload-', dir=folder)
+        self._file = os.fdopen(fd, 'wb')
+
+    @classmethod
+    def from_stream(cls, stream, filename, content_type, folder):
+        """
+        Копирует файловый объект во временный файл частями.
+        """
+        upload = cls(None, filename, content_type, folder)
+        try:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                upload.write(chunk)
+            upload.close()
+        except BaseException:
+            upload.discard()
+            raise
+        return upload
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self._hash.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        self._file.close()
+
+    def move_to(self, file_path):
+        """
+        Переносит файл на место file_path. Если такой файл уже есть (путь
+        задаётся хешем содержимого), временная копия просто удаляется.
+        """
+        self.close()
+        if os.path.exists(file_path):
+            self.discard()
+        else:
+            os.replace(self.temp_path, file_path)
+        self.temp_path = None
+
+    def discard(self):
+        self.close()
+        if self.temp_path is not None:
+            try:
+                os.remove(self.temp_path)
+            except FileNotFoundError:
+                pass
+            self.temp_path = None
+
+
+class _BodyReader:
+    """
+    Читает тело запроса частями, не больше Content-Length байт.
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self):
+        if self.remaining <= 0:
+            return b''
+        chunk = self.stream.read(min(UPLOAD_CHUNK_SIZE, self.remaining))
+        self.remaining -= len(chunk)
+        return chunk
+
+
+def _boundary(content_type):
+    header = HeaderParser().parsestr(f'Content-Type: {content_type}\r\n\r\n')
+    boundary = header.get_param('boundary')
+    if not boundary or len(boundary) > 200:
+        raise MultipartError('Missing multipart boundary')
+    return boundary.encode('latin-1')
+
+
+def parse_multipart(environ, folder, max_size=None):
+    """
+    Разбирает тело multipart/form-data по мере чтения из wsgi.input.
+
+    Файловые части записываются частями во временные файлы в folder
+    (тот же каталог, куда файлы потом переименовываются), текстовые поля
+    собираются в словарь. В памяти одновременно находится не больше
+    одного блока UPLOAD_CHUNK_SIZE тела.
+
+    :return: Пара (поля {имя: строка}, список UploadedFile).
+    :raises UploadTooLarge: Content-Length больше max_size (проверяется
+        до чтения тела).
+    :raises MultipartError: Тело повреждено или обрывается.
+    """
+    if max_size is None:
+        max_size = MAX_UPLOAD_SIZE
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        raise MultipartError('Invalid Content-Length')
+    if length > max_size:
+        raise UploadTooLarge()
+
+    delimiter = b'\r\n--' + _boundary(environ.get('CONTENT_TYPE', ''))
+    reader = _BodyReader(environ['wsgi.input'], length)
+    fields, files = {}, []
+    # Перевод строки перед первым разделителем упрощает поиск: все
+    # разделители, включая первый, имеют вид \r\n--boundary
+    buf = b'\r\n'
+
+    def fill(buf):
+        chunk = reader.read()
+        if not chunk:
+            raise MultipartError('Unexpected end of multipart body')
+        return buf + chunk
+
+    try:
+        # Пропускаем преамбулу до первого разделителя
+        while True:
+            pos = buf.find(delimiter)
+            if pos >= 0:
+                buf = buf[pos + len(delimiter):]
+                break
+            buf = fill(buf[-len(delimiter):])
+
+        while True:
+            while len(buf) < 2:
+                buf = fill(buf)
+            if buf.startswith(b'--'):
+                return fields, files
+            if not buf.startswith(b'\r\n'):
+                raise MultipartError('Malformed multipart delimiter')
+
+            while True:
+                end = buf.find(b'\r\n\r\n')
+                if end >= 0:
+                    break
+                if len(buf) > MAX_PART_HEADERS:
+                    raise MultipartError('Part headers too large')
+                buf = fill(buf)
+            headers = HeaderParser().parsestr(buf[2:end].decode('utf-8', 'replace'))
+            buf = buf[end + 4:]
+
+            name = headers.get_param('name', header='content-disposition')
+            filename = headers.get_filename()
+            if filename is not None:
+                sink = UploadedFile(name, filename, headers.get_content_type(), folder)
+                files.append(sink)
+            else:
+                sink = bytearray()
+
+            while True:
+                pos = buf.find(delimiter)
+                # Хвост буфера может оказаться началом разделителя
+                keep = len(buf) - len(delimiter) + 1 if pos < 0 else pos
+                if keep > 0:
+                    if isinstance(sink, bytearray):
+                        if len(sink) + keep > MAX_FIELD_SIZE:
+                            raise MultipartError('Form field too large')
+                        sink += buf[:keep]
+                    else:
+                        sink.write(buf[:keep])
+                    buf = buf[keep:]
+                if pos >= 0:
+                    buf = buf[len(delimiter):]
+                    break
+                buf = fill(buf)
+
+            if isinstance(sink, bytearray):
+                if name is not None:
+                    fields[name] = sink.decode('utf-8', 'replace')
+            else:
+                sink.close()
+                if not filename:
+                    # Поле файла без выбранного файла
+                    files.remove(sink)
+                    sink.discard()
+    except BaseException:
+        for upload in files:
+            upload.discard()
+        raise
@@ -0,0 +1,210 @@
+import os
+import asyncio
+import threading
+from collections import OrderedDict
+
+# Долгий опрос держит поток Waitress, поэтому число ждущих запросов
+# ограничено: остальные сразу получают обычный ответ
+LONGPOLL_MAX_WAITERS = int(os.environ.get('MESSENGER_LONGPOLL_MAX_WAITERS', 4))
+LONGPOLL_MAX_WAIT = int(os.environ.get('MESSENGER_LONGPOLL_MAX_WAIT', 25))
+# Ожидание в режиме ASGI - корутина без потока, поэтому предел намного выше
+LONGPOLL_MAX_ASYNC_WAITERS = int(os.environ.get('MESSENGER_LONGPOLL_MAX_ASYNC_WAITERS', 10000))
+# Сколько последних изменённых или опрошенных чатов хранят счётчик
+LONGPOLL_MAX_CHATS = int(os.environ.get('MESSENGER_LONGPOLL_MAX_CHATS', 10000))
+
+
+class ChatNotifier:
+    """
+    Пробуждение долгих опросов внутри процесса.
+
+    Для каждого чата хранится счётчик изменений. Запрос запоминает
+    счётчик до чтения из базы и ждёт, пока он не изменится, поэтому
+    изменение между чтением и ожиданием не теряется.
+    Ключи чатов - те же, что в журнале message_changes ('g:0', 'p:1:2'),
+    плюс 'u:<user_id>' для всех личных сообщений пользователя.
+
+    Счётчики хранятся для max_chats последних чатов (LRU). Изменение
+    записывает в счётчик номер из общей возрастающей последовательности,
+    поэтому чат, вытесненный и изменённый снова, не может вернуться к
+    запомненному запросом значению: вытеснение даёт в худшем случае
+    лишнее пробуждение, но не потерянное.
+    """
+
+    def __init__(self, max_waiters=LONGPOLL_MAX_WAITERS, max_async_waiters=LONGPOLL_MAX_ASYNC_WAITERS,
+                 max_chats=LONGPOLL_MAX_CHATS):
+        self.max_waiters = max_waiters
+        self.max_async_waiters = max_async_waiters
+        self.max_chats = max_chats
+        self._lock = threading.Lock()
+        self._versions = OrderedDict()
+        self._sequence = 0
+        # Ключ чата -> функции пробуждения ждущих его запросов;
+        # вызываются под общим замком
+        self._waiting = {}
+        self._waiters = 0
+        self._async_waiters = 0
+        self._stats = {
+            'notifications': 0,
+            'waits': 0,
+            'wakeups': 0,
+            'timeouts': 0,
+            'rejected': 0,
+            'evicted': 0,
+        }
+
+    def version(self, *chats):
+        """
+        Возвращает текущие счётчики изменений чатов.
+        """
+        with self._lock:
+            for chat in chats:
+                if chat in self._versions:
+                    self._versions.move_to_end(chat)
+            return tuple(self._versions.get(chat, 0) for chat in chats)
+
+    def notify(self, *chats):
+        """
+        Отмечает изменение чатов и будит ждущие их запросы.
+        """
+        with self._lock:
+            self._sequence += 1
+            for chat in chats:
+                self._versions[chat] = self._sequence
+                self._versions.move_to_end(chat)
+                for wake in self._waiting.get(chat, ()):
+                    wake()
+            while len(self._versions) > self.max_chats:
+                self._versions.popitem(last=False)
+                self._stats['evicted'] += 1
+            self._stats['notifications'] += 1
+
+    def wait(self, chats, versions, timeout):
+        """
+        Ждёт изменения любого из чатов после versions не дольше timeout секунд.
+
+        Возвращает True, если изменение произошло, и False по таймауту
+        или если достигнут предел ждущих запросов.
+        """
+        with self._lock:
+            if self._changed(chats, versions):
+                return True
+            if self._waiters >= self.max_waiters:
+                self._stats['rejected'] += 1
+                return False
+
+            cond = threading.Condition(self._lock)
+            wake = cond.notify
+            self._register(chats, wake)
+            self._waiters += 1
+            self._stats['waits'] += 1
+            try:
+                changed = cond.wait_for(lambda: self._changed(chats, versions), timeout)
+            finally:
+                self._waiters -= 1
+                self._unregister(chats, wake)
+
+            self._stats['wakeups' if changed else 'timeouts'] += 1
+            return changed
+
+    async def wait_async(self, chats, versions, timeout):
+        """
+        То же, что wait, но без блокировки потока: для режима ASGI.
+        """
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(woken.set)
+            except RuntimeError:
+                # Цикл событий уже закрыт
+                pass
+
+        with self._lock:
+            if self._changed(chats, versions):
+                return True
+            if self._async_waiters >= self.max_async_waiters:
+                self._stats['rejected'] += 1
+                return False
+            self._register(chats, wake)
+            self._async_waiters += 1
+            self._stats['waits'] += 1
+
+        try:
+            await asyncio.wait_for(woken.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._async_waiters -= 1
+                self._unregister(chats, wake)
+                changed = self._changed(chats, versions)
+                self._stats['wakeups' if changed else 'timeouts'] += 1
+        return changed
+
+    def _register(self, chats, wake):
+        for chat in chats:
+            self._waiting.setdefault(chat, set()).add(wake)
+
+    def _unregister(self, chats, wake):
+        for chat in chats:
+            wakes = self._waiting[chat]
+            wakes.discard(wake)
+            if not wakes:
+                del self._waiting[chat]
+
+    def _changed(self, chats, versions):
+        return any(
+            self._versions.get(chat, 0) != version
+            for chat, version in zip(chats, versions)
+        )
+
+    def stats(self):
+        """
+        Метрики долгого опроса: ожидания, пробуждения, отказы по пределу.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['waiting'] = self._waiters
+            stats['max_waiters'] = self.max_waiters
+            stats['async_waiting'] = self._async_waiters
+            stats['chats'] = len(self._versions)
+        return stats
+
+
+_notifier = ChatNotifier()
+
+
+def chat_version(*chats):
+    """
+    Возвращает счётчики изменений чатов для последующего wait_for_chats.
+    """
+    return _notifier.version(*chats)
+
+
+def notify_chats(*chats):
+    """
+    Будит долгие опросы, ждущие указанные чаты.
+    """
+    _notifier.notify(*chats)
+
+
+def wait_for_chats(chats, versions, timeout):
+    """
+    Ждёт изменения любого из чатов; timeout ограничен LONGPOLL_MAX_WAIT.
+    """
+    return _notifier.wait(chats, versions, min(timeout, LONGPOLL_MAX_WAIT))
+
+
+async def wait_for_chats_async(chats, versions, timeout):
+    """
+    Асинхронный вариант wait_for_chats для режима ASGI.
+    """
+    return await _notifier.wait_async(chats, versions, min(timeout, LONGPOLL_MAX_WAIT))
+
+
+def get_notifier_stats():
+    """
+    Возвращает метрики долгого опроса.
+    """
+    return _notifier.stats()
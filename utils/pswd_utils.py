@@ -1,14 +1,214 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
 import bcrypt
 from contextlib import contextmanager
 
+# Процессы для bcrypt; 0 - хешировать в вызывающем потоке
+HASH_WORKERS = int(os.environ.get('MESSENGER_HASH_WORKERS', min(2, os.cpu_count() or 1)))
+# Сколько операций может ждать своей очереди на один процесс
+HASH_QUEUE_FACTOR = 4
+# Сколько секунд запрос ждёт места в очереди и результата
+HASH_TIMEOUT = float(os.environ.get('MESSENGER_HASH_TIMEOUT', 10))
+
+# Ограничение неудачных входов: не больше N неудач за окно в секундах
+LOGIN_WINDOW = int(os.environ.get('MESSENGER_LOGIN_WINDOW', 300))
+LOGIN_MAX_FAILURES_PER_USER = int(os.environ.get('MESSENGER_LOGIN_MAX_FAILURES_PER_USER', 5))
+LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get('MESSENGER_LOGIN_MAX_FAILURES_PER_IP', 20))
+# Сколько имён и адресов помнит ограничитель
+LOGIN_THROTTLE_SIZE = 10000
+
+
+class PasswordHashingBusy(Exception):
+    """
+    Очередь хеширования переполнена или результат не получен за HASH_TIMEOUT.
+    """
+
+
+class HashingPool:
+    """
+    Ограниченный пул процессов для bcrypt.
+
+    bcrypt намеренно медленный; в отдельных процессах хеширование
+    идёт параллельно на нескольких ядрах и не отнимает время у потоков,
+    обслуживающих опросы чатов. Одновременно выполняются и ждут не больше
+    workers * queue_factor операций; остальные ждут места до timeout и
+    получают PasswordHashingBusy.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, timeout=HASH_TIMEOUT, queue_factor=HASH_QUEUE_FACTOR):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(workers, 1) * queue_factor)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = {'calls': 0, 'rejected': 0, 'timeouts': 0, 'inline': 0}
+
+    def start(self):
+        """
+        Запускает процессы заранее, пока в приложении мало потоков.
+        """
+        if self.workers <= 0:
+            return
+        with self._lock:
+            if self._executor is not None:
+                return
+            # fork не импортирует заново главный модуль (run.py поднял бы
+            # в каждом процессе всё приложение)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+        self._executor.submit(bcrypt.gensalt).result()
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, func, *args):
+        """
+        Выполняет func(*args) в процессе пула и ждёт результата.
+        """
+        if self.workers <= 0:
+            with self._lock:
+                self._stats['inline'] += 1
+            return func(*args)
+        deadline = time.monotonic() + self.timeout
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise PasswordHashingBusy()
+        try:
+            if self._executor is None:
+                self.start()
+            with self._lock:
+                self._stats['calls'] += 1
+            future = self._executor.submit(func, *args)
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._slots.release()
+            # Пул недоступен (процесс упал или остановлен): не теряем вход
+            logging.error(f"Hashing pool error: {str(e)}")
+            self.stop()
+            with self._lock:
+                self._stats['inline'] += 1
+            return func(*args)
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeout:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PasswordHashingBusy()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        return stats
+
+
+_hashing_pool = HashingPool()
+
+
 def hash_password(password):
     """
     Хеширует пароль с использованием bcrypt.
     """
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    return _hashing_pool.run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt())
 
 def check_password(hashed_password, user_password):
     """
     Проверяет, соответствует ли пароль хешу.
     """
-    return bcrypt.checkpw(user_password.encode('utf-8'), hashed_password)
\ No newline at end of file
+    return _hashing_pool.run(bcrypt.checkpw, user_password.encode('utf-8'), hashed_password)
+
+
+def start_hashing_pool():
+    _hashing_pool.start()
+
+
+def stop_hashing_pool():
+    _hashing_pool.stop()
+
+
+def get_hashing_stats():
+    """
+    Возвращает метрики пула хеширования паролей.
+    """
+    return _hashing_pool.stats()
+
+
+class LoginThrottle:
+    """
+    Счётчики неудачных входов по имени пользователя и по IP.
+
+    Пока ключ исчерпал лимит неудач в текущем окне, попытки входа
+    отклоняются до проверки пароля, поэтому подбор пароля не тратит
+    процессорное время на bcrypt. Успешный вход сбрасывает счётчик имени.
+    """
+
+    def __init__(self, window=LOGIN_WINDOW, max_per_user=LOGIN_MAX_FAILURES_PER_USER,
+                 max_per_ip=LOGIN_MAX_FAILURES_PER_IP, size=LOGIN_THROTTLE_SIZE):
+        self.window = window
+        self.limits = {'user': max_per_user, 'ip': max_per_ip}
+        self.size = size
+        self._lock = threading.Lock()
+        # (вид, значение) -> [начало окна, число неудач]
+        self._failures = OrderedDict()
+        self._stats = {'blocked': 0, 'failures': 0}
+
+    def _keys(self, username, ip):
+        keys = [('user', username.lower())]
+        if ip:
+            keys.append(('ip', ip))
+        return keys
+
+    def retry_after(self, username, ip=None, now=None):
+        """
+        Через сколько секунд можно повторить вход; 0 - можно сейчас.
+        """
+        now = time.time() if now is None else now
+        wait = 0
+        with self._lock:
+            for key in self._keys(username, ip):
+                entry = self._failures.get(key)
+                if entry is None or now - entry[0] >= self.window:
+                    continue
+                if entry[1] >= self.limits[key[0]]:
+                    wait = max(wait, int(entry[0] + self.window - now) + 1)
+            if wait:
+                self._stats['blocked'] += 1
+        return wait
+
+    def failure(self, username, ip=None, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._stats['failures'] += 1
+            for key in self._keys(username, ip):
+                entry = self._failures.get(key)
+                if entry is None or now - entry[0] >= self.window:
+                    entry = self._failures[key] = [now, 0]
+                entry[1] += 1
+                self._failures.move_to_end(key)
+            while len(self._failures) > self.size:
+                self._failures.popitem(last=False)
+
+    def success(self, username):
+        with self._lock:
+            self._failures.pop(('user', username.lower()), None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['tracked'] = len(self._failures)
+        return stats
+
+
+login_throttle = LoginThrottle()
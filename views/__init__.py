@@ -11,6 +11,9 @@ from .message import *
 from .users import *
 from .p_chat import *
 from .search import *
+from .batch import *
+from .events import *
+from .attachments import *
 
 __all__ = [
     'View', 'IndexView', 'TemplateView', 'RegisterView', 'LoginView',
@@ -19,6 +22,6 @@ __all__ = [
     'RemoveFromGroupView', 'GetMessageView', 'SendMessageView',
     'DeleteMessageView', 'EditMessageView', 'GetGroupMessagesView',
     'SendPrivateMessageView', 'GetPrivateMessagesView', 'CheckPrivateChatsUpdatesView', 'CheckMessagesView',
-    'CheckEditedMessagesView', 'SearchMessagesView', 'SearchUsersView',
+    'CheckEditedMessagesView', 'SyncMessagesView', 'BatchView', 'EventsView', 'AttachmentView', 'SearchMessagesView', 'SearchUsersView',
     'GetUserIdView', 'GetPrivateChatsView', 'LogoutView', 'DeleteSessionView'
 ]
\ No newline at end of file
@@ -0,0 +1,59 @@
+import logging
+from urllib.parse import quote
+
+from webob import Request
+from mimes import get_mime
+from models.MessageModel import *
+from models.blob_store import blob_store
+from .base import View, json_response
+from .static_cache import serve_file
+
+
+class AttachmentView(View):
+    """
+    Выдача загруженных файлов (/static/uploads/...).
+
+    Файл отдаётся только пользователю, который видит сообщение с этим
+    вложением. Вложения не попадают в кеш статики: файл читается с диска
+    частями или передаётся серверу через wsgi.file_wrapper (sendfile),
+    поддерживаются Range-запросы для перемотки аудио и видео.
+    """
+    methods = ('GET',)
+
+    def response(self, environ, start_response):
+        try:
+            user_id = Request(environ).cookies.get('user_id')
+            if not user_id:
+                return json_response(
+                    {'error': 'Not authorized'},
+                    start_response,
+                    '401 Unauthorized'
+                )
+
+            file_path = self.url.lstrip('/')
+            attachment = None
+            if '..' not in file_path.split('/'):
+                attachment = MessageModel.get_attachment(self.url, user_id)
+            if attachment is None:
+                # Чужое вложение неотличимо от несуществующего
+                start_response('404 Not Found', [('Content-Type', 'text/plain')])
+                return [b'File not found']
+
+            if attachment['blob_hash']:
+                file_path = blob_store.path(attachment['blob_hash'])
+            disposition = f"inline; filename*=UTF-8''{quote(attachment['filename'])}"
+            return serve_file(
+                environ, start_response, file_path,
+                cached=False,
+                # Тип по расширению исходного имени: у файла в хранилище его нет
+                mime=get_mime(attachment['filename']),
+                cache_control='private, no-cache',
+                extra_headers=[
+                    ('Content-Disposition', disposition),
+                    ('X-Content-Type-Options', 'nosniff'),
+                ]
+            )
+        except Exception as e:
+            logging.error(f"Error serving attachment {self.url}: {str(e)}")
+            start_response('500 Internal Server Error', [('Content-Type', 'text/plain')])
+            return [b'Internal Server Error']
@@ -10,8 +10,21 @@ from utils import *
 from .base import json_response, TemplateView, View
 
 
+def busy_response(start_response):
+    # Очередь хеширования паролей переполнена
+    return json_response(
+        {'error': 'Сервер перегружен, повторите попытку позже'},
+        start_response,
+        '503 Service Unavailable',
+        [('Retry-After', '1')]
+    )
+
+
 class RegisterView(TemplateView):
+    methods = ('GET', 'POST')
     template = 'templates/register.html'
+    # Хеширование пароля bcrypt: в режиме ASGI выполняется в отдельном пуле
+    cpu_bound = True
 
     def response(self, environ, start_response):
         request = Request(environ)
@@ -20,7 +33,10 @@ class RegisterView(TemplateView):
             username = post_data.get('username', '').strip()
             password = post_data.get('password', '')
 
-            success, error = UserModel.create_user(username, password)
+            try:
+                success, error = UserModel.create_user(username, password)
+            except PasswordHashingBusy:
+                return busy_response(start_response)
             
             if success:
                 return json_response(
@@ -38,7 +54,9 @@ class RegisterView(TemplateView):
 
 
 class LoginView(TemplateView):
+    methods = ('GET', 'POST')
     template = 'templates/login.html'
+    cpu_bound = True
 
     def response(self, environ, start_response):
         if environ['REQUEST_METHOD'] == 'POST':
@@ -47,8 +65,23 @@ class LoginView(TemplateView):
             username = post_data.get('username', [''])[0].strip()
             password = post_data.get('password', [''])[0]
 
-            user_id, error = UserModel.authenticate(username, password)
+            ip = environ.get('REMOTE_ADDR')
+            # Подбор пароля отклоняется до проверки bcrypt
+            retry_after = login_throttle.retry_after(username, ip)
+            if retry_after:
+                return json_response(
+                    {'error': 'Слишком много неудачных попыток входа, попробуйте позже'},
+                    start_response,
+                    '429 Too Many Requests',
+                    [('Retry-After', str(retry_after))]
+                )
+
+            try:
+                user_id, error = UserModel.authenticate(username, password)
+            except PasswordHashingBusy:
+                return busy_response(start_response)
             if user_id:
+                login_throttle.success(username)
                 
                 (session_id, key) = create_session()
                 headers = [
@@ -66,6 +99,7 @@ class LoginView(TemplateView):
                 start_response('200 OK', headers)
                 return [data.encode('utf-8')]
             else:
+                login_throttle.failure(username, ip)
                 return json_response(
                     {'error': error},
                     start_response,
@@ -74,6 +108,8 @@ class LoginView(TemplateView):
         return super().response(environ, start_response)
     
 class LogoutView(View):
+    methods = ('GET', 'POST')
+
     def response(self, environ, start_response):
         request = Request(environ)
         session_id = request.cookies.get('session_id')
@@ -94,6 +130,8 @@ class LogoutView(View):
         return []
     
 class DeleteSessionView(View):
+    methods = ('POST', 'DELETE')
+
     def response(self, environ, start_response):
         session_id = environ['url_params'][0]
         if delete_session(session_id):
@@ -3,7 +3,8 @@ import os
 import logging
 import json
 
-from mimes import get_mime
+from .static_cache import serve_file
+from .template_cache import serve_template
 from webob import Request
 
 from utils import *
@@ -17,12 +18,13 @@ logging.basicConfig(
 
 Response = namedtuple("Response", "status headers data")
 
-def json_response(data, start_response, status='200 OK'):
+def json_response(data, start_response, status='200 OK', extra_headers=()):
     headers = [
         ('Content-Type', 'application/json'),
         ('Access-Control-Allow-Origin', 'http://localhost:8000'),
         ('Access-Control-Allow-Credentials', 'true')
     ]
+    headers.extend(extra_headers)
     start_response(status, headers)
     return [json.dumps(data).encode('utf-8')]
 
@@ -32,37 +34,23 @@ def forbidden_response(start_response):
 
 class View:
     path = ''
+    # Допустимые HTTP-методы (HEAD разрешён вместе с GET); None - любые.
+    # Проверяются маршрутизатором. Статика, шаблоны и страницы ошибок
+    # только читаются
+    methods = ('GET',)
 
     def __init__(self, url) -> None:
         self.url = url
 
     def response(self, environ, start_response):
-        file_path = self.path + self.url
-        file_path = file_path.lstrip('/')
-        
-        if not os.path.exists(file_path):
+        file_path = (self.path + self.url).lstrip('/')
+        # Запрос вида /static/../app.py не выходит за каталог маршрута
+        if '..' in file_path.split('/'):
             start_response('404 Not Found', [('Content-Type', 'text/plain')])
             return [b'File not found']
         
         try:
-            mime_type = get_mime(file_path)
-            
-            if mime_type.startswith('text/') or mime_type in ['application/javascript', 'application/json']:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = f.read()
-                start_response('200 OK', [('Content-Type', mime_type)])
-                return [data.encode('utf-8')]
-            else:
-                with open(file_path, 'rb') as f:
-                    data = f.read()
-                start_response('200 OK', [('Content-Type', mime_type)])
-                return [data]
-                
-        except UnicodeDecodeError:
-            with open(file_path, 'rb') as f:
-                data = f.read()
-            start_response('200 OK', [('Content-Type', mime_type)])
-            return [data]
+            return serve_file(environ, start_response, file_path)
         except Exception as e:
             logging.error(f"Error serving file {file_path}: {str(e)}")
             start_response('500 Internal Server Error', [('Content-Type', 'text/plain')])
@@ -77,19 +65,7 @@ class TemplateView(View):
 
     def response(self, environ, start_response):
         file_name = self.path + self.url
-        headers = [('Content-type', get_mime(file_name))]
-        try:
-            data = self.read_file(file_name[1:])
-            status = '200 OK'
-        except FileNotFoundError:
-            data = ''
-            status = '404 Not found'
-        start_response(status, headers)
-        return [data.encode('utf-8')]
+        return serve_template(environ, start_response, file_name[1:])
 
-    def read_file(self, file_name):
-        with open(file_name, 'r', encoding='utf-8') as file:
-            return file.read()
-        
 class IndexView(TemplateView):
     template = 'templates/index.html'
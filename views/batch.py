@@ -0,0 +1,146 @@
+import io
+import json
+import logging
+from urllib.parse import urlsplit
+
+from webob import Request
+from utils import *
+from .base import View, json_response
+
+# Не больше стольких подзапросов в одном пакете
+BATCH_MAX_REQUESTS = 20
+BATCH_METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+
+
+class BatchView(View):
+    """
+    Выполняет несколько запросов к API за один HTTP-запрос.
+
+    Тело запроса: {"requests": [{"id": ..., "method": "GET",
+    "path": "/get_messages?timestamp=0", "body": {...}}, ...]}.
+    Подзапросы выполняются по порядку через обычные маршруты с общими
+    cookie и заголовками исходного запроса и на одном соединении-читателе.
+    Ответ: {"responses": [{"id": ..., "status": 200, "body": ...}, ...]}.
+    """
+    methods = ('POST',)
+
+    def response(self, environ, start_response):
+        # routes импортирует views, поэтому таблица маршрутов берётся здесь
+        from routes import match_route
+
+        try:
+            request = Request(environ)
+            if request.method != 'POST':
+                return json_response(
+                    {'error': 'Method not allowed'},
+                    start_response,
+                    '405 Method Not Allowed'
+                )
+
+            try:
+                sub_requests = json.loads(request.body.decode('utf-8'))['requests']
+            except (ValueError, KeyError, TypeError):
+                return json_response(
+                    {'error': 'Invalid batch'},
+                    start_response,
+                    '400 Bad Request'
+                )
+            if not isinstance(sub_requests, list) or len(sub_requests) > BATCH_MAX_REQUESTS:
+                return json_response(
+                    {'error': f'Batch must be a list of at most {BATCH_MAX_REQUESTS} requests'},
+                    start_response,
+                    '400 Bad Request'
+                )
+
+            # Разбираем cookie один раз: webob кэширует результат в environ,
+            # и копии environ подзапросов получают его готовым
+            dict(request.cookies)
+
+            set_cookies = []
+            responses = []
+            # Чтения всех подзапросов идут через одно соединение из пула
+            with get_db_connection(readonly=True):
+                for sub in sub_requests:
+                    responses.append(
+                        self._run(environ, sub, match_route, set_cookies)
+                    )
+
+            headers = [
+                ('Content-Type', 'application/json'),
+                ('Access-Control-Allow-Origin', 'http://localhost:8000'),
+                ('Access-Control-Allow-Credentials', 'true')
+            ] + set_cookies
+            start_response('200 OK', headers)
+            return [json.dumps({'responses': responses}).encode('utf-8')]
+
+        except Exception as e:
+            logging.error(f"Batch error: {str(e)}", exc_info=True)
+            return json_response(
+                {'error': 'Internal server error'},
+                start_response,
+                '500 Internal Server Error'
+            )
+
+    def _run(self, environ, sub, match_route, set_cookies):
+        """
+        Выполняет один подзапрос и возвращает его результат для конверта.
+        """
+        sub_id = sub.get('id') if isinstance(sub, dict) else None
+        method = str(sub.get('method', 'GET')).upper() if isinstance(sub, dict) else None
+        path = sub.get('path') if isinstance(sub, dict) else None
+        if method not in BATCH_METHODS or not isinstance(path, str) or not path.startswith('/'):
+            return {'id': sub_id, 'status': 400, 'body': {'error': 'Invalid sub-request'}}
+
+        parts = urlsplit(path)
+        view_class, url_params = match_route(parts.path)
+        # Вложенный пакет и потоковые ответы в пакете не выполняются
+        if view_class is None or view_class is BatchView or getattr(view_class, 'streaming', False):
+            return {'id': sub_id, 'status': 404, 'body': {'error': 'Not found'}}
+        if view_class.methods is not None and method not in view_class.methods:
+            return {'id': sub_id, 'status': 405, 'body': {'error': 'Method Not Allowed'}}
+
+        body = b''
+        if sub.get('body') is not None:
+            body = json.dumps(sub['body']).encode('utf-8')
+
+        sub_environ = dict(environ)
+        sub_environ.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': parts.path,
+            'QUERY_STRING': parts.query,
+            'REQUEST_URI': path,
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+            'url_params': url_params,
+        })
+        # webob хранит разобранное тело и GET-параметры в environ - их копировать нельзя
+        for key in list(sub_environ):
+            if key.startswith('webob.') and key != 'webob._parsed_cookies':
+                del sub_environ[key]
+
+        captured = {}
+
+        def start_response(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+
+        try:
+            data = b''.join(view_class(parts.path).response(sub_environ, start_response))
+        except Exception as e:
+            logging.error(f"Batch sub-request {path} error: {str(e)}", exc_info=True)
+            return {'id': sub_id, 'status': 500, 'body': {'error': 'Internal server error'}}
+
+        headers = captured.get('headers', [])
+        set_cookies.extend(h for h in headers if h[0].lower() == 'set-cookie')
+        content_type = next((v for k, v in headers if k.lower() == 'content-type'), '')
+        if content_type.startswith('application/json'):
+            result = json.loads(data.decode('utf-8'))
+        else:
+            result = data.decode('utf-8', errors='replace')
+
+        return {
+            'id': sub_id,
+            'status': int(captured.get('status', '500').split()[0]),
+            'body': result
+        }
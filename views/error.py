@@ -1,45 +1,32 @@
 from utils import *
 from .base import TemplateView
+from .template_cache import serve_template
+
+
+class ErrorView(TemplateView):
+    """
+    Страница ошибки из кеша шаблонов; если файла шаблона нет, отдаётся
+    встроенный текст fallback.
+    """
+    status = ''
+    fallback = b''
 
-class NotFoundView(TemplateView):
-    template = 'templates/404.html'
-    
     def response(self, environ, start_response):
-        headers = [('Content-type', 'text/html')]
-        try:
-            with open(self.template, 'r', encoding='utf-8') as file:
-                data = file.read()
-            start_response('404 Not Found', headers)
-            return [data.encode('utf-8')]
-        except FileNotFoundError:
-            start_response('404 Not Found', headers)
-            return [b'<h1>404 Not Found</h1><p>Page not found</p>']
+        return serve_template(environ, start_response, self.template, self.status, self.fallback)
+
+
+class NotFoundView(ErrorView):
+    template = 'templates/404.html'
+    status = '404 Not Found'
+    fallback = b'<h1>404 Not Found</h1><p>Page not found</p>'
         
 
-class ForbiddenView(TemplateView):
+class ForbiddenView(ErrorView):
     template = 'templates/403.html'
-    
-    def response(self, environ, start_response):
-        headers = [('Content-type', 'text/html')]
-        try:
-            with open(self.template, 'r', encoding='utf-8') as file:
-                data = file.read()
-            start_response('403 Forbidden', headers)
-            return [data.encode('utf-8')]
-        except FileNotFoundError:
-            start_response('403 Forbidden', headers)
-            return [b'<h1>403 Forbidden</h1><p>Access denied</p>']
+    status = '403 Forbidden'
+    fallback = b'<h1>403 Forbidden</h1><p>Access denied</p>'
 
-class InternalServerErrorView(TemplateView):
+class InternalServerErrorView(ErrorView):
     template = 'templates/500.html'
-    
-    def response(self, environ, start_response):
-        headers = [('Content-type', 'text/html')]
-        try:
-            with open(self.template, 'r', encoding='utf-8') as file:
-                data = file.read()
-            start_response('500 Internal Server Error', headers)
-            return [data.encode('utf-8')]
-        except FileNotFoundError:
-            start_response('500 Internal Server Error', headers)
-            return [b'<h1>500 Internal Server Error</h1><p>Server error occurred</p>']
+    status = '500 Internal Server Error'
+    fallback = b'<h1>500 Internal Server Error</h1><p>Server error occurred</p>'
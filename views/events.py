@@ -0,0 +1,104 @@
+import os
+import time
+import logging
+
+from webob import Request
+from utils import *
+from .base import View, json_response, forbidden_response
+from models.GroupModel import *
+
+# Пустой комментарий раз в EVENTS_HEARTBEAT секунд держит соединение
+# и позволяет заметить отключившегося клиента
+EVENTS_HEARTBEAT = 15
+# Поток закрывается через EVENTS_LIFETIME секунд и при изменении состава
+# групп пользователя; браузер переподключается сам, и подписка получает
+# актуальный список групп
+EVENTS_LIFETIME = int(os.environ.get('MESSENGER_SSE_LIFETIME', 300))
+EVENTS_RETRY_MS = 3000
+
+
+class EventsView(View):
+    """
+    Поток Server-Sent Events с изменениями сообщений общего чата,
+    групп пользователя и его личных чатов.
+
+    События: message (op: insert/edit/delete, chat, id, text для правок)
+    и resync (клиент не успевал читать - состояние чата догоняется через /sync).
+    """
+    methods = ('GET',)
+    streaming = True
+
+    def event_keys(self, environ):
+        """
+        Ключи чатов, на события которых подписывается пользователь,
+        или None, если пользователь не вошёл.
+        """
+        try:
+            user_id = int(Request(environ).cookies.get('user_id'))
+        except (TypeError, ValueError):
+            return None
+        return ['g:0', f'u:{user_id}'] + [
+            f'g:{group_id}' for group_id in sorted(GroupModel.get_user_group_ids(user_id))
+        ]
+
+    def response(self, environ, start_response):
+        try:
+            keys = self.event_keys(environ)
+            if keys is None:
+                return forbidden_response(start_response)
+
+            subscription = subscribe_events(keys)
+            if subscription is None:
+                start_response('503 Service Unavailable', [
+                    ('Content-Type', 'application/json'),
+                    ('Retry-After', '30')
+                ])
+                return [b'{"error": "Too many event streams"}']
+
+            start_response('200 OK', [
+                ('Content-Type', 'text/event-stream; charset=utf-8'),
+                ('Cache-Control', 'no-cache'),
+                ('X-Accel-Buffering', 'no')
+            ])
+            return EventStream(subscription)
+
+        except Exception as e:
+            logging.error(f"Events error: {str(e)}", exc_info=True)
+            return json_response(
+                {'error': 'Internal server error'},
+                start_response,
+                '500 Internal Server Error'
+            )
+
+
+class EventStream:
+    """
+    Тело ответа /events. Сервер вызывает close() по завершении ответа
+    или при отключении клиента, даже если поток ещё не начинал читаться,
+    и подписка освобождается.
+    """
+    def __init__(self, subscription):
+        self.subscription = subscription
+        self.deadline = time.monotonic() + EVENTS_LIFETIME
+        self.started = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.started:
+            self.started = True
+            return f'retry: {EVENTS_RETRY_MS}\nevent: ready\ndata: {{}}\n\n'.encode('utf-8')
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0 or self.subscription.closed:
+            raise StopIteration
+        frame = self.subscription.get(min(EVENTS_HEARTBEAT, remaining))
+        if frame is None:
+            if self.subscription.ended:
+                # Состав групп изменился: клиент переподключится с новыми ключами
+                raise StopIteration
+            return b': ping\n\n'
+        return frame
+
+    def close(self):
+        self.subscription.close()
@@ -33,6 +33,8 @@ def check_group_permissions(cursor, user_id, group_id, required_role=None):
 
 
 class GetGroupMembersView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         request = Request(environ)
         user_id = request.cookies.get('user_id')
@@ -54,6 +56,8 @@ class GetGroupMembersView(View):
         return json_response({'members': members}, start_response)
 
 class LeaveGroupView(View):
+    methods = ('POST',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -100,6 +104,8 @@ class LeaveGroupView(View):
             )
 
 class CreateGroupView(View):
+    methods = ('POST',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -132,6 +138,8 @@ class CreateGroupView(View):
             )
 
 class AddToGroupView(View):
+    methods = ('POST',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -211,6 +219,8 @@ class AddToGroupView(View):
             )
                                     
 class GetGroupsView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         request = Request(environ)
         user_id = request.cookies.get('user_id')
@@ -221,6 +231,8 @@ class GetGroupsView(View):
         return json_response(groups, start_response)
 
 class CheckGroupAccessView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -234,21 +246,19 @@ class CheckGroupAccessView(View):
                     '401 Unauthorized'
                 )
             
-            with get_db_cursor() as cursor:
-                cursor.execute('''
-                    SELECT 1 FROM group_members 
-                    WHERE group_id = ? AND user_id = ?
-                ''', (group_id, user_id))
-                
-                has_access = cursor.fetchone() is not None
-                
-                cursor.execute('SELECT 1 FROM groups WHERE group_id = ?', (group_id,))
-                group_exists = cursor.fetchone() is not None
-                
-                return json_response({
-                    'has_access': has_access,
-                    'group_exists': group_exists
-                }, start_response)
+            has_access = GroupModel.check_group_access(group_id, user_id)
+            # Участник есть только у существующей группы: база
+            # читается лишь при отказе в доступе
+            group_exists = has_access
+            if not has_access:
+                with get_read_cursor() as cursor:
+                    cursor.execute('SELECT 1 FROM groups WHERE group_id = ?', (group_id,))
+                    group_exists = cursor.fetchone() is not None
+            
+            return json_response({
+                'has_access': has_access,
+                'group_exists': group_exists
+            }, start_response)
                 
         except Exception as e:
             logging.error(f"CheckGroupAccess error: {str(e)}")
@@ -259,16 +269,18 @@ class CheckGroupAccessView(View):
             )
             
 class GetGroupNameView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         group_id = Request(environ).GET.get('group_id')
-        conn = sqlite3.connect('data.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT name FROM groups WHERE group_id = ?', (group_id,))
-        group_name = cursor.fetchone()
-        conn.close()
+        with get_read_cursor() as cursor:
+            cursor.execute('SELECT name FROM groups WHERE group_id = ?', (group_id,))
+            group_name = cursor.fetchone()
         return json_response({'name': group_name[0]}, start_response)
     
 class CheckGroupsUpdatesView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -278,7 +290,7 @@ class CheckGroupsUpdatesView(View):
 
             last_check = int(request.GET.get('last_check', 0))
             
-            with get_db_cursor() as cursor:
+            with get_read_cursor() as cursor:
                 # Проверяем изменения в членстве в группах
                 cursor.execute('''
                     SELECT 1 FROM group_members 
@@ -317,6 +329,8 @@ class CheckGroupsUpdatesView(View):
             return json_response({'updated': False}, start_response)
 
 class RenameGroupView(View):
+    methods = ('POST',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -374,6 +388,8 @@ class RenameGroupView(View):
             )
         
 class RemoveFromGroupView(View):
+    methods = ('POST',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -1,6 +1,5 @@
 from collections import namedtuple
 import json
-import time
 import os 
 import base64
 import logging
@@ -8,24 +7,95 @@ import logging
 from urllib.parse import parse_qs
 from webob import Request, Response
 from utils import *
+from utils.notify import LONGPOLL_MAX_WAIT
 from .base import View, json_response, forbidden_response
 from models.MessageModel import *
+from models.blob_store import blob_store
 from models.UserModel import *
+from models.GroupModel import *
 from models.session import *
 
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad
+from Crypto.Random import get_random_bytes
+
+
+def encrypt_messages(key, messages):
+    """
+    Шифрует пачку сообщений одной операцией AES-GCM ключом сессии.
+    Nonce случайный для каждого ответа; data - шифртекст JSON-массива
+    сообщений с тегом аутентификации в конце (формат WebCrypto).
+    """
+    nonce = get_random_bytes(12)
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    data, tag = cipher.encrypt_and_digest(
+        json.dumps(messages, ensure_ascii=False).encode('utf-8')
+    )
+    return {
+        'alg': 'AES-GCM',
+        'nonce': base64.b64encode(nonce).decode('ascii'),
+        'data': base64.b64encode(data + tag).decode('ascii'),
+    }
+
+
+def parse_wait(value):
+    """
+    Разбирает параметр долгого опроса wait (секунды ожидания).
+    """
+    try:
+        wait = int(value or 0)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid wait format")
+    return max(0, min(wait, LONGPOLL_MAX_WAIT))
+
+
+def long_poll(fetch, chats, wait):
+    """
+    Выполняет fetch(); если результат пуст и задан wait, ждёт изменения
+    чатов до wait секунд и повторяет fetch() один раз.
+
+    Счётчики изменений берутся до первого чтения, поэтому сообщение,
+    появившееся между чтением и ожиданием, будит запрос сразу.
+    """
+    versions = chat_version(*chats)
+    result = fetch()
+    if not result and wait and wait_for_chats(chats, versions, wait):
+        result = fetch()
+    return result
+
+
+def wait_chats(chat, user_id):
+    """
+    Ключи ожидания для открытого чата: сам чат и личные сообщения пользователя.
+    """
+    try:
+        return (chat, f'u:{int(user_id)}')
+    except (ValueError, TypeError):
+        return (chat,)
 
 
 class GetMessageView(View):
+    methods = ('GET',)
+
+    def long_poll_chats(self, environ):
+        """
+        Ключи, изменения которых будят долгий опрос этого запроса.
+        """
+        return wait_chats('g:0', Request(environ).cookies.get('user_id'))
+
     def response(self, environ, start_response):
         try:
             # Парсинг и валидация параметров
             query_params = parse_qs(environ.get('QUERY_STRING', ''))
             timestamp = self._parse_timestamp(query_params)
+            wait = parse_wait(query_params.get('wait', ['0'])[0])
             
-            # Получаем сообщения из модели
-            messages = MessageModel.get_general_messages(timestamp)
+            # Получаем сообщения из модели; с wait ждём новых до wait секунд
+            messages = long_poll(
+                lambda: MessageModel.get_general_messages(timestamp),
+                self.long_poll_chats(environ),
+                wait
+            )
                 
             return json_response({
                 'messages': messages,
@@ -54,7 +124,10 @@ class GetMessageView(View):
         return old_timestamp
 
 class SendMessageView(View):
+    methods = ('POST',)
+
     def response(self, environ, start_response):
+        uploads = []
         try:
             request = Request(environ)
             if request.method != 'POST':
@@ -73,8 +146,19 @@ class SendMessageView(View):
                 group_id = post_data.get('group_id')
                 receiver = post_data.get('receiver')
             elif request.content_type and request.content_type.startswith('multipart/form-data'):
-                post_data = request.POST
-                files = request.POST.getall('files')
+                # Файлы пишутся на диск по мере чтения тела, а не через request.POST
+                os.makedirs(blob_store.temp_dir, exist_ok=True)
+                try:
+                    post_data, uploads = parse_multipart(environ, blob_store.temp_dir)
+                except UploadTooLarge:
+                    return json_response(
+                        {'error': 'Файл слишком большой'},
+                        start_response,
+                        '413 Payload Too Large'
+                    )
+                except MultipartError as e:
+                    return json_response({'error': str(e)}, start_response, '400 Bad Request')
+                files = [upload for upload in uploads if upload.name == 'files']
                 message = post_data.get('message', '').strip()
                 group_id = post_data.get('group_id')
                 receiver = post_data.get('receiver')
@@ -100,16 +184,13 @@ class SendMessageView(View):
             # Для приватных сообщений получаем ID получателя
             receiver_id = None
             if message_type == 'private':
-                with get_db_cursor() as cursor:
-                    cursor.execute('SELECT id FROM users WHERE username = ?', (receiver,))
-                    receiver_user = cursor.fetchone()
-                    if not receiver_user:
-                        return json_response(
-                            {'error': 'User not found'}, 
-                            start_response, 
-                            '404 Not Found'
-                        )
-                    receiver_id = receiver_user[0]
+                receiver_id = UserModel.get_user_id(receiver)
+                if not receiver_id:
+                    return json_response(
+                        {'error': 'User not found'}, 
+                        start_response, 
+                        '404 Not Found'
+                    )
 
             # Создаем сообщение в базе данных
             message_id = MessageModel.create_message(
@@ -117,7 +198,10 @@ class SendMessageView(View):
                 user_id=user_id,
                 message_text=message,
                 group_id=group_id,
-                receiver_id=receiver_id
+                receiver_id=receiver_id,
+                # Событие публикуется после вложений: клиент, прочитавший
+                # сообщение по событию, сразу получает и его файлы
+                publish=not files
             )
             
             if not message_id:
@@ -126,21 +210,28 @@ class SendMessageView(View):
             # Обрабатываем файлы (только для multipart)
             if files:
                 unique_files = set()
-                upload_folder = os.path.join('static', 'uploads')
-                os.makedirs(upload_folder, exist_ok=True)
                 
-                for file in files:
-                    if file.filename and file.file:
-                        file_info = MessageModel.save_uploaded_file(file, upload_folder)
-                        if file_info and file_info['path'] not in unique_files:
-                            unique_files.add(file_info['path'])
-                            MessageModel.add_attachment(
-                                message_type='group' if message_type == 'general' else message_type,
-                                message_id=message_id,
-                                file_path=file_info['path'],
-                                mime_type=file_info['mime_type'],
-                                filename=file_info['filename']
-                            )
+                try:
+                    for file in files:
+                        if file.filename:
+                            file_info = MessageModel.save_uploaded_file(file)
+                            if file_info and file_info['path'] not in unique_files:
+                                unique_files.add(file_info['path'])
+                                MessageModel.add_attachment(
+                                    message_type='group' if message_type == 'general' else message_type,
+                                    message_id=message_id,
+                                    file_path=file_info['path'],
+                                    mime_type=file_info['mime_type'],
+                                    filename=file_info['filename'],
+                                    blob_hash=file_info['blob_hash']
+                                )
+                finally:
+                    # Сообщение уже сохранено, поэтому событие публикуется и при ошибке вложения
+                    MessageModel.publish_change(
+                        'insert', message_type, user_id,
+                        receiver_id if message_type == 'private' else group_id,
+                        message_id
+                    )
 
             return json_response({'status': 'success', 'message_id': message_id}, start_response)
 
@@ -151,8 +242,14 @@ class SendMessageView(View):
                 start_response, 
                 '500 Internal Server Error'
             )
+        finally:
+            # Временные файлы, не перенесённые в папку загрузок
+            for upload in uploads:
+                upload.discard()
           
 class DeleteMessageView(View):
+    methods = ('DELETE',)
+
     def get_user_id(self, environ):
         request = Request(environ)
         try:
@@ -198,6 +295,8 @@ class DeleteMessageView(View):
             )
         
 class EditMessageView(View):
+    methods = ('PUT', 'PATCH')
+
     def get_user_id(self, environ):
         request = Request(environ)
         try:
@@ -255,6 +354,19 @@ class EditMessageView(View):
             )
 
 class GetGroupMessagesView(View):
+    methods = ('GET',)
+
+    def long_poll_chats(self, environ):
+        """
+        Ключи, изменения которых будят долгий опрос этого запроса.
+        """
+        request = Request(environ)
+        try:
+            group_id = int(request.GET.get('group_id'))
+        except (TypeError, ValueError):
+            return None
+        return wait_chats(f'g:{group_id}', request.cookies.get('user_id'))
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -288,8 +400,17 @@ class GetGroupMessagesView(View):
             if not user_id:
                 return forbidden_response(start_response)
 
-            # Получаем сообщения из модели
-            messages = MessageModel.get_group_messages(group_id, timestamp)
+            try:
+                wait = parse_wait(request.GET.get('wait'))
+            except ValueError as e:
+                return json_response({'error': str(e)}, start_response, '400 Bad Request')
+
+            # Получаем сообщения из модели; с wait ждём новых до wait секунд
+            messages = long_poll(
+                lambda: MessageModel.get_group_messages(group_id, timestamp),
+                self.long_poll_chats(environ),
+                wait
+            )
                 
             return json_response({
                 'messages': messages,
@@ -305,6 +426,8 @@ class GetGroupMessagesView(View):
             )
 
 class GetPrivateMessagesView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -328,17 +451,13 @@ class GetPrivateMessagesView(View):
                 )
 
             # Получаем ID собеседника через UserModel
-            with get_db_cursor() as cursor:
-                cursor.execute('SELECT id FROM users WHERE username = ?', (other_user,))
-                result = cursor.fetchone()
-                if not result:
-                    return json_response(
-                        {'error': 'User not found'}, 
-                        start_response, 
-                        '404 Not Found'
-                    )
-                
-                other_user_id = result[0]
+            other_user_id = UserModel.get_user_id(other_user)
+            if not other_user_id:
+                return json_response(
+                    {'error': 'User not found'}, 
+                    start_response, 
+                    '404 Not Found'
+                )
                 
             messages = MessageModel.get_private_messages(
                 user_id=user_id,
@@ -346,16 +465,27 @@ class GetPrivateMessagesView(View):
                 timestamp=timestamp
             )
 
-            key = bytes(get_key(session_id))
-            #print('key', key)
+            key = get_key(session_id)
+            if key is None:
+                return json_response(
+                    {'error': 'Session expired'},
+                    start_response,
+                    '401 Unauthorized'
+                )
+            new_timestamp = max([msg['timestamp'] for msg in messages]) if messages else timestamp
+
+            if request.GET.get('enc') == 'gcm':
+                # Вся пачка шифруется один раз
+                return json_response({
+                    'encrypted': encrypt_messages(key, messages),
+                    'timestamp': new_timestamp
+                }, start_response)
+
+            # Прежний формат: каждый текст отдельно в режиме ECB
             cipher = AES.new(key, AES.MODE_ECB)
             for i in range(len(messages)):
                 msg = messages[i]['message_text']
-                #print('msg', msg)
                 messages[i]['message_text'] = base64.b64encode(cipher.encrypt(pad(msg.encode('utf-8'), AES.block_size))).decode('utf8')
-                #print('res', messages[i])
-            
-            new_timestamp = max([msg['timestamp'] for msg in messages]) if messages else timestamp
             
             return json_response({
                 'messages': messages,
@@ -371,6 +501,8 @@ class GetPrivateMessagesView(View):
             )
 
 class SendPrivateMessageView(View):
+    methods = ('POST',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -423,6 +555,8 @@ class SendPrivateMessageView(View):
             )
 
 class SendSystemMessageView(View):
+    methods = ('POST',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -430,14 +564,16 @@ class SendSystemMessageView(View):
             
             if data['type'] == 'group_leave':
                 message_text = f"Пользователь {data['username']} покинул группу"                
-                with get_db_cursor() as cursor:
-                    cursor.execute('''
-                        INSERT INTO group_messages 
-                        (group_id, user_id, message_text, timestamp)
-                        VALUES (?, 0, ?, ?)
-                    ''', (data['group_id'], message_text, int(time.time())))
-                    
-                    cursor.connection.commit()
+                # Через create_message: после фиксации сообщение попадает в буфер
+                # чата и публикуется в шину (долгие опросы, /events, другие процессы)
+                message_id = MessageModel.create_message(
+                    message_type='group',
+                    user_id=0,
+                    message_text=message_text,
+                    group_id=data['group_id']
+                )
+                if not message_id:
+                    raise Exception("Failed to create message")
                     
             return json_response({'status': 'success'}, start_response)
             
@@ -445,6 +581,8 @@ class SendSystemMessageView(View):
             return json_response({'error': str(e)}, start_response, '500 Internal Server Error')
             
 class CheckMessagesView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -455,7 +593,7 @@ class CheckMessagesView(View):
             if not message_ids or not message_ids[0]:
                 return json_response({'existingIds': []}, start_response)
 
-            with get_db_cursor() as cursor:
+            with get_read_cursor() as cursor:
                 if message_type == 'group':
                     chat_id = query.get('chat_id', [None])[0]
                     cursor.execute('''
@@ -468,9 +606,8 @@ class CheckMessagesView(View):
                     # Для приватных чатов нужно проверить оба направления
                     user_id = request.cookies.get('user_id')
                     chat_id = query.get('chat_id', [None])[0]
-                    cursor.execute('SELECT id FROM users WHERE username = ?', (chat_id,))
-                    partner = cursor.fetchone()
-                    if not partner:
+                    partner_id = UserModel.get_user_id(chat_id)
+                    if not partner_id:
                         return json_response({'existingIds': []}, start_response)
                     
                     cursor.execute('''
@@ -481,7 +618,7 @@ class CheckMessagesView(View):
                             (sender_id = ? AND receiver_id = ?)
                         ) AND id IN (%s)
                     ''' % ','.join('?'*len(message_ids)), 
-                    [user_id, partner[0], partner[0], user_id] + message_ids)
+                    [user_id, partner_id, partner_id, user_id] + message_ids)
                 else:
                     cursor.execute('''
                         SELECT message_id 
@@ -498,6 +635,8 @@ class CheckMessagesView(View):
             return json_response({'existingIds': []}, start_response)
         
 class CheckEditedMessagesView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -505,7 +644,7 @@ class CheckEditedMessagesView(View):
             message_type = query.get('type', ['general'])[0]
             last_timestamp = int(query.get('last_timestamp', [0])[0])
             
-            with get_db_cursor() as cursor:
+            with get_read_cursor() as cursor:
                 if message_type == 'group':
                     chat_id = query.get('chat_id', [None])[0]
                     cursor.execute('''
@@ -521,9 +660,8 @@ class CheckEditedMessagesView(View):
                 elif message_type == 'private':
                     user_id = request.cookies.get('user_id')
                     chat_id = query.get('chat_id', [None])[0]
-                    cursor.execute('SELECT id FROM users WHERE username = ?', (chat_id,))
-                    partner = cursor.fetchone()
-                    if not partner:
+                    partner_id = UserModel.get_user_id(chat_id)
+                    if not partner_id:
                         return json_response({'editedMessages': []}, start_response)
                     
                     cursor.execute('''
@@ -538,7 +676,7 @@ class CheckEditedMessagesView(View):
                         )
                         AND pm.timestamp > ?
                         ORDER BY pm.timestamp DESC
-                    ''', [user_id, partner[0], partner[0], user_id, last_timestamp])
+                    ''', [user_id, partner_id, partner_id, user_id, last_timestamp])
                 else:
                     cursor.execute('''
                         SELECT 
@@ -562,3 +700,72 @@ class CheckEditedMessagesView(View):
         except Exception as e:
             logging.error(f"CheckEditedMessages error: {str(e)}")
             return json_response({'editedMessages': []}, start_response)
+
+
+class SyncMessagesView(View):
+    """
+    Инкрементальная синхронизация чата по журналу изменений.
+
+    Клиент передаёт курсор из предыдущего ответа и получает только
+    добавленные, изменённые и удалённые после него сообщения.
+    Запрос без курсора возвращает текущую позицию журнала.
+    """
+    methods = ('GET',)
+
+    def response(self, environ, start_response):
+        try:
+            request = Request(environ)
+            user_id = request.cookies.get('user_id')
+            if not user_id:
+                return forbidden_response(start_response)
+
+            message_type = request.GET.get('type', 'general')
+            chat_id = request.GET.get('chat_id')
+            try:
+                cursor_param = request.GET.get('cursor')
+                cursor_seq = int(cursor_param) if cursor_param else None
+                user_id = int(user_id)
+            except ValueError:
+                return json_response(
+                    {'error': 'Invalid cursor'},
+                    start_response,
+                    '400 Bad Request'
+                )
+
+            if message_type == 'group':
+                try:
+                    chat_id = int(chat_id)
+                except (TypeError, ValueError):
+                    return json_response(
+                        {'error': 'Invalid group ID format'},
+                        start_response,
+                        '400 Bad Request'
+                    )
+                if not GroupModel.check_group_access(chat_id, user_id):
+                    return forbidden_response(start_response)
+            elif message_type == 'private':
+                chat_id = UserModel.get_user_id(chat_id) if chat_id else None
+                if not chat_id:
+                    return json_response(
+                        {'error': 'User not found'},
+                        start_response,
+                        '404 Not Found'
+                    )
+            elif message_type != 'general':
+                return json_response(
+                    {'error': 'Invalid message type'},
+                    start_response,
+                    '400 Bad Request'
+                )
+
+            chat = MessageModel.chat_key(message_type, user_id, chat_id)
+            changes = MessageModel.get_changes(message_type, chat, cursor_seq)
+            return json_response(changes, start_response)
+
+        except Exception as e:
+            logging.error(f"SyncMessages error: {str(e)}", exc_info=True)
+            return json_response(
+                {'error': 'Internal server error'},
+                start_response,
+                '500 Internal Server Error'
+            )
@@ -15,6 +15,8 @@ from .base import View, json_response, forbidden_response
 
 
 class GetPrivateChatsView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -34,6 +36,8 @@ class GetPrivateChatsView(View):
             )
         
 class CheckPrivateChatsUpdatesView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -41,7 +45,7 @@ class CheckPrivateChatsUpdatesView(View):
             if not user_id:
                 return json_response({'updated': False}, start_response)
 
-            with get_db_cursor() as cursor:
+            with get_read_cursor() as cursor:
                 # Получаем timestamp последнего сообщения в приватных чатах
                 cursor.execute('''
                     SELECT MAX(timestamp) FROM (
@@ -10,12 +10,14 @@ from models.MessageModel import *
 from models.UserModel import *
 
 class SearchUsersView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
             search_term = request.GET.get('q', '')
             
-            with get_db_cursor() as cursor:
+            with get_read_cursor() as cursor:
                 cursor.execute('''
                     SELECT username FROM users 
                     WHERE username LIKE ? 
@@ -30,6 +32,8 @@ class SearchUsersView(View):
             return json_response({'error': str(e)}, start_response, '500 Internal Server Error')
         
 class SearchMessagesView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -60,6 +64,20 @@ class SearchMessagesView(View):
             sort = query_params.get('sort', ['date'])[0]
             if sort not in ['date', 'relevance']:
                 sort = 'date'
+
+            # Курсор keyset-пагинации: before=<timestamp>,<id>
+            before = None
+            before_param = query_params.get('before', [''])[0]
+            if before_param:
+                try:
+                    before_ts, before_id = before_param.split(',')
+                    before = (int(before_ts), int(before_id))
+                except ValueError:
+                    return json_response(
+                        {'error': 'Invalid cursor'}, 
+                        start_response, 
+                        '400 Bad Request'
+                    )
             
             user_id = request.cookies.get('user_id')
             if not user_id:
@@ -92,7 +110,8 @@ class SearchMessagesView(View):
                 user_id=user_id,
                 page=page,
                 per_page=per_page,
-                sort=sort
+                sort=sort,
+                before=before
             )
             
             # Формируем контекст для UI
@@ -100,17 +119,21 @@ class SearchMessagesView(View):
             if message_type == 'private' and chat_id:
                 context = f"в переписке с {chat_id}"
             elif message_type == 'group' and chat_id:
-                with get_db_cursor() as cursor:
+                with get_read_cursor() as cursor:
                     cursor.execute("SELECT name FROM groups WHERE group_id = ?", (chat_id,))
                     group_name = cursor.fetchone()
                     context = f"в группе '{group_name[0]}'" if group_name else "в группе"
             
+            next_before = result.get('next_before')
             return json_response({
                 'messages': result['messages'],
                 'total': result['total'],
+                'total_exact': result.get('total_exact', True),
+                'total_display': str(result['total']) if result.get('total_exact', True) else f"{result['total']}+",
                 'page': result['page'],
                 'per_page': result['per_page'],
                 'total_pages': (result['total'] + per_page - 1) // per_page,
+                'next_before': f"{next_before[0]},{next_before[1]}" if next_before else None,
                 'context': context
             }, start_response)
             
@@ -0,0 +1,324 @@
+import os
+import gzip
+import stat
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from mimes import get_mime
+
+# Сколько байт (файлы вместе со сжатыми вариантами) держит кеш статики
+STATIC_CACHE_SIZE = int(os.environ.get('MESSENGER_STATIC_CACHE_SIZE', 32 * 1024 * 1024))
+# Файлы крупнее этого размера не кешируются и читаются с диска частями
+STATIC_CACHE_MAX_FILE = int(os.environ.get('MESSENGER_STATIC_CACHE_MAX_FILE', 1024 * 1024))
+# max-age для статики; 0 - браузер каждый раз проверяет файл по ETag
+STATIC_MAX_AGE = int(os.environ.get('MESSENGER_STATIC_MAX_AGE', 0))
+STATIC_CHUNK_SIZE = 64 * 1024
+
+# Сжатие выигрывает для текстовых форматов и иконок
+_COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/ico', 'image/svg+xml')
+
+
+class StaticAsset:
+    __slots__ = ('version', 'mime', 'body', 'gzip_body', 'etag', 'gzip_etag',
+                 'last_modified', 'mtime', 'size')
+
+    def __init__(self, version, mime, mtime, body=None):
+        # (mtime_ns, размер) файла, из которого прочитан ресурс
+        self.version = version
+        self.mime = mime
+        self.mtime = int(mtime)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.body = body
+        self.gzip_body = None
+        if body is None:
+            # Файл без кеша: ETag по времени изменения и размеру. Он сильный,
+            # чтобы браузер мог докачивать файл по If-Range
+            self.etag = f'"{version[0]:x}-{version[1]:x}"'
+            self.gzip_etag = None
+            self.size = 0
+            return
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.gzip_etag = None
+        if mime.startswith(_COMPRESSIBLE):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body) * 0.9:
+                self.gzip_body = compressed
+                self.gzip_etag = self.etag[:-1] + '-gzip"'
+        self.size = len(body) + len(self.gzip_body or b'')
+
+
+class StaticCache:
+    """
+    Кеш статических файлов в памяти.
+
+    Ключ - путь файла; перед выдачей проверяются время изменения и размер
+    (os.stat), изменённый файл перечитывается. Вместе с файлом хранятся
+    сильный ETag, Last-Modified и заранее сжатый gzip-вариант. Общий
+    объём ограничен max_bytes, давно не запрашивавшиеся файлы вытесняются.
+    """
+
+    def __init__(self, max_bytes=STATIC_CACHE_SIZE, max_file=STATIC_CACHE_MAX_FILE):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self._lock = threading.Lock()
+        self._assets = OrderedDict()
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'uncached': 0, 'evicted': 0}
+
+    def get(self, file_path):
+        """
+        Возвращает StaticAsset или None, если файла нет.
+        У файлов крупнее max_file body равно None - их нужно читать с диска.
+        """
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            self.discard(file_path)
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        version = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            asset = self._assets.get(file_path)
+            if asset is not None and asset.version == version:
+                self._assets.move_to_end(file_path)
+                self._stats['hits'] += 1
+                return asset
+        mime = get_mime(file_path)
+        if st.st_size > self.max_file:
+            with self._lock:
+                self._stats['uncached'] += 1
+            return StaticAsset(version, mime, st.st_mtime)
+        with open(file_path, 'rb') as f:
+            body = f.read()
+        # Файл могли переписать между stat и чтением - версию берём по прочитанному
+        asset = StaticAsset((st.st_mtime_ns, len(body)), mime, st.st_mtime, body)
+        with self._lock:
+            self._stats['misses'] += 1
+            self._remove(file_path)
+            if asset.size <= self.max_bytes:
+                self._assets[file_path] = asset
+                self._bytes += asset.size
+                while self._bytes > self.max_bytes:
+                    self._remove(next(iter(self._assets)))
+                    self._stats['evicted'] += 1
+        return asset
+
+    def discard(self, file_path):
+        with self._lock:
+            self._remove(file_path)
+
+    def clear(self):
+        with self._lock:
+            self._assets.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['files'] = len(self._assets)
+            stats['bytes'] = self._bytes
+        return stats
+
+    def _remove(self, file_path):
+        asset = self._assets.pop(file_path, None)
+        if asset is not None:
+            self._bytes -= asset.size
+
+
+static_cache = StaticCache()
+
+
+def get_static_cache_stats():
+    """
+    Возвращает метрики кеша статических файлов.
+    """
+    return static_cache.stats()
+
+
+def accepts_gzip(environ):
+    for coding in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            q = params.strip()
+            if q.startswith('q='):
+                try:
+                    return float(q[2:]) > 0
+                except ValueError:
+                    return False
+            return True
+    return False
+
+
+def _not_modified(environ, asset, etag):
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        # Слабое сравнение: подходит ETag любого варианта кодирования
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return bool(tags & {etag.removeprefix('W/'), asset.etag.removeprefix('W/')})
+    if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since:
+        try:
+            return asset.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def file_asset(file_path, mime=None):
+    """
+    StaticAsset без тела для файла, который не кешируется (вложения):
+    только ETag, Last-Modified и размер по os.stat. None, если файла нет.
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return StaticAsset((st.st_mtime_ns, st.st_size), mime or get_mime(file_path), st.st_mtime)
+
+
+def _byte_range(environ, asset, size):
+    """
+    Разбирает заголовок Range. Возвращает (первый, последний байт),
+    None - отдать файл целиком, False - диапазон за пределами файла.
+    Поддерживается один диапазон; на несколько отдаётся весь файл.
+    """
+    header = environ.get('HTTP_RANGE')
+    if not header:
+        return None
+    if_range = environ.get('HTTP_IF_RANGE')
+    if if_range and if_range.strip() not in (asset.etag, asset.last_modified):
+        # Файл изменился с прошлой загрузки - докачка невозможна
+        return None
+    unit, _, spec = header.partition('=')
+    first, sep, last = spec.strip().partition('-')
+    if unit.strip().lower() != 'bytes' or not sep or ',' in spec:
+        return None
+    if not (first + last).isdigit():
+        return None
+    if not first:
+        # bytes=-N - последние N байт
+        if int(last) == 0:
+            return False
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    return start, min(int(last) if last else size - 1, size - 1)
+
+
+class _FileChunks:
+    """
+    Читает length байт открытого файла частями. close() закрывает файл,
+    даже если чтение не начиналось (например, на запрос HEAD).
+    """
+
+    def __init__(self, f, length):
+        self.f = f
+        self.length = length
+
+    def __iter__(self):
+        try:
+            remaining = self.length
+            while remaining > 0:
+                chunk = self.f.read(min(STATIC_CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        self.f.close()
+
+
+def _file_body(environ, file_path, start, length, size):
+    f = open(file_path, 'rb')
+    try:
+        f.seek(start)
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        # file_wrapper отдаёт файл до конца, поэтому подходит только для
+        # хвоста файла, не изменившегося с момента stat
+        if (file_wrapper is not None and start + length == size
+                and os.fstat(f.fileno()).st_size == size):
+            # Waitress и другие серверы передают такой файл через sendfile
+            return file_wrapper(f, STATIC_CHUNK_SIZE)
+    except BaseException:
+        f.close()
+        raise
+    return _FileChunks(f, length)
+
+
+def serve_file(environ, start_response, file_path, cached=True,
+               cache_control=None, extra_headers=(), mime=None):
+    """
+    Отдаёт файл с ETag, Last-Modified, ответом 304 на условный запрос,
+    gzip-вариантом, если клиент его принимает, и частью файла (206) на
+    запрос с Range. Файлы вне кеша читаются с диска частями или через
+    wsgi.file_wrapper.
+
+    cached=False - файл не кладётся в кеш статики (вложения пользователей);
+    mime задаёт Content-Type такого файла вместо типа по расширению.
+    """
+    asset = static_cache.get(file_path) if cached else file_asset(file_path, mime)
+    if asset is None:
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'File not found']
+
+    size = asset.version[1]
+    byte_range = _byte_range(environ, asset, size)
+    # Диапазоны считаются по несжатому файлу
+    use_gzip = byte_range is None and asset.gzip_body is not None and accepts_gzip(environ)
+    etag = asset.gzip_etag if use_gzip else asset.etag
+    if cache_control is None:
+        cache_control = f'public, max-age={STATIC_MAX_AGE}' if STATIC_MAX_AGE else 'no-cache'
+    headers = [
+        ('ETag', etag),
+        ('Last-Modified', asset.last_modified),
+        ('Cache-Control', cache_control),
+        ('Accept-Ranges', 'bytes'),
+    ]
+    if asset.gzip_body is not None:
+        headers.append(('Vary', 'Accept-Encoding'))
+    headers.extend(extra_headers)
+
+    if _not_modified(environ, asset, etag):
+        start_response('304 Not Modified', headers)
+        return []
+
+    headers.append(('Content-Type', asset.mime))
+    if byte_range is False:
+        headers.append(('Content-Range', f'bytes */{size}'))
+        start_response('416 Range Not Satisfiable', headers)
+        return []
+
+    status = '200 OK'
+    start, end = 0, size - 1
+    if byte_range is not None:
+        start, end = byte_range
+        status = '206 Partial Content'
+        headers.append(('Content-Range', f'bytes {start}-{end}/{size}'))
+    length = end - start + 1
+
+    if use_gzip:
+        headers.append(('Content-Encoding', 'gzip'))
+        body = [asset.gzip_body]
+        length = len(asset.gzip_body)
+    elif asset.body is None:
+        body = _file_body(environ, file_path, start, length, size)
+    elif byte_range is None:
+        body = [asset.body]
+    else:
+        body = [asset.body[start:end + 1]]
+    headers.append(('Content-Length', str(length)))
+    start_response(status, headers)
+    return body
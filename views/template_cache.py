@@ -0,0 +1,121 @@
+import os
+import gzip
+import threading
+
+from mimes import get_mime
+from .static_cache import accepts_gzip
+
+# Перечитывать шаблон при изменении файла (удобно при разработке);
+# по умолчанию шаблон читается с диска один раз за время работы процесса
+TEMPLATE_RELOAD = os.environ.get('MESSENGER_TEMPLATE_RELOAD', '0') == '1'
+
+
+class Template:
+    __slots__ = ('version', 'mime', 'body', 'gzip_body')
+
+    def __init__(self, version, mime, body):
+        # (mtime_ns, размер) прочитанного файла
+        self.version = version
+        self.mime = mime
+        self.body = body
+        self.gzip_body = None
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body) * 0.9:
+            self.gzip_body = compressed
+
+
+class TemplateCache:
+    """
+    Кеш HTML-шаблонов и страниц ошибок: закодированные в UTF-8 байты и
+    заранее сжатый gzip-вариант.
+
+    Шаблонов немного, поэтому они не вытесняются. Отсутствующий файл
+    тоже запоминается, и поток запросов к несуществующим адресам не
+    обращается к диску за страницей 404. С reload=True перед выдачей
+    сравниваются время изменения и размер файла, изменённый файл
+    перечитывается.
+    """
+
+    def __init__(self, reload=TEMPLATE_RELOAD):
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._stats = {'hits': 0, 'loads': 0}
+
+    def get(self, file_name):
+        """
+        Возвращает Template или None, если файла нет.
+        """
+        version = None
+        if self.reload:
+            try:
+                st = os.stat(file_name)
+                version = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                pass
+        with self._lock:
+            if file_name in self._templates:
+                template = self._templates[file_name]
+                if not self.reload or (template.version if template else None) == version:
+                    self._stats['hits'] += 1
+                    return template
+        template = self._load(file_name)
+        with self._lock:
+            self._stats['loads'] += 1
+            self._templates[file_name] = template
+        return template
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['templates'] = len(self._templates)
+        return stats
+
+    @staticmethod
+    def _load(file_name):
+        try:
+            with open(file_name, 'r', encoding='utf-8') as file:
+                st = os.fstat(file.fileno())
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        return Template((st.st_mtime_ns, st.st_size), get_mime(file_name), data.encode('utf-8'))
+
+
+template_cache = TemplateCache()
+
+
+def get_template_cache_stats():
+    """
+    Возвращает метрики кеша шаблонов.
+    """
+    return template_cache.stats()
+
+
+def serve_template(environ, start_response, file_name, status='200 OK', fallback=None):
+    """
+    Отдаёт шаблон из кеша с Content-Length и gzip-вариантом, если клиент
+    его принимает. Если файла нет, отдаёт fallback (HTML) или пустой ответ 404.
+    """
+    template = template_cache.get(file_name)
+    if template is None:
+        if fallback is None:
+            start_response('404 Not found', [('Content-Type', get_mime(file_name)), ('Content-Length', '0')])
+            return [b'']
+        start_response(status, [('Content-Type', 'text/html'), ('Content-Length', str(len(fallback)))])
+        return [fallback]
+
+    headers = [('Content-Type', template.mime)]
+    body = template.body
+    if template.gzip_body is not None:
+        headers.append(('Vary', 'Accept-Encoding'))
+        if accepts_gzip(environ):
+            body = template.gzip_body
+            headers.append(('Content-Encoding', 'gzip'))
+    headers.append(('Content-Length', str(len(body))))
+    start_response(status, headers)
+    return [body]
@@ -10,6 +10,8 @@ from .base import View, json_response
 
 
 class GetUserIdView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)
@@ -53,13 +55,17 @@ class GetUserIdView(View):
             )
 
 class GetGeneralMembersView(View):
+    methods = ('GET',)
+
     def response(self, environ, start_response):
-        with get_db_cursor() as cursor:
+        with get_read_cursor() as cursor:
             cursor.execute('SELECT username FROM users')
             members = [row[0] for row in cursor.fetchall()]
             return json_response({'members': members}, start_response)
 
 class ChangeMemberRoleView(View):
+    methods = ('POST',)
+
     def response(self, environ, start_response):
         try:
             request = Request(environ)